@@ -7,3 +7,8 @@ timeout = 3600   # seconds (default is 30)
 errorlog = '-'  # '${INSTALL_DIR}/logs/gunicorn-error.log'
 accesslog = '-' # '${INSTALL_DIR}/logs/gunicorn-access.log'
 #worker_tmp_dir = '/tmp'
+
+# load the app once in the master process rather than in each worker, so that the workers share the reference data
+# loaded with PRELOAD_REFERENCE_DATA. Mongo clients are then also created before the workers are forked - see pymongo's
+# notes on forking before turning this on.
+#preload_app = True
@@ -4,6 +4,8 @@ from deploy.utils.constants import REFERENCE_DATA_FILES
 
 ensembl_rest_host = "beta.rest.ensembl.org"
 ensembl_rest_port = 80
+# optional directory where Ensembl REST responses are cached, so identical requests are only made once
+ensembl_rest_cache_dir = None
 ensembl_db_host = "useastdb.ensembl.org"
 ensembl_db_port = 3306
 ensembl_db_user = "anonymous"
@@ -41,3 +43,6 @@ gtex_expression_file = os.path.join(reference_data_dir, REFERENCE_DATA_FILES['gt
 gtex_samples_file = os.path.join(reference_data_dir, REFERENCE_DATA_FILES['gtex_samples'])
 
 has_phenotype_data = False
+
+# optional file that Reference.load() writes a copy of the reference cache to, for faster startup
+reference_cache_snapshot_path = None
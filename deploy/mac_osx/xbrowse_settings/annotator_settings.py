@@ -8,6 +8,15 @@ xbrowse_install_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".
 vep_perl_path = '%(xbrowse_install_dir)s/variant_effect_predictor/variant_effect_predictor.pl' % locals()
 vep_cache_dir = '%(xbrowse_install_dir)s/vep_cache_dir' % locals()
 vep_batch_size = 50000
+vep_num_processes = 1  # number of VEP batches to run concurrently
+vep_fork = 4  # VEP --fork value for each of these batches
+vep_streaming = False  # pipe variants through VEP's stdin/stdout instead of temp files
+
+# optional read-only snapshot of the db.variants collection, built with ./manage.py build_annotation_store
+annotation_store_path = None
+
+# optional read-only columnar snapshot of the pop_variants collection, built with ./manage.py build_frequency_index
+frequency_index_path = None
 
 reference_populations = [
     {
@@ -6,9 +6,12 @@ from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 
 from reference_data.models import GENOME_VERSION_CHOICES
+from xbrowse.parsers import vcf_index
+
 from seqr.models import Project, Sample, Dataset
 from seqr.utils.file_utils import does_file_exist, file_iter, inputs_older_than_outputs, \
     copy_file
+from seqr.utils.local.local_file_utils import is_local_file_path
 from seqr.views.utils.dataset.dataset_utils import link_dataset_to_sample_records, \
     get_or_create_elasticsearch_dataset
 
@@ -173,6 +176,10 @@ def _validate_vcf(vcf_path, sample_type=None, genome_version=None):
     if not does_file_exist(vcf_path):
         raise ValueError("%(vcf_path)s not found" % locals())
 
+    if is_local_file_path(vcf_path):
+        # the sidecar index has the sample ids, so the VCF header only needs to be read once
+        return vcf_index.get_sample_ids(vcf_path)
+
     for line in file_iter(vcf_path):
         if line.startswith("#CHROM"):
             header_line = line
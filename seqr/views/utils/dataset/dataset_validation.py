@@ -3,8 +3,11 @@ import logging
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 
+from xbrowse.parsers import vcf_index
+
 from seqr.models import Project, Sample, Dataset
 from seqr.utils.file_utils import does_file_exist, file_iter, get_file_stats
+from seqr.utils.local.local_file_utils import is_local_file_path
 from seqr.views.utils.dataset.dataset_utils import get_dataset, get_or_create_elasticsearch_dataset, \
     link_dataset_to_sample_records
 from seqr.views.apis.samples_api import match_sample_ids_to_sample_records
@@ -248,6 +251,10 @@ def _validate_vcf(vcf_path, sample_type=None, genome_version=None):
     if not does_file_exist(vcf_path):
         raise ValueError("%(vcf_path)s not found" % locals())
 
+    if is_local_file_path(vcf_path):
+        # the sidecar index has the sample ids, so the VCF header only needs to be read once
+        return vcf_index.get_sample_ids(vcf_path)
+
     header_line = None
     for i, line in enumerate(file_iter(vcf_path)):
         if line.startswith("#CHROM"):
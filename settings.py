@@ -316,6 +316,12 @@ CLINVAR_TSV = "/dev/null"
 
 VARIANT_QUERY_RESULTS_LIMIT = 5000
 
+# load the reference gene caches when the app starts, rather than on the first requests that need them. With gunicorn's
+# preload_app, this happens once in the master process and the workers share the data copy-on-write.
+PRELOAD_REFERENCE_DATA = False
+# also freeze the preloaded caches so the garbage collector doesn't un-share their memory - see Reference.preload
+FREEZE_PRELOADED_REFERENCE_DATA = False
+
 UPLOADED_PEDIGREE_FILE_RECIPIENTS = []
 # READ_VIZ
 
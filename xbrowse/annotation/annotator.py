@@ -1,35 +1,64 @@
 import datetime
+import json
 import os
 import pymongo
 import pysam
 import sys
 import gzip
+import hashlib
 import itertools
-from collections import defaultdict
+import multiprocessing
+import shutil
+import tempfile
+import time
+import uuid
 from xbrowse import Variant
 from xbrowse import genomeloc
 from vep_annotations import HackedVEPAnnotator
 from population_frequency_store import PopulationFrequencyStore
 from xbrowse.annotation import vep_annotations
+from xbrowse.annotation import local_annotation_store
 from xbrowse.core import constants
 from xbrowse.parsers import vcf_stuff
+from xbrowse.parsers import vcf_index
 from xbrowse.utils import compressed_file
 from xbrowse_server.xbrowse_annotation_controls import CustomAnnotator
 import vcf
 
 
+# number of annotations upserted into db.variants per bulk write
+BULK_WRITE_BATCH_SIZE = 5000
+
+# number of alleles whose population frequencies are looked up in one query
+FREQUENCY_LOOKUP_BATCH_SIZE = 1000
+
+# number of distinct positions checked against db.variants in one query
+MISSING_ANNOTATIONS_BATCH_SIZE = 1000
+
+# bump this when the annotations stored in db.variants change form, so incremental reloads rewrite all of them
+ANNOTATION_SCHEMA_VERSION = 1
+
+# seconds between checks of whether db.variants changed since the local annotation store was built
+VARIANTS_VERSION_CHECK_INTERVAL = 60
+
+
 class VariantAnnotator():
 
     def __init__(self, settings_module, custom_annotator=None):
+        self._settings_module = settings_module
         self._db = pymongo.MongoClient(host=settings_module.db_host, port=settings_module.db_port)[settings_module.db_name]
         self._population_frequency_store = PopulationFrequencyStore(
             db_conn=self._db,
             reference_populations=settings_module.reference_populations,
+            frequency_index_path=getattr(settings_module, 'frequency_index_path', None),
         )
         self._vep_annotator = HackedVEPAnnotator(
             vep_perl_path=settings_module.vep_perl_path,
             vep_cache_dir=settings_module.vep_cache_dir,
             vep_batch_size=settings_module.vep_batch_size,
+            vep_num_processes=getattr(settings_module, 'vep_num_processes', 1),
+            vep_fork=getattr(settings_module, 'vep_fork', 4),
+            vep_streaming=getattr(settings_module, 'vep_streaming', False),
             human_ancestor_fa=None,
             #human_ancestor_fa=settings_module.human_ancestor_fa,
         )
@@ -37,6 +66,11 @@ class VariantAnnotator():
         self.reference_populations = settings_module.reference_populations
         self.reference_population_slugs = [pop['slug'] for pop in settings_module.reference_populations]
 
+        # optional read-only file snapshot of db.variants - see local_annotation_store.py
+        self._local_annotation_store_path = getattr(settings_module, 'annotation_store_path', None)
+        self._local_annotation_store = None
+        self._local_annotation_store_checked_at = None
+
     def _ensure_indices(self):
         self._db.variants.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)])
 
@@ -44,6 +78,19 @@ class VariantAnnotator():
         self._db.drop_collection('variants')
         self._db.drop_collection('vcf_files')
         self._ensure_indices()
+        self.update_variants_version()
+
+    def _get_variants_version(self):
+        doc = self._db.annotator_metadata.find_one({'key': 'variants_version'})
+        return doc['val'] if doc else None
+
+    def update_variants_version(self):
+        """
+        Records that db.variants changed, so local annotation stores built before now stop being used.
+        Anything that writes to db.variants should call this when it's done.
+        """
+        self._db.annotator_metadata.update_one({'key': 'variants_version'}, {'$set': {'val': uuid.uuid4().hex}}, upsert=True)
+        self._local_annotation_store_checked_at = None
 
     def get_annotator_datastore(self):
         """Returns the mongo database object for the xbrowse_annotator database. This database contains the
@@ -66,11 +113,36 @@ class VariantAnnotator():
         self.annotate_variant(variant)
         return variant
 
+    def get_local_annotation_store(self):
+        """
+        Returns the LocalAnnotationStore configured by annotation_store_path in the settings, or None if there
+        isn't one or db.variants has changed since it was built. That's re-checked (and the file re-opened, in
+        case the store was rebuilt) every VARIANTS_VERSION_CHECK_INTERVAL seconds.
+        """
+        if not self._local_annotation_store_path:
+            return None
+
+        now = time.time()
+        if self._local_annotation_store_checked_at is None or now - self._local_annotation_store_checked_at > VARIANTS_VERSION_CHECK_INTERVAL:
+            if self._local_annotation_store is None:
+                self._local_annotation_store = local_annotation_store.LocalAnnotationStore(self._local_annotation_store_path)
+            if self._local_annotation_store.metadata.get('variants_version') != self._get_variants_version():
+                print("WARNING: local annotation store %s is out of date. Using db.variants instead." % self._local_annotation_store_path)
+                self._local_annotation_store = None
+            self._local_annotation_store_checked_at = now
+        return self._local_annotation_store
+
     def get_annotation(self, xpos, ref, alt, populations=None):
-        doc = self._db.variants.find_one({'xpos': xpos, 'ref': ref, 'alt': alt})
-        if doc is None:
-            raise ValueError("Could not find annotations for variant: " + str((xpos, ref, alt)))
-        annotation = doc['annotation']
+        annotation = None
+        annotation_store = self.get_local_annotation_store()
+        if annotation_store is not None:
+            annotation = annotation_store.get_annotation(xpos, ref, alt)
+        if annotation is None:
+            # variants annotated since the local store was built are only in db.variants
+            doc = self._db.variants.find_one({'xpos': xpos, 'ref': ref, 'alt': alt})
+            if doc is None:
+                raise ValueError("Could not find annotations for variant: " + str((xpos, ref, alt)))
+            annotation = doc['annotation']
         if populations is None:
             populations = self.reference_population_slugs
         if populations is not None:
@@ -108,6 +180,8 @@ class VariantAnnotator():
                 'alt': variant_t[2]
             }, {'$set': {'annotation': annotation},
             }, upsert=True)
+        if variants_to_add:
+            self.update_variants_version()
 
     def add_vcf_file_to_annotator(self, vcf_file_path, force_all=False):
         """
@@ -118,11 +192,17 @@ class VariantAnnotator():
             print "VCF already annotated"
             return
         print "Scanning VCF file first..."
+        vcf_file_index = vcf_index.load_vcf_index(vcf_file_path)
         variant_t_list = []
-        for variant_t in vcf_stuff.iterate_tuples(compressed_file(vcf_file_path)):
+        for variant_t in vcf_stuff.scan_tuples(compressed_file(vcf_file_path)):
             variant_t_list.append(variant_t)
             if len(variant_t_list) == 100000:
                 print "Adding another 100000 variants, through {}".format(variant_t_list[-1][0])
+                if vcf_file_index:
+                    chrom, pos = genomeloc.get_chr_pos(variant_t[0])
+                    fraction_done = vcf_index.get_fraction_done(vcf_file_index, chrom, pos)
+                    if fraction_done is not None:
+                        print "%0.1f%% done" % (100 * fraction_done)
                 self.add_variants_to_annotator(variant_t_list, force_all)
                 variant_t_list = []
         self.add_variants_to_annotator(variant_t_list, force_all)
@@ -132,15 +212,127 @@ class VariantAnnotator():
 
         return self._db.vcf_files.find_one({'vcf_file_path': vcf_file_path})
 
-    def add_preannotated_vcf_file(self, vcf_file_path, force=False, start_from_chrom=None, end_with_chrom=None):
+    def add_preannotated_vcf_file(self, vcf_file_path, force=False, start_from_chrom=None, end_with_chrom=None, num_processes=1, incremental=False):
         """
         Add the variants in vcf_file_path to annotator
         Convenience wrapper around add_variants_to_annotator
+
+        Args:
+            num_processes (int): if > 1, load chromosomes in parallel, in this many processes. This requires
+                a tabix index for the VCF.
+            incremental (bool): only reload the chromosomes whose rows changed since the last incremental load of
+                this VCF, and only write the alleles whose annotations changed. Can't be combined with
+                start_from_chrom or end_with_chrom.
         """
-        if not force and self._db.vcf_files.find_one({'vcf_file_path': vcf_file_path}):
+        if not force and not incremental and self._db.vcf_files.find_one({'vcf_file_path': vcf_file_path}):
             print "VCF %(vcf_file_path)s already loaded into db.variants cache" % locals()
             return
 
+        vcf_file_record = {'vcf_file_path': vcf_file_path}
+        chroms = None
+        if incremental:
+            if start_from_chrom or end_with_chrom:
+                raise ValueError("incremental loads can't be limited to a range of chromosomes")
+
+            vcf_file_index = vcf_index.get_vcf_index(vcf_file_path, full_scan=True)
+            chrom_hashes = vcf_index.get_chrom_hashes(vcf_file_index)
+            vcf_file_record.update({
+                'annotation_schema_version': ANNOTATION_SCHEMA_VERSION,
+                # annotations include population frequencies, so they're stale once the populations change
+                'populations_version': self._population_frequency_store.get_data_version(),
+                'header_md5': vcf_file_index['header_md5'],
+                'chrom_hashes': [[chrom, md5] for chrom, md5 in sorted(chrom_hashes.items())],  # chrom names can contain '.'
+            })
+
+            chroms = self._get_changed_chroms(vcf_file_record, vcf_file_index)
+            if not chroms:
+                print("VCF %s hasn't changed since it was last loaded into db.variants cache" % vcf_file_path)
+                return
+            print("Reloading chroms: %s" % ", ".join(chroms))
+        elif num_processes > 1:
+            chroms = get_chrom_list(start_from_chrom, end_with_chrom)
+
+        try:
+            if num_processes > 1:
+                # pymongo clients can't be shared across a fork, so each worker makes its own VariantAnnotator
+                pool = multiprocessing.Pool(num_processes, initializer=_init_preannotated_vcf_worker, initargs=(self._settings_module,))
+                try:
+                    num_alleles = sum(pool.map(_load_preannotated_vcf_chrom, [(vcf_file_path, chrom, incremental) for chrom in chroms], chunksize=1))
+                finally:
+                    pool.terminate()
+            else:
+                num_alleles = self._load_preannotated_vcf_file(
+                    vcf_file_path, start_from_chrom=start_from_chrom, end_with_chrom=end_with_chrom, chroms=chroms, skip_unchanged=incremental)
+        finally:
+            # even a partial load can have changed db.variants
+            self.update_variants_version()
+
+        print("Finished parsing %s alleles from %s" %  (num_alleles, vcf_file_path))
+        vcf_file_record['date_added'] = datetime.datetime.utcnow()
+        self._db.vcf_files.update({'vcf_file_path': vcf_file_path}, vcf_file_record, upsert=True)
+
+    def _get_changed_chroms(self, vcf_file_record, vcf_file_index):
+        """
+        Returns the chromosomes of the VCF, in file order, that changed since the VCF was recorded in db.vcf_files
+        by an incremental load - or all of them, if the header, annotation schema or reference populations changed.
+        """
+        previous_record = self._db.vcf_files.find_one({'vcf_file_path': vcf_file_record['vcf_file_path']}) or {}
+        previous_chrom_hashes = dict(previous_record.get('chrom_hashes') or [])
+        if any(previous_record.get(key) != vcf_file_record[key] for key in ('annotation_schema_version', 'header_md5', 'populations_version')):
+            previous_chrom_hashes = {}
+
+        chrom_hashes = dict(vcf_file_record['chrom_hashes'])
+        chroms = []
+        for c in vcf_file_index['chroms']:
+            if c['chrom'] not in chroms and previous_chrom_hashes.get(c['chrom']) != chrom_hashes[c['chrom']]:
+                chroms.append(c['chrom'])
+        return chroms
+
+    def _load_preannotated_vcf_file(self, vcf_file_path, start_from_chrom=None, end_with_chrom=None, chroms=None, skip_unchanged=False):
+        """
+        Upserts the annotations from vcf_file_path into db.variants, using unordered bulk writes.
+        If skip_unchanged, alleles whose stored annotation_hash matches the new annotation aren't written.
+        Returns the number of alleles loaded.
+        """
+        num_alleles = 0
+        num_written = 0
+        iterator = self._iterate_preannotated_vcf_file(vcf_file_path, start_from_chrom=start_from_chrom, end_with_chrom=end_with_chrom, chroms=chroms)
+        while True:
+            chunk = list(itertools.islice(iterator, 0, BULK_WRITE_BATCH_SIZE))
+            if len(chunk) == 0:
+                break
+
+            existing_hashes = {}
+            if skip_unchanged:
+                projection = {'_id': False, 'xpos': True, 'ref': True, 'alt': True, 'annotation_hash': True}
+                for d in self._iterate_variant_docs([variant_t for variant_t, _ in chunk], projection):
+                    existing_hashes[(d['xpos'], d['ref'], d['alt'])] = d.get('annotation_hash')
+
+            operations = []
+            for variant_t, annotation in chunk:
+                annotation_hash = get_annotation_hash(annotation)
+                if existing_hashes.get(variant_t) == annotation_hash:
+                    continue
+                operations.append(pymongo.UpdateOne(
+                    {'xpos': variant_t[0], 'ref': variant_t[1], 'alt': variant_t[2]},
+                    {'$set': {'annotation': annotation, 'annotation_hash': annotation_hash}},
+                    upsert=True
+                ))
+            if operations:
+                self._db.variants.bulk_write(operations, ordered=False)
+
+            num_alleles += len(chunk)
+            num_written += len(operations)
+            print("Loaded %s alleles from %s, through %s. %s annotations written" % (num_alleles, vcf_file_path, chunk[-1][0], num_written))
+
+        return num_alleles
+
+    def _iterate_preannotated_vcf_file(self, vcf_file_path, start_from_chrom=None, end_with_chrom=None, chroms=None):
+        """
+        Generates (variant_t, annotation) for every allele in a VEP-annotated VCF, in file order, with
+        annotations in the same form as the ones stored in db.variants.
+        If chroms is given, only the rows of those chromosomes (named as in the VCF) are read.
+        """
         r = vcf.VCFReader(filename=vcf_file_path)
         if "CSQ" not in r.infos:
             raise ValueError("ERROR: CSQ field not found in %s. Was this VCF annotated with VEP?" % vcf_file_path)
@@ -151,24 +343,18 @@ class VariantAnnotator():
         if len(expected_csq_fields - actual_csq_fields) > 0:
             raise ValueError("ERROR: VEP did not add all expected CSQ fields to the VCF. The VCF's CSQ = %s and is missing these fields: %s" % (actual_csq_fields_string, expected_csq_fields - actual_csq_fields))
 
-        if start_from_chrom or end_with_chrom:
+        if chroms is not None:
+            print("Loading chroms %s of pre-annotated VCF file: %s into db.variants cache" % (", ".join(chroms), vcf_file_path))
+            vcf_file_obj = _iterate_vcf_lines_in_chroms(vcf_file_path, chroms)
+        elif start_from_chrom or end_with_chrom:
             if start_from_chrom:
                 print("Start chrom: chr%s" % start_from_chrom)
             if end_with_chrom:
                 print("End chrom: chr%s" % end_with_chrom)
 
-            chrom_list = list(map(str, range(1,23))) + ['X','Y']
-            chrom_list_start_index = 0
-            if start_from_chrom:
-                chrom_list_start_index = chrom_list.index(start_from_chrom.replace("chr", "").upper())
-
-            chrom_list_end_index = len(chrom_list)
-            if end_with_chrom:
-                chrom_list_end_index = chrom_list.index(end_with_chrom.replace("chr", "").upper())
-
             tabix_file = pysam.TabixFile(vcf_file_path)
             vcf_iter = tabix_file.header
-            for chrom in chrom_list[chrom_list_start_index:chrom_list_end_index+1]:
+            for chrom in get_chrom_list(start_from_chrom, end_with_chrom):
                 print("Will load chrom: " + chrom)
                 try:
                     vcf_iter = itertools.chain(vcf_iter, tabix_file.fetch(chrom))
@@ -180,53 +366,104 @@ class VariantAnnotator():
             print("Loading pre-annotated VCF file: %s into db.variants cache" % vcf_file_path)
             vcf_file_obj = gzip.open(vcf_file_path) if vcf_file_path.endswith('.gz') else open(vcf_file_path)
 
-        counters = defaultdict(int)
-        for variant, vep_annotation in vep_annotations.parse_vep_annotations_from_vcf(vcf_file_obj):
-            # for variant_t in vcf_stuff.iterate_tuples(compressed_file(vcf_file_path)):
-            variant_t = variant.unique_tuple()
-            counters['alleles'] += 1
-            annotation = {
-                'vep_annotation': vep_annotation,
-                'freqs': self._population_frequency_store.get_frequencies(variant_t[0], variant_t[1], variant_t[2]),
-            }
+        iterator = vep_annotations.parse_vep_annotations_from_vcf(vcf_file_obj)
+        while True:
+            # look up population frequencies for a whole chunk of alleles at a time
+            chunk = [(variant.unique_tuple(), vep_annotation) for variant, vep_annotation in itertools.islice(iterator, 0, FREQUENCY_LOOKUP_BATCH_SIZE)]
+            if len(chunk) == 0:
+                break
 
-            add_convenience_annotations(annotation)
+            freqs = self._population_frequency_store.get_frequencies_many([variant_t for variant_t, _ in chunk])
+            for variant_t, vep_annotation in chunk:
+                annotation = {
+                    'vep_annotation': vep_annotation,
+                    'freqs': freqs[variant_t],
+                }
 
-            chrom, pos = genomeloc.get_chr_pos(variant_t[0])
+                add_convenience_annotations(annotation)
 
-            worst_annotation = vep_annotation[annotation["worst_vep_annotation_index"]]
-            predictors = get_predictors(worst_annotation)
-            annotation.update(predictors)
-            #if self._custom_annotator:
-            #    custom_annotations = self._custom_annotator.get_annotations_for_variants([variant_t])
-            #    annotation.update(custom_annotations[variant_t])
+                worst_annotation = vep_annotation[annotation["worst_vep_annotation_index"]]
+                predictors = get_predictors(worst_annotation)
+                annotation.update(predictors)
+                #if self._custom_annotator:
+                #    custom_annotations = self._custom_annotator.get_annotations_for_variants([variant_t])
+                #    annotation.update(custom_annotations[variant_t])
 
-            if counters['alleles'] % 10000 == 0:
-                import pprint
-                pprint.pprint(variant_t)
+                yield variant_t, annotation
+
+    def build_local_annotation_store(self, store_file_path, vcf_file_paths=None):
+        """
+        Writes a LocalAnnotationStore file with the annotations in db.variants, or - if vcf_file_paths is
+        specified - with the annotations in these VEP-annotated VCFs (where the same variant is in more than
+        one VCF, the annotation from the last one wins).
+        Returns the number of variants in the store.
+        """
+        # read before the annotations, so that a store built during a load into db.variants is out of date once it's done
+        variants_version = self._get_variants_version()
+        if vcf_file_paths is None:
+            metadata = {'source': 'db.variants'}
+            cursor = self._db.variants.find(
+                {}, {'xpos': True, 'ref': True, 'alt': True, 'annotation': True, '_id': False}
+            ).sort([('xpos', 1), ('ref', 1), ('alt', 1)])
+            records = ((doc['xpos'], doc['ref'], doc['alt'], doc['annotation']) for doc in cursor)
+        else:
+            metadata = {'source': 'vcf', 'vcf_file_paths': vcf_file_paths}
+            records = self._iterate_sorted_preannotated_vcf_files(vcf_file_paths)
 
-            self._db.variants.update(
-                {
-                    'xpos': variant_t[0],
-                    'ref': variant_t[1],
-                    'alt': variant_t[2]
-                }, {
-                    '$set': {'annotation': annotation}
-                }, upsert=True)
+        metadata['date_created'] = datetime.datetime.utcnow().isoformat()
+        metadata['variants_version'] = variants_version
+        return local_annotation_store.write_annotation_store(store_file_path, records, metadata=metadata)
 
-        print("Finished parsing %s alleles from %s" %  (counters.get('alleles', 0), vcf_file_path))
-        self._db.vcf_files.update({'vcf_file_path': vcf_file_path},
-            {'vcf_file_path': vcf_file_path, 'date_added': datetime.datetime.utcnow()}, upsert=True)
+    def _iterate_sorted_preannotated_vcf_files(self, vcf_file_paths):
+        """
+        Generates (xpos, ref, alt, annotation) records from all alleles in vcf_file_paths, sorted and de-duplicated.
+        Since VCF rows aren't quite in (xpos, ref, alt) order after splitting multi-allelics and taking the minimal
+        representation, records are first spilled to one temp file per chromosome, so only one chromosome
+        needs to be sorted in memory at a time.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            chrom_files = {}
+            for vcf_file_path in vcf_file_paths:
+                for variant_t, annotation in self._iterate_preannotated_vcf_file(vcf_file_path):
+                    chrom_code = int(variant_t[0] / 1e9)
+                    if chrom_code not in chrom_files:
+                        chrom_files[chrom_code] = open(os.path.join(temp_dir, str(chrom_code)), 'w+')
+                    chrom_files[chrom_code].write(json.dumps(list(variant_t) + [annotation]) + '\n')
+
+            for chrom_code in sorted(chrom_files):
+                f = chrom_files[chrom_code]
+                f.seek(0)
+                # the sort is stable, so for duplicates the record from the last VCF comes last
+                records = sorted((json.loads(line) for line in f), key=lambda r: (r[0], r[1], r[2]))
+                f.close()
+                for i, record in enumerate(records):
+                    if i + 1 < len(records) and records[i + 1][:3] == record[:3]:
+                        continue
+                    yield tuple(record)
+        finally:
+            shutil.rmtree(temp_dir)
 
     def _get_missing_annotations(self, variant_t_list):
-        ret = []
-        for variant_t in variant_t_list:
-            if not self._db.variants.find_one(
-                {'xpos': variant_t[0],
-                 'ref': variant_t[1],
-                 'alt': variant_t[2]}):
-                ret.append(variant_t)
-        return ret
+        """
+        Returns the variants in variant_t_list that aren't in db.variants yet, in their original order.
+        Looks them up with one $in query per batch of positions - projected to the (xpos, ref, alt) index
+        so mongo never has to load the annotations themselves.
+        """
+        projection = {'_id': False, 'xpos': True, 'ref': True, 'alt': True}
+        existing = {(d['xpos'], d['ref'], d['alt']) for d in self._iterate_variant_docs(variant_t_list, projection)}
+
+        return [variant_t for variant_t in variant_t_list if variant_t not in existing]
+
+    def _iterate_variant_docs(self, variant_t_list, projection):
+        """
+        Generates the projected db.variants docs at the positions of the variants in variant_t_list, with one
+        $in query per batch of positions. Callers have to match ref and alt themselves.
+        """
+        xpos_list = sorted({variant_t[0] for variant_t in variant_t_list})
+        for i in range(0, len(xpos_list), MISSING_ANNOTATIONS_BATCH_SIZE):
+            for d in self._db.variants.find({'xpos': {'$in': xpos_list[i:i+MISSING_ANNOTATIONS_BATCH_SIZE]}}, projection=projection):
+                yield d
 
     def annotate_variant(self, variant, populations=None):
         if not hasattr(variant, 'annotation') or not variant.annotation:
@@ -246,6 +483,66 @@ class VariantAnnotator():
         variant.coding_gene_ids = [g for g in annotation['coding_gene_ids']]
 
 
+def get_chrom_list(start_from_chrom=None, end_with_chrom=None):
+    """
+    Returns the list of chromosomes (1..22, X, Y) from start_from_chrom to end_with_chrom, inclusive
+    """
+    chrom_list = list(map(str, range(1,23))) + ['X','Y']
+    chrom_list_start_index = 0
+    if start_from_chrom:
+        chrom_list_start_index = chrom_list.index(start_from_chrom.replace("chr", "").upper())
+
+    chrom_list_end_index = len(chrom_list)
+    if end_with_chrom:
+        chrom_list_end_index = chrom_list.index(end_with_chrom.replace("chr", "").upper())
+
+    return chrom_list[chrom_list_start_index:chrom_list_end_index+1]
+
+
+_worker_annotator = None
+
+
+def _init_preannotated_vcf_worker(settings_module):
+    global _worker_annotator
+    _worker_annotator = VariantAnnotator(settings_module)
+
+
+def _load_preannotated_vcf_chrom(args):
+    vcf_file_path, chrom, skip_unchanged = args
+    return _worker_annotator._load_preannotated_vcf_file(vcf_file_path, chroms=[chrom], skip_unchanged=skip_unchanged)
+
+
+def _iterate_vcf_lines_in_chroms(vcf_file_path, chroms):
+    """
+    Generates the header lines of the VCF and then its rows in the given chromosomes - fetched with tabix
+    if the VCF is indexed, and otherwise by reading the whole file
+    """
+    if os.path.isfile(vcf_file_path + '.tbi'):
+        tabix_file = pysam.TabixFile(vcf_file_path)
+        for line in tabix_file.header:
+            yield line
+        for chrom in chroms:
+            try:
+                for line in tabix_file.fetch(chrom):
+                    yield line
+            except ValueError as e:
+                print("WARNING: add_preannotated_vcf_file: " + str(e))
+        return
+
+    chroms = set(chroms)
+    with (gzip.open(vcf_file_path) if vcf_file_path.endswith('.gz') else open(vcf_file_path)) as f:
+        for line in f:
+            if line.startswith('#') or line.split('\t', 1)[0] in chroms:
+                yield line
+
+
+def get_annotation_hash(annotation):
+    """
+    Returns a hash of the annotation's contents and ANNOTATION_SCHEMA_VERSION, stored with it in db.variants
+    """
+    return hashlib.md5("%s\t%s" % (ANNOTATION_SCHEMA_VERSION, json.dumps(annotation, sort_keys=True))).hexdigest()
+
+
 def add_convenience_annotations(annotation):
     """
     Add a bunch of convenience lookups to an annotation.
@@ -255,19 +552,9 @@ def add_convenience_annotations(annotation):
     vep_annotation = annotation['vep_annotation']
     annotation['gene_ids'] = vep_annotations.get_gene_ids(vep_annotation)
     annotation["coding_gene_ids"] = vep_annotations.get_coding_gene_ids(vep_annotation)
-    annotation['worst_vep_annotation_index'] = vep_annotations.get_worst_vep_annotation_index(vep_annotation)
-    annotation['worst_vep_index_per_gene'] = {}
     annotation['annotation_tags'] = list({a['consequence'] for a in vep_annotation})
-    for gene_id in annotation['gene_ids']:
-        annotation['worst_vep_index_per_gene'][gene_id] = vep_annotations.get_worst_vep_annotation_index(
-            vep_annotation,
-            gene_id=gene_id
-        )
-
-    per_gene = {}
-    for gene_id in annotation['coding_gene_ids']:
-        per_gene[gene_id] = vep_annotations.get_worst_vep_annotation_index(vep_annotation, gene_id=gene_id)
-    annotation['worst_vep_index_per_gene'] = per_gene
+    annotation['worst_vep_annotation_index'], annotation['worst_vep_index_per_gene'] = \
+        vep_annotations.get_worst_vep_annotation_indexes(vep_annotation, gene_ids=annotation['coding_gene_ids'])
 
     worst_vep_annotation = vep_annotation[annotation['worst_vep_annotation_index']]
 
@@ -0,0 +1,190 @@
+"""
+Read-only, columnar alternative to the pop_variants collection.
+
+The index is a directory with a metadata.json and, for every chromosome, one sorted uint64 array of variant
+keys, a uint64 array of allele checks and one float array of allele frequencies per population, all saved as
+.npy files:
+
+    <index_dir>/metadata.json
+    <index_dir>/<chrom code>.keys.npy
+    <index_dir>/<chrom code>.checks.npy
+    <index_dir>/<chrom code>.freq<population number>.npy
+
+A variant's key is its position within the chromosome in the high bits and a hash of its ref and alt alleles
+in the low bits, so looking up a batch of variants is a single searchsorted over the chromosome's keys.
+The check is a second, independent 64-bit hash of the alleles that a lookup must also match, so that a
+hash collision can't return another allele's frequencies. Colliding keys are rejected when the index is built.
+Frequencies are NaN where a variant isn't in a population. Arrays are memory-mapped, so they are shared through
+the OS page cache by all the processes on a host.
+"""
+
+import array
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+
+INDEX_VERSION = 2
+METADATA_FILE_NAME = 'metadata.json'
+
+HASH_BITS = 36
+HASH_MASK = 2**HASH_BITS - 1
+MAX_POS = 2**(64 - HASH_BITS)
+
+XPOS_CHROM_FACTOR = int(1e9)  # see genomeloc.get_single_location
+
+FREQUENCY_DTYPES = ('float32', 'float16')
+
+# number of keys built up in a python list before they're moved to a numpy chunk
+KEY_CHUNK_SIZE = 100000
+
+
+def get_variant_key(xpos, ref, alt):
+    """
+    Returns the (uint64 index key, uint64 allele check) for the given variant
+    """
+    pos = xpos % XPOS_CHROM_FACTOR
+    if pos >= MAX_POS:
+        raise ValueError("Position %s is too large for the frequency index" % xpos)
+    allele_md5 = hashlib.md5("%s\t%s" % (ref, alt)).hexdigest()
+    return (pos << HASH_BITS) | (int(allele_md5[:16], 16) & HASH_MASK), int(allele_md5[16:], 16)
+
+
+class FrequencyIndex():
+
+    def __init__(self, index_dir):
+        self._index_dir = index_dir
+        with open(os.path.join(index_dir, METADATA_FILE_NAME)) as f:
+            metadata = json.load(f)
+        if metadata.get('version') != INDEX_VERSION:
+            raise ValueError("%s has frequency index version %s. Expected %s." % (index_dir, metadata.get('version'), INDEX_VERSION))
+
+        self.population_slugs = metadata['population_slugs']
+        self.num_variants = metadata['num_variants']
+        self._chrom_codes = set(metadata['chrom_codes'])
+        self._chrom_arrays = {}
+
+    def get_frequencies(self, xpos, ref, alt):
+        return self.get_frequencies_many([(xpos, ref, alt)])[(xpos, ref, alt)]
+
+    def get_frequencies_many(self, variant_t_list):
+        """
+        Returns a dict that maps each (xpos, ref, alt) tuple in variant_t_list to a dict of its population
+        frequencies - in the same form as the pop_variants documents, so it's empty for variants that aren't
+        in any population.
+        """
+        variant_t_by_chrom = defaultdict(list)
+        for variant_t in set(variant_t_list):
+            variant_t_by_chrom[variant_t[0] // XPOS_CHROM_FACTOR].append(variant_t)
+
+        ret = {}
+        for chrom_code, chrom_variant_t_list in variant_t_by_chrom.items():
+            for variant_t in chrom_variant_t_list:
+                ret[variant_t] = {}
+
+            chrom_arrays = self._get_chrom_arrays(chrom_code)
+            if chrom_arrays is None:
+                continue
+            keys, checks, freq_columns = chrom_arrays
+
+            query_keys = np.array([get_variant_key(*variant_t) for variant_t in chrom_variant_t_list], dtype=np.uint64)
+            indices = np.minimum(np.searchsorted(keys, query_keys[:, 0]), len(keys) - 1)
+            found = (keys[indices] == query_keys[:, 0]) & (checks[indices] == query_keys[:, 1])
+            for slug, freq_column in zip(self.population_slugs, freq_columns):
+                freqs = freq_column[indices]
+                for i in np.flatnonzero(found & ~np.isnan(freqs)):
+                    d = ret[chrom_variant_t_list[i]]
+                    if not d:
+                        d['xpos'], d['ref'], d['alt'] = chrom_variant_t_list[i]
+                    d[slug] = float(freqs[i])
+
+        return ret
+
+    def _get_chrom_arrays(self, chrom_code):
+        if chrom_code not in self._chrom_codes:
+            return None
+        if chrom_code not in self._chrom_arrays:
+            keys = np.load(os.path.join(self._index_dir, '%s.keys.npy' % chrom_code), mmap_mode='r')
+            checks = np.load(os.path.join(self._index_dir, '%s.checks.npy' % chrom_code), mmap_mode='r')
+            freq_columns = [
+                np.load(os.path.join(self._index_dir, '%s.freq%s.npy' % (chrom_code, i)), mmap_mode='r')
+                for i in range(len(self.population_slugs))
+            ]
+            self._chrom_arrays[chrom_code] = (keys, checks, freq_columns)
+        return self._chrom_arrays[chrom_code]
+
+
+def write_frequency_index(index_dir, records, population_slugs, dtype='float32'):
+    """
+    Writes a new frequency index.
+
+    Args:
+        index_dir (str): output directory. It's created if it doesn't exist, and the metadata file is written
+            last, so the index isn't usable until it's complete. Existing indexes aren't overwritten, since other
+            processes may have their files memory-mapped - write a new one and point the settings at it.
+        records: iterator of (xpos, ref, alt, freqs) tuples in any order, where freqs is a dict of population
+            slug -> frequency, like the pop_variants documents
+        population_slugs (list): populations to include in the index
+        dtype (str): 'float32' or 'float16' - the type used to store the frequencies. float16 halves the size of
+            the frequency arrays, but it loses precision for frequencies below about 6e-5 (the smallest normal
+            float16), and rounds frequencies below about 6e-8 to 0.
+    Returns:
+        the number of variants written
+    Raises:
+        ValueError: if two different alleles at the same position have the same key
+    """
+    if dtype not in FREQUENCY_DTYPES:
+        raise ValueError("Unexpected frequency index dtype: %s" % dtype)
+    if os.path.exists(os.path.join(index_dir, METADATA_FILE_NAME)):
+        raise ValueError("%s already contains a frequency index" % index_dir)
+
+    # accumulate in compact arrays - python lists of these would be several times the size. array.array has no
+    # 64-bit unsigned type on every platform, so keys go through a short list into numpy chunks instead
+    key_chunks_by_chrom = defaultdict(list)
+    pending_keys_by_chrom = defaultdict(list)
+    freqs_by_chrom = defaultdict(lambda: [array.array('f') for _ in population_slugs])
+    for xpos, ref, alt, freqs in records:
+        chrom_code = xpos // XPOS_CHROM_FACTOR
+        pending_keys = pending_keys_by_chrom[chrom_code]
+        pending_keys.append(get_variant_key(xpos, ref, alt))
+        if len(pending_keys) == KEY_CHUNK_SIZE:
+            key_chunks_by_chrom[chrom_code].append(np.array(pending_keys, dtype=np.uint64))
+            del pending_keys[:]
+        for slug, freq_array in zip(population_slugs, freqs_by_chrom[chrom_code]):
+            freq = freqs.get(slug)
+            freq_array.append(float('nan') if freq is None else freq)
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+
+    num_variants = 0
+    for chrom_code, pending_keys in pending_keys_by_chrom.items():
+        key_chunks = key_chunks_by_chrom[chrom_code] + [np.array(pending_keys, dtype=np.uint64).reshape(-1, 2)]
+        keys_and_checks = np.concatenate(key_chunks)
+        order = np.lexsort((keys_and_checks[:, 1], keys_and_checks[:, 0]))
+        keys = keys_and_checks[order, 0]
+        checks = keys_and_checks[order, 1]
+
+        is_new_key = keys[1:] != keys[:-1]
+        if np.any(~is_new_key & (checks[1:] != checks[:-1])):
+            raise ValueError("Frequency index key collision between different alleles on chrom code %s" % chrom_code)
+        is_first = np.concatenate([[True], is_new_key])  # drop duplicate variants, keeping the first
+        np.save(os.path.join(index_dir, '%s.keys.npy' % chrom_code), keys[is_first])
+        np.save(os.path.join(index_dir, '%s.checks.npy' % chrom_code), checks[is_first])
+        for i, freq_array in enumerate(freqs_by_chrom[chrom_code]):
+            freqs = np.frombuffer(freq_array, dtype=np.float32)[order][is_first].astype(dtype)
+            np.save(os.path.join(index_dir, '%s.freq%s.npy' % (chrom_code, i)), freqs)
+        num_variants += int(is_first.sum())
+
+    with open(os.path.join(index_dir, METADATA_FILE_NAME), 'w') as f:
+        json.dump({
+            'version': INDEX_VERSION,
+            'population_slugs': list(population_slugs),
+            'chrom_codes': sorted(pending_keys_by_chrom.keys()),
+            'num_variants': num_variants,
+            'dtype': dtype,
+        }, f)
+
+    return num_variants
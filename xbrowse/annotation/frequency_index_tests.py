@@ -0,0 +1,66 @@
+import shutil
+import tempfile
+from django.test import TestCase
+from xbrowse.annotation import frequency_index
+
+
+RECORDS = [
+    (1000000100, 'A', 'G', {'g1k': 0.25, 'exac': 0.5}),
+    (1000000100, 'A', 'T', {'exac': 0.125}),
+    (2000000050, 'CT', 'C', {'g1k': 0.75}),
+    (1000000099, 'G', 'C', {'other': 0.5}),
+]
+
+
+class FrequencyIndexTest(TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_get_frequencies_many(self):
+        num_variants = frequency_index.write_frequency_index(self.index_dir, iter(RECORDS), ['g1k', 'exac'])
+        self.assertEqual(num_variants, 4)
+
+        index = frequency_index.FrequencyIndex(self.index_dir)
+        freqs = index.get_frequencies_many([
+            (1000000100, 'A', 'G'), (1000000100, 'A', 'T'), (2000000050, 'CT', 'C'),
+            (1000000099, 'G', 'C'), (1000000100, 'A', 'C'), (3000000001, 'A', 'C'),
+        ])
+        self.assertEqual(freqs, {
+            (1000000100, 'A', 'G'): {'xpos': 1000000100, 'ref': 'A', 'alt': 'G', 'g1k': 0.25, 'exac': 0.5},
+            (1000000100, 'A', 'T'): {'xpos': 1000000100, 'ref': 'A', 'alt': 'T', 'exac': 0.125},
+            (2000000050, 'CT', 'C'): {'xpos': 2000000050, 'ref': 'CT', 'alt': 'C', 'g1k': 0.75},
+            (1000000099, 'G', 'C'): {},
+            (1000000100, 'A', 'C'): {},
+            (3000000001, 'A', 'C'): {},
+        })
+        self.assertEqual(index.get_frequencies(2000000050, 'CT', 'C')['g1k'], 0.75)
+
+    def test_existing_index_is_not_overwritten(self):
+        frequency_index.write_frequency_index(self.index_dir, iter(RECORDS), ['g1k'], dtype='float16')
+        with self.assertRaises(ValueError):
+            frequency_index.write_frequency_index(self.index_dir, iter(RECORDS), ['g1k'])
+
+    def test_key_collisions(self):
+        get_variant_key = frequency_index.get_variant_key
+
+        def get_colliding_variant_key(xpos, ref, alt):
+            # the same key for every allele at a position, with the real allele check
+            return (xpos % frequency_index.XPOS_CHROM_FACTOR) << frequency_index.HASH_BITS, get_variant_key(xpos, ref, alt)[1]
+
+        frequency_index.get_variant_key = get_colliding_variant_key
+        try:
+            # duplicates of the same variant are fine
+            frequency_index.write_frequency_index(self.index_dir, iter(RECORDS[:1] + RECORDS[:1]), ['g1k'])
+            index = frequency_index.FrequencyIndex(self.index_dir)
+            self.assertEqual(index.get_frequencies(1000000100, 'A', 'G')['g1k'], 0.25)
+            # a lookup of a colliding allele doesn't return the other allele's frequencies
+            self.assertEqual(index.get_frequencies(1000000100, 'A', 'T'), {})
+
+            with self.assertRaises(ValueError):
+                frequency_index.write_frequency_index(tempfile.mkdtemp(dir=self.index_dir), iter(RECORDS), ['g1k'])
+        finally:
+            frequency_index.get_variant_key = get_variant_key
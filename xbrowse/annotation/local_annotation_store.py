@@ -0,0 +1,155 @@
+"""
+Read-only, file-based alternative to the annotator's db.variants collection.
+
+The store is a single immutable file of annotations sorted by (xpos, ref, alt), grouped into
+zlib-compressed blocks of records:
+
+    MAGIC | block 0 | block 1 | ... | index | footer
+
+Each block starts with its number of records, then has one tab-separated "xpos ref alt" line per record,
+followed by one line of json per annotation. The index (also compressed) holds the first key, offset and
+length of every block, so a lookup is a bisect over the in-memory index, decompressing one block, and
+decoding just the one annotation. The file is memory-mapped read-only, so all the WSGI workers on a host
+share it through the OS page cache instead of each holding its own copy.
+"""
+
+import bisect
+import itertools
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+
+MAGIC = 'XBANNOT1'
+FOOTER_FORMAT = '<QQ'  # index offset, index length
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT) + len(MAGIC)
+
+DEFAULT_BLOCK_SIZE = 64  # records per block
+DEFAULT_BLOCK_CACHE_SIZE = 256  # decompressed blocks kept in memory per process
+
+
+class LocalAnnotationStore():
+
+    def __init__(self, store_file_path, block_cache_size=DEFAULT_BLOCK_CACHE_SIZE):
+        self._store_file_path = store_file_path
+        self._block_cache_size = block_cache_size
+        self._block_cache = OrderedDict()
+
+        self._file = open(store_file_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC or self._mmap[-len(MAGIC):] != MAGIC:
+            raise ValueError("%s is not an annotation store file" % store_file_path)
+        index_offset, index_length = struct.unpack(FOOTER_FORMAT, self._mmap[-FOOTER_SIZE:-len(MAGIC)])
+        index = json.loads(zlib.decompress(self._mmap[index_offset:index_offset+index_length]))
+
+        self.metadata = index['metadata']
+        self.num_records = index['num_records']
+        self._block_first_keys = [(b[0], b[1], b[2]) for b in index['blocks']]
+        self._block_offsets = [(b[3], b[4]) for b in index['blocks']]
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def get_annotation(self, xpos, ref, alt):
+        """
+        Returns the annotation dict for the given variant, or None if it's not in the store.
+        Each call decodes a new dict, so callers are free to modify it.
+        """
+        key = (xpos, ref, alt)
+        block_i = bisect.bisect_right(self._block_first_keys, key) - 1
+        if block_i < 0:
+            return None
+
+        key_positions, annotation_lines = self._get_block(block_i)
+        i = key_positions.get("%s\t%s\t%s" % key)
+        if i is None:
+            return None
+        return json.loads(annotation_lines[i])
+
+    def get_annotations(self, variant_t_list):
+        """
+        Batch version of get_annotation.
+        Returns a dict of (xpos, ref, alt) -> annotation for the variants in variant_t_list that are in the store.
+        """
+        ret = {}
+        for variant_t in sorted(set(variant_t_list)):
+            annotation = self.get_annotation(*variant_t)
+            if annotation is not None:
+                ret[variant_t] = annotation
+        return ret
+
+    def _get_block(self, block_i):
+        block = self._block_cache.pop(block_i, None)
+        if block is None:
+            offset, length = self._block_offsets[block_i]
+            lines = zlib.decompress(self._mmap[offset:offset+length]).split('\n')
+            num_records = int(lines[0])
+            # key lines are left as strings - parsing them would cost more than the rest of the lookup
+            block = (dict(itertools.izip(lines[1:num_records+1], itertools.count())), lines[num_records+1:])
+            if len(self._block_cache) >= self._block_cache_size:
+                self._block_cache.popitem(last=False)
+        self._block_cache[block_i] = block  # most recently used goes last
+        return block
+
+
+def write_annotation_store(store_file_path, records, block_size=DEFAULT_BLOCK_SIZE, metadata=None):
+    """
+    Writes a new annotation store file.
+
+    Args:
+        store_file_path (str): output path. The file is written next to it first and then renamed into place,
+            so processes that have the old store open are never affected.
+        records: iterator of (xpos, ref, alt, annotation) tuples, sorted by (xpos, ref, alt) with no duplicates
+        block_size (int): number of records per compressed block
+        metadata (dict): optional json-serializable info about how the store was built
+    Returns:
+        the number of records written
+    """
+    temp_file_path = "%s.%s.tmp" % (store_file_path, os.getpid())
+    blocks = []
+    num_records = 0
+    with open(temp_file_path, 'wb') as f:
+        f.write(MAGIC)
+
+        def write_block(block_records):
+            lines = [str(len(block_records))]
+            lines += ["%s\t%s\t%s" % tuple(r[:3]) for r in block_records]
+            lines += [json.dumps(r[3], separators=(',', ':')) for r in block_records]
+            data = zlib.compress('\n'.join(lines))
+            first_xpos, first_ref, first_alt = block_records[0][:3]
+            blocks.append([first_xpos, first_ref, first_alt, f.tell(), len(data)])
+            f.write(data)
+
+        previous_key = None
+        block_records = []
+        for xpos, ref, alt, annotation in records:
+            key = (xpos, ref, alt)
+            if previous_key is not None and key <= previous_key:
+                raise ValueError("Annotation store records must be sorted and unique: %s came after %s" % (key, previous_key))
+            previous_key = key
+
+            block_records.append([xpos, ref, alt, annotation])
+            num_records += 1
+            if len(block_records) == block_size:
+                write_block(block_records)
+                block_records = []
+
+        if block_records:
+            write_block(block_records)
+
+        index_offset = f.tell()
+        index_data = zlib.compress(json.dumps({
+            'metadata': metadata or {},
+            'num_records': num_records,
+            'blocks': blocks,
+        }))
+        f.write(index_data)
+        f.write(struct.pack(FOOTER_FORMAT, index_offset, len(index_data)))
+        f.write(MAGIC)
+
+    os.rename(temp_file_path, store_file_path)
+    return num_records
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from xbrowse.annotation.local_annotation_store import LocalAnnotationStore, write_annotation_store
+
+
+class LocalAnnotationStoreTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_file_path = os.path.join(self.temp_dir, 'annotations.xbannot')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_lookups(self):
+        records = []
+        for i in range(1000):
+            xpos = 1000000000 + 10 * i
+            records.append((xpos, 'A', 'C', {'vep_group': 'missense', 'i': i}))
+            records.append((xpos, 'A', 'T', {'vep_group': 'synonymous', 'i': i}))
+        self.assertEqual(write_annotation_store(self.store_file_path, records, block_size=7, metadata={'source': 'test'}), 2000)
+
+        store = LocalAnnotationStore(self.store_file_path, block_cache_size=3)
+        self.assertEqual(store.num_records, 2000)
+        self.assertEqual(store.metadata, {'source': 'test'})
+        for xpos, ref, alt, annotation in records:
+            self.assertEqual(store.get_annotation(xpos, ref, alt), annotation)
+
+        self.assertIsNone(store.get_annotation(999999999, 'A', 'C'))
+        self.assertIsNone(store.get_annotation(1000000000, 'A', 'G'))
+        self.assertIsNone(store.get_annotation(1000000005, 'A', 'C'))
+        self.assertIsNone(store.get_annotation(2000000000, 'A', 'C'))
+
+        annotations = store.get_annotations([(1000000010, 'A', 'T'), (1000000005, 'A', 'C')])
+        self.assertEqual(annotations, {(1000000010, 'A', 'T'): {'vep_group': 'synonymous', 'i': 1}})
+        store.close()
+
+    def test_unsorted_records(self):
+        records = [(1000000010, 'A', 'C', {}), (1000000005, 'A', 'C', {})]
+        self.assertRaises(ValueError, write_annotation_store, self.store_file_path, records)
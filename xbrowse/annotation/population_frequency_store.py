@@ -1,31 +1,86 @@
 import gzip
+import hashlib
+import itertools
+import json
 import os
+import pymongo
+import uuid
+from collections import OrderedDict
 from xbrowse.utils import get_progressbar
 from xbrowse import vcf_stuff
 from xbrowse.utils import get_aaf
 from xbrowse.parsers.esp_vcf import get_variants_from_esp_file
 from xbrowse.core import genomeloc
+from xbrowse.annotation import frequency_index
+
+
+# number of variants upserted into db.pop_variants per bulk write
+BULK_WRITE_BATCH_SIZE = 5000
+
+# file types that are all parsed with vcf_stuff.iterate_vcf
+VCF_FILE_TYPES = ('vcf', 'sites_vcf', 'sites_vcf_with_counts')
+
+# sites VCF populations that are stored in the same file can be loaded in one pass over it
+SITES_VCF_FILE_TYPES = ('sites_vcf', 'sites_vcf_with_counts')
+
+# 1000 Genomes popmax is the max of these super-population AFs
+ONE_KG_POPMAX_META_FIELDS = ["EAS_AF", "EUR_AF", "AFR_AF", "AMR_AF", "SAS_AF"]
 
 
 class PopulationFrequencyStore():
 
-    def __init__(self, db_conn, reference_populations):
+    def __init__(self, db_conn, reference_populations, frequency_index_path=None):
         self._db = db_conn
         self.reference_populations = reference_populations
 
+        # optional read-only columnar snapshot of pop_variants - see frequency_index.py
+        self._frequency_index_path = frequency_index_path
+        self._frequency_index = None
+
+    def get_frequency_index(self):
+        """Returns the FrequencyIndex at frequency_index_path, or None if there isn't one"""
+        if self._frequency_index is None and self._frequency_index_path:
+            self._frequency_index = frequency_index.FrequencyIndex(self._frequency_index_path)
+        return self._frequency_index
+
     def get_frequencies(self, xpos, ref, alt):
+        if self.get_frequency_index() is not None:
+            return self.get_frequency_index().get_frequencies(xpos, ref, alt)
+
         d = self._db.pop_variants.find_one({'xpos': xpos, 'ref': ref, 'alt': alt}, projection={'_id': False})
         if d is None:
             d = {}
 
         return d
 
+    def get_frequencies_many(self, variant_t_list):
+        """
+        Batch version of get_frequencies.
+        Returns a dict that maps each (xpos, ref, alt) tuple in variant_t_list to the same dict get_frequencies would return
+        """
+        if self.get_frequency_index() is not None:
+            return self.get_frequency_index().get_frequencies_many(variant_t_list)
+
+        variant_t_set = set(variant_t_list)
+        ret = {variant_t: {} for variant_t in variant_t_set}
+        if not variant_t_set:
+            return ret
+
+        xpos_list = list({variant_t[0] for variant_t in variant_t_set})
+        for d in self._db.pop_variants.find({'xpos': {'$in': xpos_list}}, projection={'_id': False}):
+            variant_t = (d['xpos'], d['ref'], d['alt'])
+            if variant_t in variant_t_set:
+                ret[variant_t] = d
+
+        return ret
+
     def add_populations_to_variants(self, variants, population_slug_list):
         """
         variants is a list of annotated variants, this adds more population frequencies to that annotation
         """
+        freqs_by_variant = self.get_frequencies_many([variant.unique_tuple() for variant in variants])
         for variant in variants:
-            freqs = self.get_frequencies(variant.xpos, variant.ref, variant.alt)
+            freqs = freqs_by_variant[variant.unique_tuple()]
             for slug in population_slug_list:
                 if slug in freqs:
                     variant.annotation['freqs'][slug] = freqs[slug]
@@ -37,249 +92,93 @@ class PopulationFrequencyStore():
         Load up the database from settings_module
         """
         self._ensure_indices()
-        self.load_populations(self.reference_populations)
+        self.load_populations(self.reference_populations, merge_sources=True)
+
+    def build_frequency_index(self, index_dir, dtype='float32'):
+        """
+        Writes a FrequencyIndex of the reference populations in pop_variants to index_dir.
+        Returns the number of variants in it.
+        """
+        population_slugs = [population['slug'] for population in self.reference_populations]
+        cursor = self._db.pop_variants.find({}, projection={'_id': False})
+        records = ((d['xpos'], d['ref'], d['alt'], d) for d in cursor)
+        return frequency_index.write_frequency_index(index_dir, records, population_slugs, dtype=dtype)
+
+    def get_data_version(self):
+        """
+        Returns an id that changes whenever the frequencies returned by get_frequencies may have changed - when
+        populations are loaded into pop_variants, or the settings point at a different frequency index or set of
+        reference populations.
+        """
+        doc = self._db.annotator_metadata.find_one({'key': 'pop_variants_version'})
+        return hashlib.md5(json.dumps([
+            doc['val'] if doc else None,
+            self._frequency_index_path,
+            [population['slug'] for population in self.reference_populations],
+        ])).hexdigest()
+
+    def _update_pop_variants_version(self):
+        self._db.annotator_metadata.update_one({'key': 'pop_variants_version'}, {'$set': {'val': uuid.uuid4().hex}}, upsert=True)
 
     def _ensure_indices(self):
         self._db.pop_variants.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)])
 
-    def _add_population_frequency(self, xpos, ref, alt, population, freq):
-        self._db.pop_variants.update(
-            {'xpos': xpos, 'ref': ref, 'alt': alt},
-            {'$set': {population: freq}},
-            upsert=True
-        )
-
-    def load_populations(self, population_list):
+    def _add_population_frequencies(self, freqs_iter):
+        """
+        Bulk upserts population frequencies into pop_variants.
+        freqs_iter is an iterator of (xpos, ref, alt, {population slug: freq}) tuples
+        """
+        try:
+            while True:
+                chunk = list(itertools.islice(freqs_iter, 0, BULK_WRITE_BATCH_SIZE))
+                if len(chunk) == 0:
+                    break
+
+                # unordered writes may be applied in any order, so combine repeats of a variant here
+                # to keep the last value in the file, like the per-variant updates did
+                merged = OrderedDict()
+                for xpos, ref, alt, freqs in chunk:
+                    merged.setdefault((xpos, ref, alt), {}).update(freqs)
+
+                self._db.pop_variants.bulk_write([
+                    pymongo.UpdateOne(
+                        {'xpos': variant_t[0], 'ref': variant_t[1], 'alt': variant_t[2]},
+                        {'$set': freqs},
+                        upsert=True
+                    ) for variant_t, freqs in merged.items()
+                ], ordered=False)
+        finally:
+            # even a partial load can have changed pop_variants
+            self._update_pop_variants_version()
+
+    def load_populations(self, population_list, merge_sources=False):
         """
         Load all the populations described in population_list into annotator
         TODO: create example-settings.py that shows format
+
+        Args:
+            merge_sources (bool): load populations that come from the same file (eg. several INFO fields
+                of one sites VCF) together, in a single pass over the file
         """
+        if not merge_sources:
+            for population in population_list:
+                self.load_population(population)
+            return
+
+        population_groups = OrderedDict()
         for population in population_list:
-            self.load_population(population)
+            population_groups.setdefault(_get_population_source(population), []).append(population)
+
+        for populations in population_groups.values():
+            print("Loading populations: %s" % ", ".join(p['slug'] for p in populations))
+            self._add_population_frequencies(iterate_population_frequencies(populations))
 
     def load_population(self, population):
         """
         Take a population and a data source; extract and load it into annotator
         Data source can be VCF file, VCF Counts file, or a counts dir (in the case of ESP data)
         """
-        if population['file_type'] == 'vcf':
-            if population['file_path'].endswith('.gz'):
-                vcf_file = gzip.open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = vcf_file.fileobj
-            else:
-                vcf_file = open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = vcf_file
-            progress = get_progressbar(size, 'Loading vcf: {}'.format(population['slug']))
-            for variant in vcf_stuff.iterate_vcf(vcf_file, genotypes=True, genotype_meta=False):
-                progress.update(progress_file.tell())
-                freq = get_aaf(variant)
-                self._add_population_frequency(variant.xpos, variant.ref, variant.alt, population['slug'], freq)
-            vcf_file.close()
-
-        elif population['file_type'] == 'sites_vcf':
-            if population['file_path'].endswith('.gz'):
-                vcf_file = gzip.open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = vcf_file.fileobj
-            else:
-                vcf_file = open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = vcf_file
-            meta_key = population.get('vcf_info_key', 'AF')
-
-            progress = get_progressbar(size, 'Loading sites vcf: {}'.format(population['slug']))
-            is_1kg_popmax = "popmax" in meta_key.lower() and ("1000 Genomes" in population["name"])
-            if is_1kg_popmax:
-                meta_fields = ["EAS_AF", "EUR_AF", "AFR_AF", "AMR_AF", "SAS_AF"]
-            else:
-                meta_fields = [meta_key,]
-
-            for variant in vcf_stuff.iterate_vcf(vcf_file, meta_fields=meta_fields):
-                progress.update(progress_file.tell())
-                if "popmax" in meta_key.lower() and ("1000 Genomes" in population["name"]):
-                    allele_idx = variant.extras['alt_allele_pos']
-                    freq = 0
-                    for meta_key in meta_fields:
-                        freq = max(freq, float(variant.extras.get(meta_key, 0).split(',')[allele_idx]))
-
-                    ##INFO=<ID=EAS_AF,Number=A,Type=Float,Description="Allele frequency in the EAS populations calculated from AC and AN, in the range (0,1)">
-                    ##INFO=<ID=EUR_AF,Number=A,Type=Float,Description="Allele frequency in the EUR populations calculated from AC and AN, in the range (0,1)">
-                    ##INFO=<ID=AFR_AF,Number=A,Type=Float,Description="Allele frequency in the AFR populations calculated from AC and AN, in the range (0,1)">
-                    ##INFO=<ID=AMR_AF,Number=A,Type=Float,Description="Allele frequency in the AMR populations calculated from AC and AN, in the range (0,1)">
-                    ##INFO=<ID=SAS_AF,Number=A,Type=Float,Description="Allele frequency in the SAS populations calculated from AC and AN, in the range (0,1)">
-                else:
-                    freq = float(variant.extras.get(meta_key, 0).split(',')[variant.extras['alt_allele_pos']])
-
-                self._add_population_frequency(
-                    variant.xpos,
-                    variant.ref,
-                    variant.alt,
-                    population['slug'],
-                    freq
-                )
-            vcf_file.close()
-
-        #
-        # Directory of per-chromosome VCFs that ESP publishes
-        #
-        elif population['file_type'] == 'esp_vcf_dir':
-            for filename in os.listdir(population['dir_path']):
-                file_path = os.path.abspath(os.path.join(population['dir_path'], filename))
-                f = open(file_path)
-                file_size = os.path.getsize(file_path)
-                progress = get_progressbar(file_size, 'Loading ESP file: {}'.format(filename))
-                for variant in get_variants_from_esp_file(f):
-                    progress.update(f.tell())
-                    self._add_population_frequency(
-                        variant['xpos'],
-                        variant['ref'],
-                        variant['alt'],
-                        population['slug'],
-                        variant[population['counts_key']]
-                    )
-                f.close()
-        #
-        # text file of allele counts, as Monkol has been using for the joint calling data
-        #
-        elif population['file_type'] == 'counts_file':
-            if population['file_path'].endswith('.gz'):
-                counts_file = gzip.open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = counts_file.fileobj
-            else:
-                counts_file = open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = counts_file
-
-            progress = get_progressbar(size, 'Loading population: {}'.format(population['slug']))
-            for line in counts_file:
-                progress.update(progress_file.tell())
-                fields = line.strip('\n').split('\t')
-                chrom = 'chr' + fields[0]
-                pos = int(fields[1])
-                xpos = genomeloc.get_single_location(chrom, pos)
-                ref = fields[2]
-                alt = fields[3]
-                if int(fields[5]) == 0:
-                    continue
-                freq = float(fields[4]) / float(fields[5])
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
-            counts_file.close()
-
-        # this is now the canonical allele frequency file -
-        # tab separated file with xpos / ref / alt / freq
-        elif population['file_type'] == 'xbrowse_freq_file':
-            if population['file_path'].endswith('.gz'):
-                counts_file = gzip.open(population['file_path'])
-                progress_file = counts_file.fileobj
-            else:
-                counts_file = open(population['file_path'])
-                progress_file = counts_file
-            size = os.path.getsize(population['file_path'])
-            progress = get_progressbar(size, 'Loading population: {}'.format(population['slug']))
-
-            for line in counts_file:
-                progress.update(progress_file.tell())
-                fields = line.strip('\n').split('\t')
-                xpos = int(fields[0])
-                ref = fields[1]
-                alt = fields[2]
-                freq = float(fields[3])
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
-            counts_file.close()
-
-        elif population['file_type'] == 'tsv_file':
-            if population['file_path'].endswith('.gz'):
-                freq_file = gzip.open(population['file_path'])
-                progress_file = freq_file.fileobj
-            else:
-                freq_file = open(population['file_path'])
-                progress_file = freq_file
-            size = os.path.getsize(population['file_path'])
-            progress = get_progressbar(size, 'Loading population: {}'.format(population['slug']))
-            header = next(freq_file)
-            print("Header: " + header)
-            for line in freq_file:
-                progress.update(progress_file.tell())
-                fields = line.strip('\n').split('\t')
-                chrom = fields[0]
-                pos = int(fields[1])
-                ref = fields[2]
-                alt = fields[3]
-                freq = float(fields[4])
-
-                xpos = genomeloc.get_single_location(chrom, pos)
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
-            freq_file.close()
-
-        elif population['file_type'] == 'sites_vcf_with_counts':
-            if population['file_path'].endswith('.gz') or population['file_path'].endswith('.bgz'):
-                vcf_file = gzip.open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = vcf_file.fileobj
-            else:
-                vcf_file = open(population['file_path'])
-                size = os.path.getsize(population['file_path'])
-                progress_file = vcf_file
-            ac_info_key = population['ac_info_key']
-            an_info_key = population['an_info_key']
-
-            progress = get_progressbar(size, 'Loading sites vcf: {}'.format(population['slug']))
-            for variant in vcf_stuff.iterate_vcf(vcf_file, meta_fields=[ac_info_key, an_info_key]):
-                progress.update(progress_file.tell())
-
-                alt_allele_pos = variant.extras['alt_allele_pos']
-                try:
-                    ac = int(variant.extras.get(ac_info_key).split(',')[alt_allele_pos].replace("NA", "0"))
-                except Exception, e:
-                    print("Couldn't parse AC value %s from %s: %s" % (alt_allele_pos, ac_info_key, variant.extras), e)
-                    continue
-
-                try:
-                    if "popmax" in ac_info_key.lower():
-                        AN_index = alt_allele_pos  # each allele may have a different AN value from a different population
-                    else:
-                        AN_index = 0
-
-                    an = int(variant.extras.get(an_info_key).split(',')[AN_index].replace("NA", "0"))
-                except Exception, e:
-                    print("Couldn't parse AN value %s from %s: %s" % (alt_allele_pos, an_info_key, variant.extras), e)
-                    continue
-
-                if an == 0:
-                    freq = 0.0
-                else:
-                    freq = float(ac)/an
-                self._add_population_frequency(
-                    variant.xpos,
-                    variant.ref,
-                    variant.alt,
-                    population['slug'],
-                    freq
-                )
-            vcf_file.close()
-        else:
-            raise ValueError("Unexpected population['file_type']: " + population['file_type'])
+        self._add_population_frequencies(iterate_population_frequencies([population]))
 
     def passes_frequency_filters(self, xpos, ref, alt, frequency_filter_list):
         """
@@ -297,4 +196,191 @@ class PopulationFrequencyStore():
         return True
 
 
+def _get_population_source(population):
+    """
+    Returns a key that's the same for populations that can be loaded in one pass over the same file
+    """
+    if population['file_type'] in SITES_VCF_FILE_TYPES:
+        return ('sites_vcf', population['file_path'])
+    elif population['file_type'] == 'esp_vcf_dir':
+        return ('esp_vcf_dir', population['dir_path'])
+    else:
+        return (population['file_type'], population['file_path'])
+
+
+def _open_population_file(file_path):
+    """
+    Returns (file, progress_file, size), where progress_file.tell() is the position in the file on disk
+    """
+    if file_path.endswith('.gz') or file_path.endswith('.bgz'):
+        f = gzip.open(file_path)
+        return f, f.fileobj, os.path.getsize(file_path)
+    else:
+        f = open(file_path)
+        return f, f, os.path.getsize(file_path)
+
+
+def iterate_population_frequencies(populations):
+    """
+    Reads the data source shared by the given populations (see _get_population_source) once.
+    Generates (xpos, ref, alt, freqs) tuples, where freqs is a dict of population slug -> frequency.
+    """
+    file_type = populations[0]['file_type']
+    slugs = ", ".join(p['slug'] for p in populations)
+
+    if file_type in VCF_FILE_TYPES:
+        vcf_file, progress_file, size = _open_population_file(populations[0]['file_path'])
+        meta_fields = set()
+        for population in populations:
+            meta_fields.update(_get_vcf_meta_fields(population))
+        genotypes = file_type == 'vcf'
+
+        progress = get_progressbar(size, 'Loading vcf: {}'.format(slugs))
+        for variant in vcf_stuff.iterate_vcf(vcf_file, genotypes=genotypes, genotype_meta=False, meta_fields=list(meta_fields)):
+            progress.update(progress_file.tell())
+            freqs = {}
+            for population in populations:
+                freq = _get_vcf_population_frequency(population, variant)
+                if freq is not None:
+                    freqs[population['slug']] = freq
+            if freqs:
+                yield variant.xpos, variant.ref, variant.alt, freqs
+        vcf_file.close()
+
+    #
+    # Directory of per-chromosome VCFs that ESP publishes
+    #
+    elif file_type == 'esp_vcf_dir':
+        for filename in os.listdir(populations[0]['dir_path']):
+            file_path = os.path.abspath(os.path.join(populations[0]['dir_path'], filename))
+            f = open(file_path)
+            file_size = os.path.getsize(file_path)
+            progress = get_progressbar(file_size, 'Loading ESP file: {}'.format(filename))
+            for variant in get_variants_from_esp_file(f):
+                progress.update(f.tell())
+                freqs = {population['slug']: variant[population['counts_key']] for population in populations}
+                yield variant['xpos'], variant['ref'], variant['alt'], freqs
+            f.close()
+
+    #
+    # text file of allele counts, as Monkol has been using for the joint calling data
+    #
+    elif file_type == 'counts_file':
+        counts_file, progress_file, size = _open_population_file(populations[0]['file_path'])
+        progress = get_progressbar(size, 'Loading population: {}'.format(slugs))
+        for line in counts_file:
+            progress.update(progress_file.tell())
+            fields = line.strip('\n').split('\t')
+            chrom = 'chr' + fields[0]
+            pos = int(fields[1])
+            xpos = genomeloc.get_single_location(chrom, pos)
+            ref = fields[2]
+            alt = fields[3]
+            if int(fields[5]) == 0:
+                continue
+            freq = float(fields[4]) / float(fields[5])
+            yield xpos, ref, alt, {population['slug']: freq for population in populations}
+        counts_file.close()
+
+    # this is now the canonical allele frequency file -
+    # tab separated file with xpos / ref / alt / freq
+    elif file_type == 'xbrowse_freq_file':
+        counts_file, progress_file, size = _open_population_file(populations[0]['file_path'])
+        progress = get_progressbar(size, 'Loading population: {}'.format(slugs))
+        for line in counts_file:
+            progress.update(progress_file.tell())
+            fields = line.strip('\n').split('\t')
+            xpos = int(fields[0])
+            ref = fields[1]
+            alt = fields[2]
+            freq = float(fields[3])
+            yield xpos, ref, alt, {population['slug']: freq for population in populations}
+        counts_file.close()
+
+    elif file_type == 'tsv_file':
+        freq_file, progress_file, size = _open_population_file(populations[0]['file_path'])
+        progress = get_progressbar(size, 'Loading population: {}'.format(slugs))
+        header = next(freq_file)
+        print("Header: " + header)
+        for line in freq_file:
+            progress.update(progress_file.tell())
+            fields = line.strip('\n').split('\t')
+            chrom = fields[0]
+            pos = int(fields[1])
+            ref = fields[2]
+            alt = fields[3]
+            freq = float(fields[4])
+
+            xpos = genomeloc.get_single_location(chrom, pos)
+            yield xpos, ref, alt, {population['slug']: freq for population in populations}
+        freq_file.close()
+
+    else:
+        raise ValueError("Unexpected population['file_type']: " + file_type)
+
+
+def _is_1kg_popmax(population):
+    return "popmax" in population.get('vcf_info_key', 'AF').lower() and ("1000 Genomes" in population["name"])
+
+
+def _get_vcf_meta_fields(population):
+    """
+    Returns the INFO fields that _get_vcf_population_frequency needs for this population
+    """
+    if population['file_type'] == 'sites_vcf':
+        if _is_1kg_popmax(population):
+            return ONE_KG_POPMAX_META_FIELDS
+        return [population.get('vcf_info_key', 'AF')]
+    elif population['file_type'] == 'sites_vcf_with_counts':
+        return [population['ac_info_key'], population['an_info_key']]
+    return []
+
+
+def _get_vcf_population_frequency(population, variant):
+    """
+    Returns the frequency of variant in population, computed from the genotypes or INFO fields
+    of a VCF row, or None if the row can't be parsed
+    """
+    if population['file_type'] == 'vcf':
+        return get_aaf(variant)
+
+    elif population['file_type'] == 'sites_vcf':
+        allele_idx = variant.extras['alt_allele_pos']
+        if _is_1kg_popmax(population):
+            ##INFO=<ID=EAS_AF,Number=A,Type=Float,Description="Allele frequency in the EAS populations calculated from AC and AN, in the range (0,1)">
+            ##INFO=<ID=EUR_AF,Number=A,Type=Float,Description="Allele frequency in the EUR populations calculated from AC and AN, in the range (0,1)">
+            ##INFO=<ID=AFR_AF,Number=A,Type=Float,Description="Allele frequency in the AFR populations calculated from AC and AN, in the range (0,1)">
+            ##INFO=<ID=AMR_AF,Number=A,Type=Float,Description="Allele frequency in the AMR populations calculated from AC and AN, in the range (0,1)">
+            ##INFO=<ID=SAS_AF,Number=A,Type=Float,Description="Allele frequency in the SAS populations calculated from AC and AN, in the range (0,1)">
+            freq = 0
+            for meta_key in ONE_KG_POPMAX_META_FIELDS:
+                freq = max(freq, float(variant.extras.get(meta_key, 0).split(',')[allele_idx]))
+            return freq
+
+        meta_key = population.get('vcf_info_key', 'AF')
+        return float(variant.extras.get(meta_key, 0).split(',')[allele_idx])
+
+    elif population['file_type'] == 'sites_vcf_with_counts':
+        ac_info_key = population['ac_info_key']
+        an_info_key = population['an_info_key']
+        alt_allele_pos = variant.extras['alt_allele_pos']
+        try:
+            ac = int(variant.extras.get(ac_info_key).split(',')[alt_allele_pos].replace("NA", "0"))
+        except Exception, e:
+            print("Couldn't parse AC value %s from %s: %s" % (alt_allele_pos, ac_info_key, variant.extras), e)
+            return None
+
+        try:
+            if "popmax" in ac_info_key.lower():
+                AN_index = alt_allele_pos  # each allele may have a different AN value from a different population
+            else:
+                AN_index = 0
+
+            an = int(variant.extras.get(an_info_key).split(',')[AN_index].replace("NA", "0"))
+        except Exception, e:
+            print("Couldn't parse AN value %s from %s: %s" % (alt_allele_pos, an_info_key, variant.extras), e)
+            return None
 
+        if an == 0:
+            return 0.0
+        return float(ac)/an
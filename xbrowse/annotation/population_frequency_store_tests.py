@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from xbrowse.annotation import population_frequency_store
+
+
+SITES_VCF_TEXT = """##fileformat=VCFv4.1
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+1\t100\t.\tA\tG\t50\tPASS\tAF=0.25;AC=3;AN=10
+1\t200\t.\tC\tT,G\t50\tPASS\tAF=0.1,0.2;AC=1,NA;AN=0
+"""
+
+
+class PopulationFrequencyStoreTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.vcf_file_path = os.path.join(self.temp_dir, 'sites.vcf')
+        with open(self.vcf_file_path, 'w') as f:
+            f.write(SITES_VCF_TEXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_iterate_merged_populations(self):
+        populations = [
+            {'slug': 'af', 'name': 'AF', 'file_type': 'sites_vcf', 'file_path': self.vcf_file_path, 'vcf_info_key': 'AF'},
+            {'slug': 'counts', 'name': 'Counts', 'file_type': 'sites_vcf_with_counts', 'file_path': self.vcf_file_path,
+                'ac_info_key': 'AC', 'an_info_key': 'AN'},
+        ]
+        self.assertEqual(
+            population_frequency_store._get_population_source(populations[0]),
+            population_frequency_store._get_population_source(populations[1]))
+
+        actual = list(population_frequency_store.iterate_population_frequencies(populations))
+        self.assertEqual(actual, [
+            (1000000100, 'A', 'G', {'af': 0.25, 'counts': 0.3}),
+            (1000000200, 'C', 'T', {'af': 0.1, 'counts': 0.0}),
+            (1000000200, 'C', 'G', {'af': 0.2, 'counts': 0.0}),
+        ])
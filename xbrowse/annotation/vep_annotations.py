@@ -1,9 +1,11 @@
 import datetime
 import os
 import re
-#import sh
+import subprocess
 import tempfile
-from collections import defaultdict
+import threading
+from collections import defaultdict, deque
+from multiprocessing.pool import ThreadPool
 from xbrowse import vcf_stuff
 from tqdm import tqdm
 
@@ -53,29 +55,70 @@ CODING_POS_CUTOFF = SO_SEVERITY_ORDER_POS['coding_sequence_variant']
 NUM_SO_TERMS = len(SO_SEVERITY_ORDER)
 
 
+class _VEPProcesses(object):
+    """
+    The VEP subprocesses started for one get_vep_annotations_for_variants call, so they can all be killed if it
+    stops early - the pool threads waiting on them can't be stopped
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._killed = False
+
+    def start(self, vep_command, **popen_kwargs):
+        with self._lock:
+            if self._killed:
+                raise RuntimeError("VEP processes were killed")
+            vep_process = subprocess.Popen(vep_command, **popen_kwargs)
+            self._processes.add(vep_process)
+        return vep_process
+
+    def finished(self, vep_process):
+        with self._lock:
+            self._processes.discard(vep_process)
+
+    def kill_all(self):
+        with self._lock:
+            self._killed = True
+            for vep_process in self._processes:
+                if vep_process.poll() is None:
+                    vep_process.kill()
+
+
 class HackedVEPAnnotator():
     """
     xBrowse depends on VEP annotations -
     This class is a wrapper around VEP that provides a pythonic interface to VEP annotations
     It should just call the REST API, but that is slow, so it spins out subprocesses :(
     """
-    def __init__(self, vep_perl_path, vep_cache_dir, vep_batch_size=20000, human_ancestor_fa=None):
+    def __init__(self, vep_perl_path, vep_cache_dir, vep_batch_size=20000, human_ancestor_fa=None, vep_num_processes=1, vep_fork=4, vep_streaming=False):
+        """
+        Args:
+            vep_num_processes (int): how many VEP subprocesses to run at once, each on its own batch
+            vep_fork (int): value of VEP's own --fork option, used by each of these subprocesses
+            vep_streaming (bool): if True, pipe sites VCF lines into VEP's stdin and parse its stdout as
+                it's written, instead of round-tripping each batch through temp files
+        """
         self._vep_perl_path = vep_perl_path
         self._vep_cache_dir = vep_cache_dir
         self._vep_batch_size = vep_batch_size
         self._human_ancestor_fa = human_ancestor_fa
+        self._vep_num_processes = vep_num_processes
+        self._vep_fork = vep_fork
+        self._vep_streaming = vep_streaming
 
-    def _run_vep(self, input_vcf, output_vcf):
+    def _get_vep_command(self, input_vcf, output_vcf):
         """
-        Just run VEP to the xbrowse configurations
+        Returns the VEP command line, as a list. input_vcf and output_vcf can be "STDIN" and "STDOUT"
         """
         vep_command = [
+            "perl",
             self._vep_perl_path,
             "--offline",
             "--cache",
             "--everything",  # http://useast.ensembl.org/info/docs/tools/vep/script/vep_options.html#opt_everything
             "--vcf",
-            "--fork", "4",
+            "--fork", str(self._vep_fork),
             "--fasta", os.path.join(self._vep_cache_dir,
                 "homo_sapiens/78_GRCh37/Homo_sapiens.GRCh37.75.dna.primary_assembly.fa"),
             "--force_overwrite",
@@ -83,13 +126,94 @@ class HackedVEPAnnotator():
             "-i", input_vcf,
             "-o", output_vcf,
         ]
+        if output_vcf == "STDOUT":
+            # otherwise VEP writes the stats file next to the output
+            vep_command.append("--no_stats")
         if self._human_ancestor_fa is not None:
             vep_command += [
                 "--plugin", "LoF,human_ancestor_fa:{}".format(self._human_ancestor_fa),
             ]
 
+        return vep_command
+
+    def _run_vep(self, input_vcf, output_vcf, vep_processes=None):
+        """
+        Just run VEP to the xbrowse configurations
+        """
+        vep_command = self._get_vep_command(input_vcf, output_vcf)
         print("Running VEP:\n" + " ".join(vep_command))
-        sh.perl(vep_command)
+        vep_processes = vep_processes or _VEPProcesses()
+        vep_process = vep_processes.start(vep_command)
+        try:
+            vep_process.wait()
+        finally:
+            vep_processes.finished(vep_process)
+        if vep_process.returncode != 0:
+            raise subprocess.CalledProcessError(vep_process.returncode, " ".join(vep_command))
+
+    def _stream_batch(self, variant_t_batch, vep_processes=None):
+        """
+        Generator version of _process_batch that doesn't use temp files: a writer thread feeds the sites
+        VCF into VEP's stdin while this thread parses VEP's stdout. Both pipes block when full, so
+        neither side gets ahead of the other by more than the OS pipe buffer.
+        """
+        vep_command = self._get_vep_command("STDIN", "STDOUT")
+        print("Streaming VEP:\n" + " ".join(vep_command))
+        vep_processes = vep_processes or _VEPProcesses()
+        vep_process = vep_processes.start(vep_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def write_input():
+            try:
+                vcf_stuff.write_sites_vcf(vep_process.stdin, variant_t_batch)
+            except IOError:
+                pass  # VEP exited early - its return code is checked below
+            finally:
+                vep_process.stdin.close()
+
+        writer_thread = threading.Thread(target=write_input)
+        writer_thread.daemon = True
+        writer_thread.start()
+
+        finished = False
+        try:
+            # readline, unlike file iteration, doesn't wait for a full read-ahead buffer before returning a line
+            for variant, annotation in parse_vep_annotations_from_vcf(iter(vep_process.stdout.readline, '')):
+                yield variant.unique_tuple(), annotation
+            finished = True
+        finally:
+            if not finished and vep_process.poll() is None:
+                # the consumer stopped early, or parsing failed
+                vep_process.kill()
+            vep_process.wait()
+            vep_processes.finished(vep_process)
+            writer_thread.join()
+            vep_process.stdout.close()
+
+        if vep_process.returncode != 0:
+            raise subprocess.CalledProcessError(vep_process.returncode, " ".join(vep_command))
+
+    def _process_batch(self, variant_t_batch, vep_processes=None):
+        """
+        Write variant_t_batch to a sites VCF, run VEP on it, and return the parsed list of
+        (variant tuple, vep annotation) pairs
+        vep_processes (_VEPProcesses) tracks the VEP subprocess, so the caller can kill it
+        """
+        if self._vep_streaming:
+            return list(self._stream_batch(variant_t_batch, vep_processes))
+
+        vep_input_file_path = tempfile.mkstemp()[1]
+        vep_output_file_path = tempfile.mkstemp()[1]
+        try:
+            with open(vep_input_file_path, 'w') as vep_input_file:
+                vcf_stuff.write_sites_vcf(vep_input_file, variant_t_batch)
+
+            self._run_vep(vep_input_file_path, vep_output_file_path, vep_processes)
+
+            with open(vep_output_file_path) as f:
+                return [(variant.unique_tuple(), annotation) for variant, annotation in parse_vep_annotations_from_vcf(f)]
+        finally:
+            os.remove(vep_input_file_path)
+            os.remove(vep_output_file_path)
 
     def get_vep_annotations_for_variants(self, variant_t_list):
         """
@@ -98,37 +222,55 @@ class HackedVEPAnnotator():
         - runs VEP on the temp VCF file
         - loads newly annotated VCF to annotator
         Obviously there should be a better way to do this, but this is what we have for now
+
+        Up to vep_num_processes batches are processed at once - while VEP runs on some batches, the next
+        batch's input is written and finished batches are parsed. Annotations are still yielded in the
+        same order as variant_t_list.
         """
 
-        def process_batch(variant_t_batch):
-            vep_input_file_path = tempfile.mkstemp()[1]
-            vep_output_file_path = tempfile.mkstemp()[1]
+        def iter_batches():
+            batch = []
+            for variant_t in variant_t_list:
+                batch.append(variant_t)
+                if len(batch) == self._vep_batch_size:
+                    print "Running VEP on next {} variants, through {}".format(self._vep_batch_size, variant_t[0])
+                    yield batch
+                    batch = []
+            if len(batch) > 0:
+                yield batch
+
+        if self._vep_num_processes <= 1:
+            for batch in iter_batches():
+                if self._vep_streaming:
+                    # yield annotations while VEP is still running on the rest of the batch
+                    annotations = self._stream_batch(batch)
+                else:
+                    annotations = self._process_batch(batch)
+                for variant_t, annotation in annotations:
+                    yield variant_t, annotation
+            return
+
+        # threads are enough here, since the heavy lifting happens in the VEP subprocesses
+        pool = ThreadPool(self._vep_num_processes)
+        vep_processes = _VEPProcesses()
+        try:
+            pending_results = deque()
+            for batch in iter_batches():
+                pending_results.append(pool.apply_async(self._process_batch, (batch, vep_processes)))
 
-            vep_input_file = open(vep_input_file_path, 'w')
-            vcf_stuff.write_sites_vcf(vep_input_file, variant_t_batch)
-            vep_input_file.close()
+                # don't submit more batches than there are workers, so that at most one batch is waiting
+                # in the queue and annotations aren't held in memory faster than they're consumed
+                while len(pending_results) > self._vep_num_processes:
+                    for variant_t, annotation in pending_results.popleft().get():
+                        yield variant_t, annotation
 
-            self._run_vep(vep_input_file_path, vep_output_file_path)
-
-            with open(vep_output_file_path) as f:
-                ret = list(parse_vep_annotations_from_vcf(f))
-            os.remove(vep_input_file_path)
-            os.remove(vep_output_file_path)
-            return ret
-
-        batch = []
-        for variant_t in variant_t_list:
-            batch.append(variant_t)
-            if len(batch) == self._vep_batch_size:
-                print "Running VEP on next {} variants, through {}".format(self._vep_batch_size, variant_t[0])
-                annotations = process_batch(batch)
-                for variant, annotation in annotations:
-                    yield variant.unique_tuple(), annotation
-                batch = []
-        if len(batch) > 0:
-            annotations = process_batch(batch)
-            for variant, annotation in annotations:
-                yield variant.unique_tuple(), annotation
+            while pending_results:
+                for variant_t, annotation in pending_results.popleft().get():
+                    yield variant_t, annotation
+        finally:
+            # if a batch failed or the consumer stopped early, don't leave the other batches' VEPs running
+            vep_processes.kill_all()
+            pool.terminate()
 
 
 def parse_vep_annotations_from_vcf(vcf_file_obj):
@@ -255,18 +397,17 @@ def get_worst_vep_annotation(vep_variant_consequence_strings):
         The string from the list which is considered the worst effect in terms of severity.
     """
 
-    vep_variant_severity_indexes = []
-    for s in set(vep_variant_consequence_strings):
-        try:
-            vep_variant_severity_indexes.append(
-                SO_SEVERITY_ORDER.index(s))
-        except ValueError as e:
-            print(str(e) + ".  Unexpected consequence string contains: " + ", ".join(map(str, vep_variant_consequence_strings)))
+    worst_i = None
+    for s in vep_variant_consequence_strings:
+        i = SO_SEVERITY_ORDER_POS.get(s)
+        if i is None:
+            print("'%s' is not in list.  Unexpected consequence string contains: %s" % (s, ", ".join(map(str, vep_variant_consequence_strings))))
             continue
+        if worst_i is None or i < worst_i:
+            worst_i = i
 
-    if not vep_variant_severity_indexes:
+    if worst_i is None:
         return None
-    worst_i = min(vep_variant_severity_indexes)
     return SO_SEVERITY_ORDER[worst_i]
 
 
@@ -320,43 +461,89 @@ def get_worst_vep_annotation_index(transcript_annotations, gene_id=None):
         annotations = protein_coding_transcript_annotations
 
     # find the transcript(s) affected with the worst severity
-    worst_severity = 10**9   # lower numbers are worse severity
-    worst_severity_annotations = []  # a list of worst-severity transcripts
+    worst_key = None
+    worst_severity_annotation_index = None
     for i, transcript_annotation in annotations:
-        try:
-            severity_scale = SO_SEVERITY_ORDER.index(
-                transcript_annotation['consequence'])
-        except ValueError as e:
-            print(str(e) + ".  Unexpected consequence string in " + str(transcript_annotation))
-            continue
+        key = _get_transcript_sort_key(i, transcript_annotation)
+        if key is not None and (worst_key is None or key < worst_key):
+            worst_key = key
+            worst_severity_annotation_index = i
 
-        # hack: this is to deprioritize noncoding and nonsense mediated decay transcripts
-        if transcript_annotation['is_nc']:
-            severity_scale += NUM_SO_TERMS
-        if transcript_annotation['is_nmd']:
-            severity_scale += 2*NUM_SO_TERMS
+    return worst_severity_annotation_index
 
-        if severity_scale <= worst_severity:
-            if severity_scale < worst_severity:
-                worst_severity_annotations = []
-                worst_severity = severity_scale
 
-            worst_severity_annotations.append((i, transcript_annotation))
+def get_worst_vep_annotation_indexes(transcript_annotations, gene_ids=()):
+    """
+    Single-pass version of get_worst_vep_annotation_index for when both the worst transcript overall and the
+    worst transcript of each of several genes are needed.
 
-    # if multiple transcripts have the same worst severity, chose the canonical transcript
-    for i, transcript_annotation in worst_severity_annotations:
-        if transcript_annotation['canonical']:
-            worst_severity_annotation_index = i
-            break
-    else:
-        # otherwise, sort transcripts alphabetically by transcript id and return the 1st one
-        if worst_severity_annotations:
-            worst_severity_annotations.sort(key=lambda x: x[1]['feature'])
-            worst_severity_annotation_index, _ = worst_severity_annotations[0]
-        else:
-            worst_severity_annotation_index = None
+    Args:
+        transcript_annotations: a list where each element represents VEP annotations
+            for a different transcript (parsed from a VCF record's CSQ field).
+        gene_ids: the genes to find the worst transcript for
+    Returns:
+        (worst index overall, {gene_id: worst index for that gene}) - the same indexes that
+        get_worst_vep_annotation_index returns with and without gene_id
+    """
+    if not transcript_annotations:
+        raise ValueError("transcript_annotations is empty")
 
-    return worst_severity_annotation_index
+    gene_ids = set(gene_ids)
+
+    # for the variant overall and each gene: [worst key among protein-coding transcripts, worst key among
+    # the other transcripts, whether there are protein-coding transcripts, whether there are any transcripts]
+    overall = [None, None, False, True]
+    per_gene = {gene_id: [None, None, False, False] for gene_id in gene_ids}
+    for i, transcript_annotation in enumerate(transcript_annotations):
+        is_protein_coding = transcript_annotation['biotype'] == "protein_coding"
+        key = _get_transcript_sort_key(i, transcript_annotation)
+
+        groups = [overall]
+        if transcript_annotation['gene'] in per_gene:
+            groups.append(per_gene[transcript_annotation['gene']])
+        for group in groups:
+            group[3] = True
+            if is_protein_coding:
+                group[2] = True
+            if key is not None:
+                j = 0 if is_protein_coding else 1
+                if group[j] is None or key < group[j]:
+                    group[j] = key
+
+    def get_index(group):
+        # if 1 or more transcripts is protein-coding, discard the non-protein-coding transcripts
+        key = group[0] if group[2] else group[1]
+        return key[-1] if key is not None else None
+
+    worst_index_per_gene = {}
+    for gene_id, group in per_gene.items():
+        if not group[3]:
+            raise ValueError("None of the transcripts in %s have gene_id: '%s'" % (transcript_annotations, gene_id))
+        worst_index_per_gene[gene_id] = get_index(group)
+
+    return get_index(overall), worst_index_per_gene
+
+
+def _get_transcript_sort_key(i, transcript_annotation):
+    """
+    Returns a key that sorts transcripts from worst to least severe consequence. Among transcripts with the same
+    severity, the first canonical transcript comes first, and otherwise the one with the alphabetically first
+    transcript id. Returns None if the consequence is unexpected.
+    """
+    severity_scale = SO_SEVERITY_ORDER_POS.get(transcript_annotation['consequence'])
+    if severity_scale is None:
+        print("'%s' is not in list.  Unexpected consequence string in %s" % (transcript_annotation['consequence'], transcript_annotation))
+        return None
+
+    # hack: this is to deprioritize noncoding and nonsense mediated decay transcripts
+    if transcript_annotation['is_nc']:
+        severity_scale += NUM_SO_TERMS
+    if transcript_annotation['is_nmd']:
+        severity_scale += 2*NUM_SO_TERMS
+
+    if transcript_annotation['canonical']:
+        return (severity_scale, 0, '', i)
+    return (severity_scale, 1, transcript_annotation['feature'], i)
 
 
 def get_gene_ids(vep_annotation):
@@ -0,0 +1,154 @@
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from django.test import TestCase
+from xbrowse.annotation import vep_annotations
+from xbrowse.annotation.vep_annotations import HackedVEPAnnotator
+
+
+# stands in for VEP: reads a sites VCF on stdin and writes it to stdout with a CSQ field added
+FAKE_VEP_SCRIPT = """
+import sys
+CSQ_FIELDS = "Allele|Gene|Feature|Feature_type|Consequence|BIOTYPE|CANONICAL|ALLELE_NUM"
+for line in iter(sys.stdin.readline, ''):
+    if line.startswith('#CHROM'):
+        sys.stdout.write('##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. Format: %s">\\n' % CSQ_FIELDS)
+        sys.stdout.write(line)
+    elif line.startswith('#'):
+        sys.stdout.write(line)
+    else:
+        fields = line.rstrip('\\n').split('\\t')
+        fields[7] = 'CSQ=%s|ENSG00000001|ENST00000001|Transcript|missense_variant|protein_coding|YES|1' % fields[4]
+        sys.stdout.write('\\t'.join(fields) + '\\n')
+    sys.stdout.flush()
+"""
+
+# stands in for VEP on a batch file: hangs on most batches, but fails on the batch with the first variant once
+# the VEPs for two other batches have started
+FAILING_FAKE_VEP_SCRIPT = """
+import os, sys, time
+if '\\t1\\t' in open(sys.argv[1]).read():
+    for _ in range(200):
+        if len([name for name in os.listdir(sys.argv[2]) if name.endswith('.pid')]) >= 2:
+            break
+        time.sleep(0.05)
+    sys.exit(1)
+with open(os.path.join(sys.argv[2], '%s.pid' % os.getpid()), 'w'):
+    pass
+time.sleep(60)
+"""
+
+
+class SlowFakeVEPAnnotator(HackedVEPAnnotator):
+    """Stands in for VEP: earlier batches take longer, so batches finish out of order"""
+
+    def _process_batch(self, variant_t_batch, vep_processes=None):
+        time.sleep(0.01 * (10 - variant_t_batch[0][0] % 10))
+        return [(variant_t, [{'consequence': 'missense_variant'}]) for variant_t in variant_t_batch]
+
+
+class FakeVEPAnnotator(HackedVEPAnnotator):
+    """Runs FAKE_VEP_SCRIPT instead of VEP"""
+
+    def __init__(self, fake_vep_script_path, **kwargs):
+        HackedVEPAnnotator.__init__(self, vep_perl_path=None, vep_cache_dir=None, **kwargs)
+        self._fake_vep_script_path = fake_vep_script_path
+
+    def _get_vep_command(self, input_vcf, output_vcf):
+        return [sys.executable, self._fake_vep_script_path]
+
+
+class HackedVEPAnnotatorTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.fake_vep_script_path = os.path.join(self.temp_dir, 'fake_vep.py')
+        with open(self.fake_vep_script_path, 'w') as f:
+            f.write(FAKE_VEP_SCRIPT)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_concurrent_batches_preserve_order(self):
+        variant_t_list = [(1000000000 + i, 'A', 'G') for i in range(50)]
+        for vep_num_processes in [1, 3]:
+            vep_annotator = SlowFakeVEPAnnotator(
+                vep_perl_path=None, vep_cache_dir=None, vep_batch_size=4, vep_num_processes=vep_num_processes)
+            results = list(vep_annotator.get_vep_annotations_for_variants(variant_t_list))
+            self.assertEqual([variant_t for variant_t, annotation in results], variant_t_list)
+
+    def test_streaming(self):
+        variant_t_list = [(1000000000 + i, 'A', 'G') for i in range(1, 30)] + [(2000000100, 'CT', 'C')]
+        for vep_num_processes in [1, 2]:
+            vep_annotator = FakeVEPAnnotator(
+                self.fake_vep_script_path, vep_batch_size=7, vep_num_processes=vep_num_processes, vep_streaming=True)
+            results = list(vep_annotator.get_vep_annotations_for_variants(variant_t_list))
+            self.assertEqual([variant_t for variant_t, annotation in results], variant_t_list)
+            self.assertEqual(results[0][1][0]['consequence'], 'missense_variant')
+            self.assertEqual(results[0][1][0]['gene'], 'ENSG00000001')
+
+    def test_streaming_consumer_stops_early(self):
+        variant_t_list = [(1000000000 + i, 'A', 'G') for i in range(1, 1000)]
+        vep_annotator = FakeVEPAnnotator(self.fake_vep_script_path, vep_batch_size=1000, vep_streaming=True)
+        annotations = vep_annotator.get_vep_annotations_for_variants(variant_t_list)
+        self.assertEqual(next(annotations)[0], variant_t_list[0])
+        annotations.close()
+
+    def test_failed_batch_kills_other_batches(self):
+        failing_fake_vep_script_path = os.path.join(self.temp_dir, 'failing_fake_vep.py')
+        with open(failing_fake_vep_script_path, 'w') as f:
+            f.write(FAILING_FAKE_VEP_SCRIPT)
+        vep_annotator = FakeVEPAnnotator(failing_fake_vep_script_path, vep_batch_size=1, vep_num_processes=3)
+        vep_annotator._get_vep_command = lambda input_vcf, output_vcf: [
+            sys.executable, failing_fake_vep_script_path, input_vcf, self.temp_dir]
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(vep_annotator.get_vep_annotations_for_variants([(1000000000 + i, 'A', 'G') for i in range(1, 4)]))
+
+        pids = [int(name.split('.')[0]) for name in os.listdir(self.temp_dir) if name.endswith('.pid')]
+        self.assertEqual(len(pids), 2)
+        for pid in pids:
+            for _ in range(100):
+                try:
+                    os.kill(pid, 0)
+                except OSError:
+                    break  # killed and reaped
+                time.sleep(0.05)
+            else:
+                self.fail("VEP process %s is still running" % pid)
+
+
+class WorstVepAnnotationTest(TestCase):
+
+    def test_get_worst_vep_annotation(self):
+        self.assertEqual(vep_annotations.get_worst_vep_annotation(['intron_variant', 'missense_variant']), 'missense_variant')
+        self.assertEqual(vep_annotations.get_worst_vep_annotation(['not_a_consequence']), None)
+
+    def test_single_pass_matches_per_gene_selection(self):
+        rand = random.Random(1)
+        consequences = ['stop_gained', 'missense_variant', 'synonymous_variant', 'intron_variant', 'not_a_consequence']
+        for _ in range(500):
+            transcript_annotations = [{
+                'gene': rand.choice(['ENSG1', 'ENSG2', 'ENSG3']),
+                'feature': rand.choice(['ENST1', 'ENST2', 'ENST3']),
+                'consequence': rand.choice(consequences),
+                'biotype': rand.choice(['protein_coding', 'lincRNA']),
+                'canonical': rand.choice(['YES', '']),
+                'is_nc': rand.random() < 0.2,
+                'is_nmd': rand.random() < 0.2,
+            } for _ in range(rand.randint(1, 8))]
+            gene_ids = vep_annotations.get_gene_ids(transcript_annotations)
+
+            worst_index, worst_index_per_gene = vep_annotations.get_worst_vep_annotation_indexes(transcript_annotations, gene_ids)
+            self.assertEqual(worst_index, vep_annotations.get_worst_vep_annotation_index(transcript_annotations))
+            self.assertEqual(worst_index_per_gene, {
+                gene_id: vep_annotations.get_worst_vep_annotation_index(transcript_annotations, gene_id=gene_id)
+                for gene_id in gene_ids
+            })
+
+        with self.assertRaises(ValueError):
+            vep_annotations.get_worst_vep_annotation_indexes(transcript_annotations, ['ENSG4'])
@@ -1,10 +1,10 @@
 from xbrowse.core import genomeloc
-#import banyan
+from xbrowse.utils.interval_index import IntervalIndex
 
 
 class GenomeSubsetFilter():
     """
-    This class represents a subset of nonoverlapping intervals in the genome
+    This class represents a subset of intervals in the genome
     It is used for filtering variants, and is most commonly used to represent an exome target -
     but can be used for many other purposes
     TODO: right now this assumes variants are 1 base long - need to expand to cover all those corner cases
@@ -17,32 +17,16 @@ class GenomeSubsetFilter():
         if len(intervals) == 0:
             raise Exception("Intervals cannot have length 0")
         self.intervals = intervals
-        # removing because banyan was causing install problems and we don't actually use this
-        #self.interval_tree = banyan.SortedSet(intervals, updator=banyan.OverlappingIntervalsUpdator)
+        self.interval_index = IntervalIndex((xstart, xend, True) for xstart, xend in intervals)
 
     def filter_variant_list(self, variant_t_list):
         """
+        variant_t_list must be sorted by xpos
         Returns:
             List of (variant, True/False) tuples, indicating whether variant falls in this GenomeSubset
         """
-        ret = []
-
-        interval_i = iter(self.intervals)
-        next_interval = interval_i.next()
-
-        for variant_t in variant_t_list:
-            # if variant is past target, get new target
-            try:
-                while variant_t[0] > next_interval[1]:
-                    next_interval = interval_i.next()
-            except StopIteration:
-                pass
-            if next_interval[0] <= variant_t[0] <= next_interval[1]:
-                ret.append((variant_t, True))
-            else:
-                ret.append((variant_t, False))
-
-        return ret
+        queries = ((variant_t[0], variant_t[0], variant_t) for variant_t in variant_t_list)
+        return [(query[2], bool(overlapping)) for query, overlapping in self.interval_index.overlap_sorted(queries)]
 
 
 def create_genome_subset_from_interval_list(interval_list_file):
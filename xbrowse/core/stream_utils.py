@@ -3,83 +3,120 @@ Many of the lookups in xbrowse are returned as streams,
 Streams themselves can be operated on with these utils
 """
 
-import Queue
 import heapq
 import itertools
+import logging
 
+logger = logging.getLogger(__name__)
 
-def combine_variant_streams(stream_list):
+# gene streams hold each gene until the variant stream is this far past its end. VEP annotates variants up to 5kb
+# outside a gene with it, and annotations from a different gene model than the reference can be further out still
+GENE_HOLD_DISTANCE = 1000000
+
+
+def _keyed_stream(stream, key_func, stream_index):
     """
-    Combines an arbitraty number of variant streams into a single stream, in genomic order
-    Each input stream must be in genomic order
+    Wraps each item of a stream as (key, stream index, index in stream, item), so merges never have to compare items
+    Raises ValueError if the stream isn't sorted by key, since the merge would silently be out of order
     """
+    previous_key = None
+    for i, item in enumerate(stream):
+        key = key_func(item)
+        if previous_key is not None and key < previous_key:
+            raise ValueError("Stream %s is out of order: %s came after %s" % (stream_index, key, previous_key))
+        previous_key = key
+        yield key, stream_index, i, item
 
-    # priority queue stores tuples of (genomic order, stream index, variant)
-    # TODO: Queue or heapq?
-    variant_queue = Queue.PriorityQueue()
 
-    for stream_index, stream in enumerate(stream_list):
+def _merge_streams(stream_list, key_func):
+    """
+    k-way merge of streams that are each sorted by key_func; ties are returned in stream order
+    """
+    keyed_streams = [_keyed_stream(stream, key_func, stream_index) for stream_index, stream in enumerate(stream_list)]
+    for _, _, _, item in heapq.merge(*keyed_streams):
+        yield item
 
-        try:
-            variant = stream.next()
-            variant_queue.put((variant.xpos, stream_index, variant))
-        except StopIteration:
-            pass
 
-    while True:
+def _gene_stream_key(reference, gene_id):
+    """
+    Order that genes are yielded in gene streams: by gene end (plus GENE_HOLD_DISTANCE), as that's when a gene is
+    complete. Genes that aren't in the reference go last
+    """
+    gene_bounds = reference.get_gene_bounds(gene_id)
+    return (gene_bounds[1] + GENE_HOLD_DISTANCE if gene_bounds else float('inf')), gene_id
 
-        if variant_queue.empty():
-            raise StopIteration
-        else:
-            pos, stream_index, variant = variant_queue.get()
 
-        try:
-            next_variant = stream_list[stream_index].next()
-            variant_queue.put((next_variant.xpos, stream_index, next_variant))
-        except StopIteration:
-            pass
+def combine_variant_streams(stream_list):
+    """
+    Combines an arbitraty number of variant streams into a single stream, in genomic order
+    Each input stream must be in genomic order
+    """
+    return _merge_streams(stream_list, lambda variant: variant.xpos)
 
-        yield variant
 
 def unique_variant_stream(stream):
     """
     Remove duplicate variants from a stream.
     To be "duplicate", variant need only the same single_position, ref, and alt -- so genotypes ignored
     Should only use this streams from the same data source
+    Stream must be in genomic order, so only the variants at the current position need to be remembered
     """
-    raise NotImplementedError
+    current_xpos = None
+    current_variants = set()
+    for variant in stream:
+        if variant.xpos != current_xpos:
+            current_xpos = variant.xpos
+            current_variants = set()
+        vartuple = (variant.xpos, variant.ref, variant.alt)
+        if vartuple not in current_variants:
+            current_variants.add(vartuple)
+            yield variant
 
 
 def variant_stream_to_gene_stream(stream, reference):
     """
     Turns a variant stream into a stream of tuples (gene, variant_list)
-    Allows multiple gene annotations, but requires gene annotations to be contiguous
+    Input stream must be in genomic order; variants can be annotated with multiple genes
     TODO: should switch to generic regions instead of gene
-    TODO: check this for corner cases - what if variant / gene order is awkward?
 
     Algorithm: look through genome, keep track of which genes you are currently reading (current_genes)
-    For each variant:
-    -- get list of genes
-    -- add variant to each in current_genes
-    -- if any genes didn't get a variant added, yield them
+    along with a heap of their end positions. For each variant:
+    -- yield any current genes that end (plus GENE_HOLD_DISTANCE) before this variant
+    -- add variant to each of its genes
 
+    So genes are yielded once the stream is well past them, in order of gene end, and each gene is yielded once.
+    Genes that aren't in the reference are held until the end of the stream.
+    A variant annotated with a gene that ends more than GENE_HOLD_DISTANCE before it can't be added to that gene
+    without yielding genes out of order, so it's left out of that gene, with a warning.
     """
     current_genes = {}
-    while True:
-        try:
-            variant = stream.next()
-        except StopIteration:
-            for gene, variants in current_genes.items():
-                yield (gene, variants)
-            raise StopIteration
-
-        genes = variant.gene_ids
-        for gene in genes:
-            if gene == '':
+    gene_ends = []  # heap of _gene_stream_key for current_genes
+    skipped_genes = set()
+
+    for variant in stream:
+        while gene_ends and gene_ends[0][0] < variant.xpos:
+            _, gene_id = heapq.heappop(gene_ends)
+            yield (gene_id, current_genes.pop(gene_id))
+
+        for gene_id in variant.gene_ids:
+            if gene_id == '':
                 continue
-            if not gene in current_genes:
-                current_genes[gene] = []
-            current_genes[gene].append(variant)
+            if gene_id not in current_genes:
+                key = _gene_stream_key(reference, gene_id)
+                if key[0] < variant.xpos:
+                    # the gene was already yielded, or should have been
+                    if gene_id not in skipped_genes:
+                        skipped_genes.add(gene_id)
+                        logger.warning("Variant at %s is annotated with gene %s, which ends more than %s before it. "
+                                       "Leaving it out of the gene." % (variant.xpos, gene_id, GENE_HOLD_DISTANCE))
+                    continue
+                current_genes[gene_id] = []
+                heapq.heappush(gene_ends, key)
+            current_genes[gene_id].append(variant)
+
+    while gene_ends:
+        _, gene_id = heapq.heappop(gene_ends)
+        yield (gene_id, current_genes.pop(gene_id))
 
 
 # TODO: tests for ref/alt corner cases
@@ -119,53 +156,16 @@ def _sort_variant_list(variant_list):
 def combine_gene_streams(stream_list, reference):
     """
     Analagous to combine_variant_streams;
-    combines an arbitraty number of gene streams into a single stream, in genomic order
+    combines an arbitraty number of gene streams into a single stream, in the same order as variant_stream_to_gene_stream
+    Each input stream must be in that order (eg. be from variant_stream_to_gene_stream)
     Genes are combined - variant lists are merged; but
     does *not* eliminate duplicate variants...see remove_duplicate_variants_from_gene_stream
-
-    TODO: results not necessarily sorted, because no way to access gene coords.
-    Need to add dependency on reference
-
-    Algorithm (TODO: switch to priority queue after we get gene order)
-    -- Get a gene from all streams
-    -- Combine genes that need to be combined
-    -- Return each gene
+    Streams are merged by _gene_stream_key, the key variant_stream_to_gene_stream yields genes in - it only depends
+    on the gene, so a gene's entries from different streams are adjacent in the merged stream
     """
-
-    next_genes = {}  # map from gene -> list of variant lists
-    gene_queue = []  # priority queue for identifying next closest gene.
-                     # Elements are tuples of (gene position, gene name, stream index)
-
-    def add_gene(stream_index):
-        gene, variant_list = stream_list[stream_index].next()
-        if gene in next_genes:
-            next_genes[gene].append(variant_list)
-            add_gene(stream_index)
-        else:
-            next_genes[gene] = [variant_list, ]
-            heapq.heappush(gene_queue, (reference.get_gene_bounds(gene), gene, stream_index))
-
-    for i, stream in enumerate(stream_list):
-        try:
-            add_gene(i)
-        except StopIteration:
-            pass
-
-    while True:
-
-        if len(next_genes) == 0:
-            raise StopIteration
-
-        position, gene_name, stream_index = heapq.heappop(gene_queue)
-        try:
-            add_gene(stream_index)
-        except StopIteration:
-            pass
-
-        list_of_lists = next_genes[gene_name]
-        del next_genes[gene_name]  # only need to delete from next_genes; heappop deletes from other
-
-        yield (gene_name, _combine_variant_lists(list_of_lists))
+    genes = _merge_streams(stream_list, lambda gene: _gene_stream_key(reference, gene[0]))
+    for gene_id, gene_group in itertools.groupby(genes, key=lambda gene: gene[0]):
+        yield (gene_id, _combine_variant_lists([variant_list for _, variant_list in gene_group]))
 
 
 def remove_duplicate_variants_from_gene_stream(gene_stream):
@@ -180,40 +180,19 @@ def remove_duplicate_variants_from_gene_stream(gene_stream):
 
 def gene_stream_to_variant_stream(gene_stream, reference):
     """
-    TODO: does not guarantee variants are in order if genes overlap
-    TODO: remove duplicate variants
+    Variants from a gene stream, in genomic order and without duplicates
+    Gene streams are in order of gene end, and a later gene can always start further back,
+    so no variant can be yielded until the whole gene stream is read
     """
-    variant_queue = []
+    variant_queue = []  # heap of ((xpos, ref, alt), variant)
     pending_variants = set()
 
-    # gets tuple for random access
-    def get_tuple(variant):
-        return variant.xpos, variant.ref, variant.alt
-
-    # Flush all variants that end *before* pos
-    def flush_to(pos):
-        while True:
-            _next = heapq.nsmallest(1, variant_queue)
-            if len(_next) == 0:
-                break
-            next_variant = _next[0][1]
-
-            if next_variant.xposx < pos:
-                heapq.heappop(variant_queue)
-                pending_variants.discard(get_tuple(next_variant))
-                yield next_variant
-            else:
-                break
-
     for gene_id, variant_list in gene_stream:
         for variant in variant_list:
-            vartuple = get_tuple(variant)
+            vartuple = (variant.xpos, variant.ref, variant.alt)
             if vartuple not in pending_variants:
                 pending_variants.add(vartuple)
-                heapq.heappush(variant_queue, (variant.xpos, variant))
-        start_of_gene = reference.get_gene_bounds(gene_id)
-        if start_of_gene is not None:
-            flush_to(start_of_gene[0])
+                heapq.heappush(variant_queue, (vartuple, variant))
 
-    for item in flush_to(25e9):
-        yield item
+    while variant_queue:
+        yield heapq.heappop(variant_queue)[1]
@@ -0,0 +1,122 @@
+from django.test import TestCase
+from xbrowse.core import stream_utils
+
+
+class FakeVariant(object):
+
+    def __init__(self, xpos, gene_ids, ref='A', alt='G'):
+        self.xpos = xpos
+        self.gene_ids = gene_ids
+        self.ref = ref
+        self.alt = alt
+
+
+class FakeReference(object):
+
+    def __init__(self, gene_positions):
+        self.gene_positions = gene_positions
+
+    def get_gene_bounds(self, gene_id):
+        return self.gene_positions.get(gene_id)
+
+
+def get_variants_past_a_flushed_gene():
+    reference = FakeReference({
+        'A': [1000010000, 1000020000],
+        'B': [1000030000, 1000040000],
+        'C': [1003000000, 1003100000],
+    })
+    variants = [
+        FakeVariant(1000031000, ['B']),
+        FakeVariant(1000032000, ['A', 'B']),  # past the end of A, which hasn't been seen yet
+        FakeVariant(1003050000, ['C']),
+        FakeVariant(1003060000, ['A', 'C']),  # A was already yielded
+    ]
+    return reference, variants
+
+
+class VariantStreamToGeneStreamTest(TestCase):
+
+    def test_genes_are_flushed_incrementally(self):
+        reference = FakeReference({
+            'A': [1000010000, 1000020000],
+            'B': [1000015000, 1000100000],
+            'C': [1001100000, 1001110000],
+        })
+        variants = [
+            FakeVariant(1000011000, ['A']),
+            FakeVariant(1000016000, ['A', 'B']),
+            FakeVariant(1000524000, ['A', 'B', 'D']),  # past the end of A, but within GENE_HOLD_DISTANCE
+            FakeVariant(1001101000, ['C', '']),
+        ]
+        consumed = []
+
+        def variant_stream():
+            for variant in variants:
+                consumed.append(variant)
+                yield variant
+
+        gene_stream = stream_utils.variant_stream_to_gene_stream(variant_stream(), reference)
+
+        gene_id, gene_variants = gene_stream.next()
+        self.assertEqual(gene_id, 'A')
+        self.assertEqual(gene_variants, variants[:3])
+        self.assertEqual(len(consumed), 4)
+
+        self.assertEqual(gene_stream.next(), ('B', variants[1:3]))
+        # C is only complete at the end of the stream; D isn't in the reference so it comes last
+        self.assertEqual(list(gene_stream), [('C', variants[3:]), ('D', variants[2:3])])
+
+    def test_variants_past_a_flushed_gene(self):
+        reference, variants = get_variants_past_a_flushed_gene()
+        gene_stream = stream_utils.variant_stream_to_gene_stream(iter(variants), reference)
+        self.assertEqual(list(gene_stream), [('A', variants[1:2]), ('B', variants[:2]), ('C', variants[2:])])
+
+    def test_empty_stream(self):
+        self.assertEqual(list(stream_utils.variant_stream_to_gene_stream(iter([]), FakeReference({}))), [])
+
+
+class StreamMergeTest(TestCase):
+
+    def test_combine_variant_streams(self):
+        a1, a2, b1, c1 = FakeVariant(1, []), FakeVariant(5, []), FakeVariant(1, []), FakeVariant(3, [])
+        combined = stream_utils.combine_variant_streams([iter([a1, a2]), iter([b1]), iter([]), iter([c1])])
+        self.assertEqual(list(combined), [a1, b1, c1, a2])
+
+    def test_unique_variant_stream(self):
+        variants = [FakeVariant(1, []), FakeVariant(1, [], alt='T'), FakeVariant(1, []), FakeVariant(2, [])]
+        self.assertEqual(list(stream_utils.unique_variant_stream(iter(variants))), [variants[0], variants[1], variants[3]])
+
+    def test_combine_gene_streams(self):
+        reference = FakeReference({'A': [1, 100], 'B': [50, 20000]})
+        v1, v2, v3 = FakeVariant(10, []), FakeVariant(60, []), FakeVariant(70, [])
+
+        combined = stream_utils.combine_gene_streams([
+            iter([('A', [v1]), ('B', [v2])]),
+            iter([('A', [v2]), ('B', [v3]), ('X', [v3])]),
+        ], reference)
+        self.assertEqual(list(combined), [('A', [v1, v2]), ('B', [v2, v3]), ('X', [v3])])
+
+        variants = stream_utils.gene_stream_to_variant_stream(
+            iter([('A', [v1, v2]), ('B', [v2, v3]), ('C', [v1])]), reference)
+        self.assertEqual(list(variants), [v1, v2, v3])
+
+    def test_merge_requires_sorted_streams(self):
+        reference = FakeReference({'A': [1, 100], 'B': [50, 20000]})
+        v1 = FakeVariant(10, [])
+        with self.assertRaises(ValueError):
+            list(stream_utils.combine_gene_streams([iter([('B', [v1]), ('A', [v1])])], reference))
+        with self.assertRaises(ValueError):
+            list(stream_utils.combine_variant_streams([iter([FakeVariant(5, []), FakeVariant(3, [])])]))
+
+    def test_combine_gene_streams_past_a_flushed_gene(self):
+        reference, variants = get_variants_past_a_flushed_gene()
+        combined = stream_utils.combine_gene_streams([
+            stream_utils.variant_stream_to_gene_stream(iter(variants), reference),
+            stream_utils.variant_stream_to_gene_stream(iter(variants[1:2]), reference),
+        ], reference)
+        self.assertEqual(list(combined), [
+            ('A', [variants[1], variants[1]]),
+            ('B', [variants[0], variants[1], variants[1]]),
+            ('C', variants[2:]),
+        ])
@@ -17,6 +17,7 @@ import settings
 
 from xbrowse import utils as xbrowse_utils
 from xbrowse import vcf_stuff, genomeloc
+from xbrowse.parsers import vcf_index
 from xbrowse.core.variant_filters import VariantFilter, passes_variant_filter
 from xbrowse import Variant
 import datastore
@@ -411,6 +412,9 @@ class MongoDatastore(datastore.Datastore):
             # TODO handle case where it's one vcf file, not split by chromosome
 
         size = os.path.getsize(vcf_file_path)
+
+        # if the VCF was indexed when it was registered, use the index to report progress through the whole file
+        vcf_file_index = vcf_index.load_vcf_index(vcf_file_path)
         #progress = get_progressbar(size, 'Loading VCF: {}'.format(vcf_file_path))
 
         def insert_all_variants_in_buffer(buff, collections_dict):
@@ -461,7 +465,10 @@ class MongoDatastore(datastore.Datastore):
 
 
             if variants_buffered_counter > 2000:
-                logger.info(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S") + "-- %s:%s-%s-%s (%0.1f%% done) - inserting %d family-variants from %d vcf rows into %s families" % (variant.chr, variant.pos, variant.ref, variant.alt, 100*variant.pos / CHROMOSOME_SIZES[variant.chr.replace("chr", "")], variants_buffered_counter, vcf_rows_counter, len(family_id_to_variant_list)))
+                fraction_done = vcf_index.get_fraction_done(vcf_file_index, variant.chr, variant.pos) if vcf_file_index else None
+                if fraction_done is None:
+                    fraction_done = float(variant.pos) / CHROMOSOME_SIZES[variant.chr.replace("chr", "")]
+                logger.info(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S") + "-- %s:%s-%s-%s (%0.1f%% done) - inserting %d family-variants from %d vcf rows into %s families" % (variant.chr, variant.pos, variant.ref, variant.alt, 100*fraction_done, variants_buffered_counter, vcf_rows_counter, len(family_id_to_variant_list)))
 
                 insert_all_variants_in_buffer(family_id_to_variant_list, collections)
 
@@ -0,0 +1,244 @@
+#
+# Small sidecar index of VCF metadata, so that code that only needs the samples, header
+# definitions or row counts of a VCF doesn't have to re-read multi-GB files every time.
+#
+# The index is stored as JSON next to the VCF (<vcf_file_path>.xbindex.json), and is only
+# considered valid while the VCF's path, size and mtime match the ones recorded in it.
+#
+
+import gzip
+import hashlib
+import json
+import os
+
+import vcf as pyvcf
+
+INDEX_FILE_SUFFIX = '.xbindex.json'
+INDEX_VERSION = 2
+
+# number of bytes read from the start and the end of the file to compute the fingerprint
+FINGERPRINT_SAMPLE_SIZE = 2**20
+
+# per-process cache of vcf_file_path -> index
+_index_cache = {}
+
+
+def get_index_file_path(vcf_file_path):
+    return vcf_file_path + INDEX_FILE_SUFFIX
+
+
+def get_vcf_index(vcf_file_path, full_scan=False):
+    """
+    Returns the metadata index for the given VCF, reading it from the in-process cache or from
+    the sidecar file if they are still valid, and (re)building it otherwise.
+
+    Args:
+        vcf_file_path (str): local path of a .vcf or .vcf.gz file
+        full_scan (bool): if True, make sure the index includes per-chromosome row counts
+            and offsets - which requires one pass over the whole file. Otherwise only the header
+            is read when the index has to be built.
+    Returns:
+        dict with keys:
+            vcf_file_path, size, mtime, version, fingerprint,
+            header_md5 (str): md5 of the header lines,
+            sample_ids (list): sample ids as they appear in the #CHROM line,
+            infos (dict): INFO id -> {'number', 'type', 'description'},
+            formats (dict): FORMAT id -> {'number', 'type', 'description'},
+            chroms (list): only present after a full scan - one dict per chromosome, in file order,
+                with 'chrom', 'rows', 'offset' (of its first row in the uncompressed stream),
+                'first_pos', 'last_pos' and 'md5' (of its rows)
+    """
+    vcf_index = load_vcf_index(vcf_file_path)
+    if vcf_index is None or (full_scan and 'chroms' not in vcf_index):
+        vcf_index = build_vcf_index(vcf_file_path, full_scan=full_scan)
+
+    return vcf_index
+
+
+def load_vcf_index(vcf_file_path):
+    """
+    Returns the metadata index for the given VCF if there is a valid one in the in-process cache or in
+    its sidecar file, or None - without ever reading the VCF itself.
+    """
+    stat = os.stat(vcf_file_path)
+
+    vcf_index = _index_cache.get(vcf_file_path)
+    if vcf_index is None or not _is_index_current(vcf_index, vcf_file_path, stat):
+        vcf_index = _read_index_file(vcf_file_path, stat)
+        if vcf_index is None:
+            return None
+        _index_cache[vcf_file_path] = vcf_index
+
+    return vcf_index
+
+
+def get_sample_ids(vcf_file_path):
+    """
+    Returns the list of sample ids in the VCF header, without slugifying them
+    """
+    return get_vcf_index(vcf_file_path)['sample_ids']
+
+
+def build_vcf_index(vcf_file_path, full_scan=True):
+    """
+    Reads the VCF and writes a new sidecar index for it. See get_vcf_index for the index contents.
+    """
+    stat = os.stat(vcf_file_path)
+    vcf_index = {
+        'version': INDEX_VERSION,
+        'vcf_file_path': vcf_file_path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'fingerprint': compute_fingerprint(vcf_file_path),
+        'sample_ids': None,
+        'infos': {},
+        'formats': {},
+    }
+
+    pyvcf_meta_parser = pyvcf.parser._vcf_metadata_parser()
+    chroms = []
+    chrom_md5s = []
+    header_md5 = hashlib.md5()
+    offset = 0
+    f = gzip.open(vcf_file_path) if vcf_file_path.endswith('.gz') else open(vcf_file_path)
+    try:
+        for line in f:
+            if line.startswith('#'):
+                header_md5.update(line)
+                if line.startswith('##INFO'):
+                    k, v = pyvcf_meta_parser.read_info(line)
+                    vcf_index['infos'][k] = {'number': v.num, 'type': v.type, 'description': v.desc}
+                elif line.startswith('##FORMAT'):
+                    k, v = pyvcf_meta_parser.read_format(line)
+                    vcf_index['formats'][k] = {'number': v.num, 'type': v.type, 'description': v.desc}
+                elif line.startswith('#CHROM'):
+                    vcf_index['sample_ids'] = line.rstrip('\n').split('\t')[9:]
+                    if not full_scan:
+                        break
+                offset += len(line)
+                continue
+
+            chrom, pos, _ = line.split('\t', 2)
+            if not chroms or chroms[-1]['chrom'] != chrom:
+                chroms.append({'chrom': chrom, 'rows': 0, 'offset': offset, 'first_pos': int(pos)})
+                chrom_md5s.append(hashlib.md5())
+            chroms[-1]['rows'] += 1
+            chrom_md5s[-1].update(line)
+            chroms[-1]['last_pos'] = int(pos)
+            offset += len(line)
+    finally:
+        f.close()
+
+    if vcf_index['sample_ids'] is None:
+        raise ValueError("Unexpected VCF header. #CHROM line not found in %s" % vcf_file_path)
+
+    vcf_index['header_md5'] = header_md5.hexdigest()
+    if full_scan:
+        for c, md5 in zip(chroms, chrom_md5s):
+            c['md5'] = md5.hexdigest()
+        vcf_index['chroms'] = chroms
+
+    _write_index_file(vcf_index)
+    _index_cache[vcf_file_path] = vcf_index
+    return vcf_index
+
+
+def compute_fingerprint(vcf_file_path):
+    """
+    Returns a cheap content fingerprint for the file: an md5 of its size and of the raw bytes at
+    its start and end. Unlike size + mtime, this stays the same when an identical file is copied.
+    """
+    size = os.path.getsize(vcf_file_path)
+    md5 = hashlib.md5(str(size))
+    with open(vcf_file_path, 'rb') as f:
+        md5.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+        if size > FINGERPRINT_SAMPLE_SIZE:
+            f.seek(max(FINGERPRINT_SAMPLE_SIZE, size - FINGERPRINT_SAMPLE_SIZE))
+            md5.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+    return md5.hexdigest()
+
+
+def get_total_rows(vcf_index):
+    """
+    Returns the number of data rows in the VCF, or None if the index wasn't built with a full scan
+    """
+    if 'chroms' not in vcf_index:
+        return None
+    return sum(c['rows'] for c in vcf_index['chroms'])
+
+
+def get_chrom_hashes(vcf_index):
+    """
+    Returns a dict of chrom -> md5 of all the rows of that chromosome, or None if the index wasn't built
+    with a full scan. Use with header_md5 to tell which chromosomes changed between two versions of a VCF.
+    """
+    if 'chroms' not in vcf_index:
+        return None
+
+    md5s = {}
+    for c in vcf_index['chroms']:
+        # a chromosome whose rows aren't contiguous has more than one entry
+        md5s[c['chrom']] = hashlib.md5(md5s[c['chrom']] + c['md5']).hexdigest() if c['chrom'] in md5s else c['md5']
+    return md5s
+
+
+def get_fraction_done(vcf_index, chrom, pos):
+    """
+    Estimates what fraction of the VCF's rows come before chrom:pos, assuming rows are spread evenly
+    between the first and last position of each chromosome. Returns None if the index wasn't built
+    with a full scan or chrom isn't in the VCF.
+    """
+    total_rows = get_total_rows(vcf_index)
+    if not total_rows:
+        return None
+
+    chrom = chrom.replace('chr', '')
+    rows_before = 0
+    for c in vcf_index['chroms']:
+        if c['chrom'].replace('chr', '') == chrom:
+            span = c['last_pos'] - c['first_pos']
+            within = float(pos - c['first_pos']) / span if span > 0 else 0.0
+            rows_before += c['rows'] * min(max(within, 0.0), 1.0)
+            return float(rows_before) / total_rows
+        rows_before += c['rows']
+
+    return None
+
+
+def _is_index_current(vcf_index, vcf_file_path, stat):
+    return (
+        vcf_index.get('version') == INDEX_VERSION and
+        vcf_index.get('vcf_file_path') == vcf_file_path and
+        vcf_index.get('size') == stat.st_size and
+        vcf_index.get('mtime') == stat.st_mtime
+    )
+
+
+def _read_index_file(vcf_file_path, stat):
+    index_file_path = get_index_file_path(vcf_file_path)
+    if not os.path.isfile(index_file_path):
+        return None
+    try:
+        with open(index_file_path) as f:
+            vcf_index = json.load(f)
+    except (IOError, ValueError), e:
+        print("WARNING: couldn't read VCF index %s: %s" % (index_file_path, e))
+        return None
+
+    if not _is_index_current(vcf_index, vcf_file_path, stat):
+        return None
+
+    return vcf_index
+
+
+def _write_index_file(vcf_index):
+    index_file_path = get_index_file_path(vcf_index['vcf_file_path'])
+    try:
+        # write to a temp file first so that other processes never see a partially-written index
+        temp_file_path = "%s.%s.tmp" % (index_file_path, os.getpid())
+        with open(temp_file_path, 'w') as f:
+            json.dump(vcf_index, f)
+        os.rename(temp_file_path, index_file_path)
+    except (IOError, OSError), e:
+        # the VCF may be in a read-only directory - the index is still cached in this process
+        print("WARNING: couldn't write VCF index %s: %s" % (index_file_path, e))
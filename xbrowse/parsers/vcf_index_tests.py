@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from xbrowse.parsers import vcf_index
+
+
+VCF_TEXT = """##fileformat=VCFv4.1
+##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count in genotypes">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE.1\tSAMPLE2
+1\t100\t.\tA\tG\t50\tPASS\tAC=1\tGT\t0/1\t0/0
+1\t300\t.\tC\tT\t50\tPASS\tAC=1\tGT\t0/1\t0/0
+2\t100\t.\tG\tA\t50\tPASS\tAC=1\tGT\t0/1\t0/0
+"""
+
+
+class VcfIndexTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.vcf_file_path = os.path.join(self.temp_dir, 'test.vcf')
+        with open(self.vcf_file_path, 'w') as f:
+            f.write(VCF_TEXT)
+        vcf_index._index_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        vcf_index._index_cache.clear()
+
+    def test_header_only_index(self):
+        index = vcf_index.get_vcf_index(self.vcf_file_path)
+        self.assertEqual(index['sample_ids'], ['SAMPLE.1', 'SAMPLE2'])
+        self.assertEqual(index['infos']['AC']['type'], 'Integer')
+        self.assertEqual(index['formats']['GT']['type'], 'String')
+        self.assertNotIn('chroms', index)
+        self.assertTrue(os.path.isfile(vcf_index.get_index_file_path(self.vcf_file_path)))
+
+    def test_full_scan_index(self):
+        index = vcf_index.get_vcf_index(self.vcf_file_path, full_scan=True)
+        self.assertEqual([(c['chrom'], c['rows']) for c in index['chroms']], [('1', 2), ('2', 1)])
+        self.assertEqual(vcf_index.get_total_rows(index), 3)
+        self.assertEqual(VCF_TEXT[index['chroms'][1]['offset']:].split('\t')[:2], ['2', '100'])
+        self.assertAlmostEqual(vcf_index.get_fraction_done(index, 'chr1', 200), 1.0 / 3)
+        self.assertAlmostEqual(vcf_index.get_fraction_done(index, 'chr2', 100), 2.0 / 3)
+
+    def test_index_is_reused_until_vcf_changes(self):
+        index = vcf_index.get_vcf_index(self.vcf_file_path, full_scan=True)
+
+        # a new process reads the sidecar file instead of the VCF
+        vcf_index._index_cache.clear()
+        self.assertEqual(vcf_index.load_vcf_index(self.vcf_file_path), index)
+
+        with open(self.vcf_file_path, 'a') as f:
+            f.write("2\t200\t.\tG\tA\t50\tPASS\tAC=1\tGT\t0/1\t0/0\n")
+        self.assertIsNone(vcf_index.load_vcf_index(self.vcf_file_path))
+        self.assertEqual(vcf_index.get_total_rows(vcf_index.get_vcf_index(self.vcf_file_path, full_scan=True)), 4)
+
+    def test_chrom_hashes(self):
+        index = vcf_index.get_vcf_index(self.vcf_file_path, full_scan=True)
+        chrom_hashes = vcf_index.get_chrom_hashes(index)
+        self.assertEqual(set(chrom_hashes.keys()), {'1', '2'})
+
+        with open(self.vcf_file_path, 'w') as f:
+            f.write(VCF_TEXT.replace("2\t100\t.\tG\tA", "2\t100\t.\tG\tC"))
+        os.utime(self.vcf_file_path, (0, 0))
+        new_index = vcf_index.get_vcf_index(self.vcf_file_path, full_scan=True)
+        new_chrom_hashes = vcf_index.get_chrom_hashes(new_index)
+        self.assertEqual(new_index['header_md5'], index['header_md5'])
+        self.assertEqual(new_chrom_hashes['1'], chrom_hashes['1'])
+        self.assertNotEqual(new_chrom_hashes['2'], chrom_hashes['2'])
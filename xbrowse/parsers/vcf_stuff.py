@@ -3,22 +3,22 @@
 #
 
 import sys
-import gzip
+import pysam
 import vcf as pyvcf
 
 from xbrowse import genomeloc
 from xbrowse import family_utils
 from xbrowse.utils import slugify
+from xbrowse.parsers import vcf_index
 from xbrowse.core.variants import Variant, Genotype
 from xbrowse.utils.minirep import get_minimal_representation
 
 
 def get_ids_from_vcf_path(vcf_file_path):
-    if vcf_file_path.endswith('.gz'):
-        f = gzip.open(vcf_file_path)
-    else:
-        f = open(vcf_file_path)
-    return get_ids_from_vcf(f)
+    """
+    Get the individuals in the VCF at vcf_file_path, using its sidecar index if it has one
+    """
+    return [slugify(indiv_id, separator='_', replace_dot=True) for indiv_id in vcf_index.get_sample_ids(vcf_file_path)]
 
 
 def get_ids_from_vcf(vcf_file):
@@ -484,7 +484,7 @@ def write_sites_vcf(f, sites_list):
     f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
     for site in sites_list:
         chrom, pos = genomeloc.get_chr_pos(site[0])
-        fields = [chrom[3:], str(pos), '.', site[1], site[2], '.', '.', '.']
+        fields = [chrom, str(pos), '.', site[1], site[2], '.', '.', '.']
         f.write('\t'.join(fields) + '\n')
     return True
 
@@ -495,3 +495,70 @@ def iterate_tuples(vcf_file):
     """
     for variant in iterate_vcf(vcf_file):
         yield variant.unique_tuple()
+
+
+def get_tuples_from_vcf_line(line):
+    """
+    Return the list of (xpos, ref, alt) tuples - one per alt allele - for a single VCF data line.
+    Only the first five columns are split; INFO and genotype columns are never touched.
+    Tuples are returned in minimal representation and skipped the same way iterate_vcf skips variants
+    (unknown chromosome, or alleles too long to be mongo keys)
+    """
+    fields = line.split('\t', 5)
+    chrom = fields[0] if 'chr' in fields[0] else 'chr' + fields[0]
+    pos = int(fields[1])
+    if not genomeloc.valid_pos(chrom, pos):
+        print "ERROR: could not figure out coordinates for %s:%d...maybe a nonstandard chromosome?" % (chrom, pos)
+        return []
+
+    xpos = genomeloc.get_single_location(chrom, pos)
+    ref = fields[3]
+    tuples = []
+    for alt in fields[4].split(','):
+        variant_t = get_minimal_representation(xpos, ref, alt)
+        # same hack as in iterate_vcf, because mongo keys can't be big
+        if len(variant_t[1]) + len(variant_t[2]) > 1000:
+            continue
+        tuples.append(variant_t)
+    return tuples
+
+
+def scan_tuples(vcf_file):
+    """
+    Fast alternative to iterate_tuples: iterate (xpos, ref, alt) tuples in a VCF file without
+    building Variant objects or parsing INFO / genotypes.
+
+    Args:
+        vcf_file: iterable of VCF lines - a file handle, or the lines returned by a tabix fetch
+    """
+    for i, line in enumerate(vcf_file):
+        if line.startswith('#'):
+            continue
+        try:
+            variant_tuples = get_tuples_from_vcf_line(line.rstrip('\n'))
+        except Exception, e:
+            raise Exception(str(e) + " on row %s: %s" % (i, line))
+        for variant_t in variant_tuples:
+            yield variant_t
+
+
+def scan_tuples_in_region(vcf_file_path, chrom, start=None, end=None):
+    """
+    Iterate (xpos, ref, alt) tuples in a region of a bgzipped, tabix-indexed VCF file
+
+    Args:
+        vcf_file_path (str): path of the VCF - a .tbi index must exist alongside it
+        chrom (str): chromosome name, as it appears in the VCF
+        start (int): optional 1-based start position (inclusive)
+        end (int): optional 1-based end position (inclusive)
+    """
+    tabix_file = pysam.TabixFile(vcf_file_path)
+    try:
+        lines = tabix_file.fetch(chrom, start - 1 if start else None, end)
+    except ValueError, e:
+        # chromosome isn't in the index
+        print("WARNING: scan_tuples_in_region: " + str(e))
+        return
+
+    for variant_t in scan_tuples(lines):
+        yield variant_t
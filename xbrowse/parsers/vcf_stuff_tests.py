@@ -0,0 +1,30 @@
+import StringIO
+from django.test import TestCase
+from xbrowse.parsers import vcf_stuff
+
+
+VCF_TEXT = """##fileformat=VCFv4.1
+##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count in genotypes">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE1
+1\t100\trs1\tA\tG\t50\tPASS\tAC=1\tGT:AD\t0/1:5,5
+1\t200\t.\tCTT\tC,CT\t50\tPASS\tAC=1,1\tGT:AD\t1/2:0,4,6
+chrX\t300\t.\tGA\tGC\t50\tPASS\tAC=2\tGT:AD\t1/1:0,10
+GL000192.1\t10\t.\tA\tT\t50\tPASS\tAC=1\tGT:AD\t0/1:5,5
+"""
+
+
+class VcfStuffTest(TestCase):
+
+    def test_scan_tuples_matches_iterate_tuples(self):
+        expected = list(vcf_stuff.iterate_tuples(StringIO.StringIO(VCF_TEXT)))
+        actual = list(vcf_stuff.scan_tuples(StringIO.StringIO(VCF_TEXT)))
+        self.assertEqual(expected, actual)
+
+    def test_scan_tuples_minimal_representation(self):
+        actual = list(vcf_stuff.scan_tuples(StringIO.StringIO(VCF_TEXT)))
+        self.assertEqual(actual, [
+            (1000000100, 'A', 'G'),
+            (1000000200, 'CTT', 'C'),
+            (1000000200, 'CT', 'C'),
+            (23000000301, 'A', 'C'),
+        ])
@@ -0,0 +1,68 @@
+"""
+On-disk snapshot of the reference_cache collection, so that processes can load all the cached gene info
+with one local file read instead of downloading and decoding every cache document from mongo.
+
+The snapshot is a single marshal-serialized dict. marshal is the fastest serialization python has for plain
+dicts / lists / strings / numbers, but its format may change between python versions, so the python version
+is recorded in the snapshot along with SNAPSHOT_VERSION and snapshots from other versions are ignored.
+"""
+
+import marshal
+import os
+import sys
+
+SNAPSHOT_VERSION = 1
+
+# per-process cache of snapshot path -> (mtime, snapshot), shared by all Reference objects
+_snapshot_cache = {}
+
+
+def write_cache_snapshot(snapshot_path, cache_id, caches):
+    """
+    Writes the snapshot, replacing any existing one.
+
+    Args:
+        snapshot_path (str): output path. The file is written next to it first and then renamed into place,
+            so processes never see a partially-written snapshot.
+        cache_id (str): id of the reference_cache contents the snapshot was made from
+        caches (dict): reference_cache key -> value
+    """
+    temp_file_path = "%s.%s.tmp" % (snapshot_path, os.getpid())
+    with open(temp_file_path, 'wb') as f:
+        marshal.dump({
+            'version': SNAPSHOT_VERSION,
+            'python_version': list(sys.version_info[:2]),
+            'cache_id': cache_id,
+            'caches': caches,
+        }, f, 2)
+    os.rename(temp_file_path, snapshot_path)
+
+
+def read_cache_snapshot(snapshot_path):
+    """
+    Returns the snapshot dict with 'cache_id' and 'caches' keys, or None if there's no usable snapshot at
+    snapshot_path. Each snapshot is only read from disk once per process, until the file changes.
+    """
+    try:
+        mtime = os.path.getmtime(snapshot_path)
+    except OSError:
+        return None
+
+    cached = _snapshot_cache.get(snapshot_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snapshot = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError), e:
+        print("WARNING: couldn't read reference cache snapshot %s: %s" % (snapshot_path, e))
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION or \
+            snapshot.get('python_version') != list(sys.version_info[:2]):
+        print("WARNING: reference cache snapshot %s was written by a different version. Ignoring it." % snapshot_path)
+        return None
+
+    _snapshot_cache[snapshot_path] = (mtime, snapshot)
+    return snapshot
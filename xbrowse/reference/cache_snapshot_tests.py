@@ -0,0 +1,38 @@
+import marshal
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from xbrowse.reference import cache_snapshot
+
+
+class CacheSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.temp_dir, 'reference_cache.snapshot')
+        cache_snapshot._snapshot_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        cache_snapshot._snapshot_cache.clear()
+
+    def test_write_and_read(self):
+        caches = {
+            'gene_symbols': {u'ENSG00000001': u'GENE1'},
+            'ordered_genes': [[u'ENSG00000001', 1000000100, 1000000200]],
+            'gene_summaries': {u'ENSG00000001': {'coding_size': 300, 'lof_constraint': 0.5}},
+        }
+        cache_snapshot.write_cache_snapshot(self.snapshot_path, 'abc', caches)
+
+        snapshot = cache_snapshot.read_cache_snapshot(self.snapshot_path)
+        self.assertEqual(snapshot['cache_id'], 'abc')
+        self.assertEqual(snapshot['caches'], caches)
+        self.assertIs(cache_snapshot.read_cache_snapshot(self.snapshot_path), snapshot)
+
+    def test_missing_or_other_version(self):
+        self.assertIsNone(cache_snapshot.read_cache_snapshot(self.snapshot_path))
+
+        with open(self.snapshot_path, 'wb') as f:
+            marshal.dump({'version': cache_snapshot.SNAPSHOT_VERSION + 1, 'caches': {}}, f)
+        self.assertIsNone(cache_snapshot.read_cache_snapshot(self.snapshot_path))
@@ -1,4 +1,7 @@
 import gzip
+import itertools
+
+import numpy as np
 import settings
 import tqdm
 from xbrowse.core.genomeloc import get_xpos, valid_chrom
@@ -56,3 +59,45 @@ def parse_clinvar_vcf(clinvar_vcf_path=None):
             'variant_id': variant_id,
             'clinsig': clinical_significance,
         }
+
+
+class ClinvarIndex():
+    """
+    Compact in-memory copy of the clinvar collection, for looking up many variants at once:
+    a sorted array of the records' xpos, plus one "ref\talt\tvariant_id\tclinsig" string per record.
+    """
+
+    def __init__(self, records):
+        """
+        Args:
+            records: iter of dicts with 'xpos', 'ref', 'alt', 'variant_id' and 'clinsig' keys, like parse_clinvar_vcf
+                yields. Where there's more than one record for a variant, the first one is used.
+        """
+        rows = sorted(
+            ((r['xpos'], '\t'.join((r['ref'], r['alt'], r['variant_id'], r['clinsig']))) for r in records),
+            key=lambda row: row[0],
+        )
+        self._xpos = np.array([row[0] for row in rows], dtype=np.int64)
+        self._rows = [row[1] for row in rows]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_clinvar_info_many(self, variant_t_list):
+        """
+        Returns a dict that maps each (xpos, ref, alt) tuple in variant_t_list that's in clinvar to a
+        (variant_id, clinsig) tuple
+        """
+        variant_t_list = list(variant_t_list)
+        query_xpos = np.array([variant_t[0] for variant_t in variant_t_list], dtype=np.int64)
+        starts = np.searchsorted(self._xpos, query_xpos, side='left')
+        ends = np.searchsorted(self._xpos, query_xpos, side='right')
+
+        ret = {}
+        for variant_t, start, end in itertools.izip(variant_t_list, starts, ends):
+            for row in self._rows[start:end]:
+                ref, alt, variant_id, clinsig = row.split('\t')
+                if ref == variant_t[1] and alt == variant_t[2]:
+                    ret[variant_t] = (variant_id, clinsig)
+                    break
+        return ret
@@ -0,0 +1,30 @@
+from django.test import TestCase
+from xbrowse.reference.clinvar import ClinvarIndex
+
+
+class ClinvarIndexTest(TestCase):
+
+    def test_get_clinvar_info_many(self):
+        index = ClinvarIndex([
+            {'xpos': 1000000200, 'ref': 'A', 'alt': 'G', 'variant_id': '3', 'clinsig': 'benign'},
+            {'xpos': 1000000100, 'ref': 'C', 'alt': 'T', 'variant_id': '1', 'clinsig': 'pathogenic'},
+            {'xpos': 1000000100, 'ref': 'C', 'alt': 'A', 'variant_id': '2', 'clinsig': 'likely benign'},
+            {'xpos': 1000000100, 'ref': 'C', 'alt': 'T', 'variant_id': '4', 'clinsig': 'uncertain significance'},
+        ])
+        self.assertEqual(len(index), 4)
+
+        self.assertEqual(index.get_clinvar_info_many([
+            (1000000100, 'C', 'T'),
+            (1000000100, 'C', 'A'),
+            (1000000100, 'C', 'G'),
+            (1000000200, 'A', 'G'),
+            (1000000150, 'A', 'G'),
+            (2000000100, 'C', 'T'),
+        ]), {
+            (1000000100, 'C', 'T'): ('1', 'pathogenic'),  # the first record wins
+            (1000000100, 'C', 'A'): ('2', 'likely benign'),
+            (1000000200, 'A', 'G'): ('3', 'benign'),
+        })
+
+        self.assertEqual(index.get_clinvar_info_many([]), {})
+        self.assertEqual(ClinvarIndex([]).get_clinvar_info_many([(1000000100, 'C', 'T')]), {})
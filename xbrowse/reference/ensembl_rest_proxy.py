@@ -0,0 +1,359 @@
+"""
+Client for the Ensembl REST API (https://rest.ensembl.org) that a Reference uses as an underlying data source.
+
+Successful responses can be cached on disk, keyed by request URL, so identical requests are only made once across
+all processes and runs that share the cache directory. Batch methods spread their requests over a bounded pool of
+threads.
+
+EnsemblRESTStubServer serves canned responses on localhost, so the proxy can be exercised offline.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+import ensembl_parsing_utils
+import requests
+from xbrowse import genomeloc
+
+DEFAULT_NUM_WORKERS = 4  # Ensembl allows 15 requests per second per client
+MAX_RETRIES = 5  # for rate-limited (429) responses
+REQUEST_TIMEOUT = 60  # seconds
+
+
+class EnsemblRESTProxy(object):
+    """
+    Wrapper over an Ensembl REST server that a Reference uses as its underlying data source
+    """
+
+    def __init__(self, host, port, cache_dir=None, num_workers=DEFAULT_NUM_WORKERS):
+        """
+        Args:
+            host (str): REST server host name
+            port (int): REST server port
+            cache_dir (str): optional directory to cache responses in. It's created if it doesn't exist.
+            num_workers (int): max number of requests that batch methods make at once
+        """
+        self.host = host
+        self.port = port
+        self.cache_dir = cache_dir
+        self.num_workers = num_workers
+
+    def _get_rest_url(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    def _get_json(self, path, params=None):
+        """
+        GETs the given path and returns the decoded json response, from the disk cache when possible
+        """
+        params = dict(params or {}, **{'content-type': 'application/json'})
+        url = self._get_rest_url() + path + '?' + urllib.urlencode(sorted(params.items()))
+
+        cache_file_path = self._get_cache_file_path(url)
+        if cache_file_path is not None and os.path.isfile(cache_file_path):
+            try:
+                with open(cache_file_path) as f:
+                    return json.load(f)
+            except (IOError, ValueError), e:
+                print("WARNING: couldn't read cached Ensembl response %s: %s" % (cache_file_path, e))
+
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        for retry in range(MAX_RETRIES + 1):
+            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+            if response.status_code != 429 or retry == MAX_RETRIES:
+                break
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+        response.raise_for_status()
+        result = response.json()
+
+        if cache_file_path is not None:
+            self._write_cache_file(cache_file_path, response.content)
+
+        return result
+
+    def _get_cache_file_path(self, url):
+        if self.cache_dir is None:
+            return None
+        key = hashlib.md5(url).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def _write_cache_file(self, cache_file_path, content):
+        try:
+            cache_subdir = os.path.dirname(cache_file_path)
+            if not os.path.isdir(cache_subdir):
+                try:
+                    os.makedirs(cache_subdir)
+                except OSError:
+                    if not os.path.isdir(cache_subdir):  # another thread or process may have just created it
+                        raise
+            # write to a temp file first so that other processes never see a partially-written response
+            fd, temp_file_path = tempfile.mkstemp(dir=cache_subdir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.rename(temp_file_path, cache_file_path)
+        except (IOError, OSError), e:
+            print("WARNING: couldn't cache Ensembl response %s: %s" % (cache_file_path, e))
+
+    def _map_with_workers(self, func, items):
+        """
+        Returns [func(item) for item in items], with up to num_workers calls running at once
+        """
+        items = list(items)
+        if self.num_workers <= 1 or len(items) <= 1:
+            return map(func, items)
+
+        pool = ThreadPool(min(self.num_workers, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_phenotype_info(self, gene_id):
+        """
+        Here's what returns for RYR1:
+        {
+            'has_mendelian_phenotype': true,
+            'mim_id': "180901",
+            'mim_phenotypes': [
+                {'mim_id': '117000', 'description': 'CENTRAL CORE DISEASE OF MUSCLE'},
+                ...
+            ],
+            'orphanet_phenotypes': [
+                {'orphanet_id': '178145', 'description': 'Moderate multiminicore disease with hand involvement'},
+                ...
+            ]
+        }
+        """
+
+        phenotype_info = {
+            'mim_id': None,
+            'mim_phenotypes': [],
+            'orphanet_phenotypes': []
+        }
+
+        xrefs_json = self._get_json('/xrefs/id/%s' % gene_id)
+
+        for item in xrefs_json:
+
+            if item['dbname'] == 'MIM_GENE':
+                phenotype_info['mim_id'] = item['primary_id']
+
+            elif item['dbname'] == 'MIM_MORBID':
+                phenotype_info['mim_phenotypes'].append({
+                    'mim_id': item['primary_id'],
+                    'description': item['description']
+                })
+
+            elif item['dbname'] == 'Orphanet':
+                phenotype_info['orphanet_phenotypes'].append({
+                    'orphanet_id': item['primary_id'],
+                    'description': item['description']
+                })
+
+        if len(phenotype_info['mim_phenotypes']) > 0 or len(phenotype_info['orphanet_phenotypes']) > 0:
+            phenotype_info['has_mendelian_phenotype'] = True
+        else:
+            phenotype_info['has_mendelian_phenotype'] = False
+
+        return phenotype_info
+
+    def get_phenotype_info_many(self, gene_ids):
+        """
+        Batch version of get_phenotype_info. Returns a dict of gene_id -> phenotype info
+        Ensembl has no batch xrefs endpoint, so the requests are spread over the worker pool instead.
+        """
+        gene_ids = list(gene_ids)
+        return dict(zip(gene_ids, self._map_with_workers(self.get_phenotype_info, gene_ids)))
+
+    def get_gene_structure(self, gene_id):
+        """
+        Query ensembl API for the transcript/exon structure of a gene
+        This is the foundation of the elements in db.genes
+        Exception if can't process gene
+        """
+
+        gene = {}
+
+        # gene basics
+        gene_list_json = self._get_json('/feature/id/%s' % gene_id, {'feature': 'gene'})
+        gene_list_json = [item for item in gene_list_json if item['ID'] == gene_id]
+        if len(gene_list_json) == 0:
+            raise Exception("No genes with ID %s" % gene_id)
+        if len(gene_list_json) > 1:
+            raise Exception(">1 ensembl genes with ID %s" % gene_id)
+        gene_json = gene_list_json[0]
+
+        chr = ensembl_parsing_utils.get_chr_from_seq_region_name(gene_json['seq_region_name'])
+        if chr is None:
+            raise Exception("Gene %s is on a nonstandard chromosome: %s" % (gene_id, chr) )
+
+        gene['chr'] = chr
+        gene['start'] = gene_json['start']
+        gene['stop'] = gene_json['end']
+        gene['xstart'] = genomeloc.get_single_location(chr, gene['start'])
+        gene['xstop'] = genomeloc.get_single_location(chr, gene['stop'])
+
+        gene['gene_id'] = gene_json['ID']
+        gene['symbol'] = gene_json['external_name']
+        gene['description'] = gene_json['description']
+        gene['biotype'] = gene_json['biotype']
+
+        # transcripts
+        transcript_json = [
+            t for t in self._get_json('/feature/id/%s' % gene_id, {'feature': 'transcript'}) if t['Parent'] == gene_id
+        ]
+
+        # exons_for_transcript
+        transcript_exon_jsons = self._map_with_workers(
+            lambda t: self._get_json('/feature/id/%s' % t['ID'], {'feature': 'exon'}), transcript_json)
+
+        gene['transcripts'] = []
+        for t, transcript_exon_json in zip(transcript_json, transcript_exon_jsons):
+            transcript_id = t['ID']
+            transcript = dict(
+                transcript_id=transcript_id,
+                biotype=t['biotype'],
+                start=t['start'],
+                stop=t['end']
+            )
+            transcript['xstart'] = genomeloc.get_single_location(chr, transcript['start'])
+            transcript['xstop'] = genomeloc.get_single_location(chr, transcript['stop'])
+            transcript['exons'] = [
+                e['ID'] for e in sorted(transcript_exon_json, key=lambda x: x['start']) if e['Parent'] == transcript_id
+            ]
+
+            gene['transcripts'].append(transcript)
+
+        # exons
+        exon_json = self._get_json('/feature/id/%s' % gene_id, {'feature': 'exon'})
+
+        transcript_ids = {t['transcript_id'] for t in gene['transcripts']}
+        exon_ids_seen = set()
+        gene['exons'] = []
+        for e in exon_json:
+            exon_id = e['ID']
+            # skip exons that aren't actually in one of this gene's transcripts
+            if e['Parent'] not in transcript_ids:
+                continue
+            if exon_id in exon_ids_seen:
+                continue
+            exon = {
+                'exon_id': exon_id,
+                'start': e['start'],
+                'stop': e['end'],
+            }
+            exon['xstart'] = genomeloc.get_single_location(chr, exon['start'])
+            exon['xstop'] = genomeloc.get_single_location(chr, exon['stop'])
+            gene['exons'].append(exon)
+            exon_ids_seen.add(e['ID'])
+
+        # cds
+        cds_json = self._get_json('/feature/id/%s' % gene_id, {'feature': 'cds'})
+
+        cds_map = {}  # map from (start, stop) -> {start, stop, transcripts}
+        for c in cds_json:
+            # skip exons that aren't actually in one of this gene's transcripts
+            if c['Parent'] not in transcript_ids:
+                continue
+            cds_t = (c['start'], c['end'])
+            if cds_t not in cds_map:
+                cds_map[cds_t] = {
+                    'start': c['start'],
+                    'stop': c['end'],
+                    'xstart': genomeloc.get_single_location(chr, c['start']),
+                    'xstop': genomeloc.get_single_location(chr, c['end']),
+                    'transcripts': [],
+                }
+            cds_map[cds_t]['transcripts'].append(c['Parent'])
+        gene['cds'] = sorted(cds_map.values(), key=lambda x: (x['start'], x['stop']))
+        for i, cds in enumerate(gene['cds']):
+            cds['cds_id'] = '%s-%i' % (gene['gene_id'], i+1)
+        return gene
+
+
+class EnsemblRESTStubServer(object):
+    """
+    Minimal local stand-in for the Ensembl REST server, for running EnsemblRESTProxy offline - eg. in tests:
+
+        with EnsemblRESTStubServer(xrefs={'ENSG00000196218': [...]}) as server:
+            proxy = EnsemblRESTProxy(server.host, server.port)
+
+    It serves GET /xrefs/id/<id> and GET /feature/id/<id>?feature=<type> from the given dicts. Unknown ids get a
+    400 response, like the real server. Every request is recorded in self.requests as a (method, path) tuple.
+    """
+
+    def __init__(self, xrefs=None, features=None):
+        """
+        Args:
+            xrefs (dict): id -> list of xref dicts
+            features (dict): (id, feature type) -> list of feature dicts
+        """
+        self.xrefs = xrefs or {}
+        self.features = features or {}
+        self.requests = []
+        self.host = '127.0.0.1'
+        self.port = None
+        self._server = None
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlparse.urlparse(self.path)
+                stub.requests.append(('GET', url.path))
+                query = urlparse.parse_qs(url.query)
+                parts = url.path.strip('/').split('/')
+                result = None
+                if parts[:2] == ['xrefs', 'id'] and len(parts) == 3:
+                    result = stub.xrefs.get(parts[2])
+                elif parts[:2] == ['feature', 'id'] and len(parts) == 3:
+                    result = stub.features.get((parts[2], query.get('feature', [None])[0]))
+                self._respond(result)
+
+            def _respond(self, result):
+                if result is None:
+                    self.send_response(400)
+                    content = json.dumps({'error': 'ID not found'})
+                else:
+                    self.send_response(200)
+                    content = json.dumps(result)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self._server = Server((self.host, 0), Handler)
+        self.port = self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
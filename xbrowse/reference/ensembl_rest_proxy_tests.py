@@ -0,0 +1,54 @@
+import shutil
+import tempfile
+
+import requests
+from django.test import TestCase
+from xbrowse.reference.ensembl_rest_proxy import EnsemblRESTProxy, EnsemblRESTStubServer
+
+RYR1_XREFS = [
+    {'dbname': 'MIM_GENE', 'primary_id': '180901', 'description': 'RYANODINE RECEPTOR 1'},
+    {'dbname': 'MIM_MORBID', 'primary_id': '117000', 'description': 'CENTRAL CORE DISEASE OF MUSCLE'},
+    {'dbname': 'Orphanet', 'primary_id': '178145', 'description': 'Moderate multiminicore disease with hand involvement'},
+    {'dbname': 'HGNC', 'primary_id': 'HGNC:10483', 'description': 'ryanodine receptor 1'},
+]
+
+
+class EnsemblRESTProxyTest(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.server = EnsemblRESTStubServer(
+            xrefs={'ENSG00000196218': RYR1_XREFS, 'ENSG00000000001': []},
+        ).start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_phenotype_info(self):
+        proxy = EnsemblRESTProxy(self.server.host, self.server.port, cache_dir=self.cache_dir)
+        self.assertEqual(proxy.get_phenotype_info('ENSG00000196218'), {
+            'has_mendelian_phenotype': True,
+            'mim_id': '180901',
+            'mim_phenotypes': [{'mim_id': '117000', 'description': 'CENTRAL CORE DISEASE OF MUSCLE'}],
+            'orphanet_phenotypes': [
+                {'orphanet_id': '178145', 'description': 'Moderate multiminicore disease with hand involvement'}],
+        })
+        self.assertEqual(len(self.server.requests), 1)
+
+        # responses are cached on disk, for this and other proxies
+        other_proxy = EnsemblRESTProxy(self.server.host, self.server.port, cache_dir=self.cache_dir)
+        other_proxy.get_phenotype_info('ENSG00000196218')
+        self.assertEqual(len(self.server.requests), 1)
+
+        with self.assertRaises(requests.HTTPError):
+            proxy.get_phenotype_info('ENSG00000000002')
+
+    def test_get_phenotype_info_many(self):
+        proxy = EnsemblRESTProxy(self.server.host, self.server.port, num_workers=2)
+        phenotype_info = proxy.get_phenotype_info_many(['ENSG00000196218', 'ENSG00000000001'])
+        self.assertEqual(sorted(phenotype_info.keys()), ['ENSG00000000001', 'ENSG00000196218'])
+        self.assertTrue(phenotype_info['ENSG00000196218']['has_mendelian_phenotype'])
+        self.assertFalse(phenotype_info['ENSG00000000001']['has_mendelian_phenotype'])
+        self.assertEqual(len(self.server.requests), 2)
+
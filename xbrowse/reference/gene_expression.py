@@ -1,7 +1,12 @@
 import gzip
+
+import numpy as np
 import tqdm
 from xbrowse.core.constants import TISSUE_TYPES
 
+# significant digits of the expression values returned for display - the plot is on a log scale
+DISPLAY_VALUE_PRECISION = 4
+
 
 def get_tissue_expression_values_by_gene(expression_file_name, samples_file_name):
     """
@@ -46,6 +51,77 @@ def get_tissue_expression_values_by_gene(expression_file_name, samples_file_name
         yield (gene_id, get_expressions(line, tissues_by_column))
 
 
+def get_tissue_expression_arrays_by_gene(expression_file_name, samples_file_name):
+    """
+    Columnar version of get_tissue_expression_values_by_gene.
+    Returns (tissue_index, iterator of (gene_id, values) tuples) where
+    tissue_index is a list of [tissue_type, number of samples] pairs, shared by all genes, and
+    values is a float32 array of the gene's expression in every sample, grouped by tissue in tissue_index order
+    """
+    tissue_type_map = get_tissue_type_map(samples_file_name)
+
+    expression_file = gzip.open(expression_file_name)
+
+    # first two lines are junk; third is the header
+    expression_file.readline()
+    expression_file.readline()
+    tissues_by_column = get_tissues_by_column(expression_file.readline().rstrip('\n'), tissue_type_map)
+
+    tissue_index = []
+    column_order = []
+    for tissue in sorted(set(t for t in tissues_by_column if t is not None and t != 'na')):
+        tissue_columns = [i for i, t in enumerate(tissues_by_column) if t == tissue]
+        tissue_index.append([tissue, len(tissue_columns)])
+        column_order.extend(tissue_columns)
+    column_order = np.array(column_order, dtype=np.int64)
+
+    def iterate_values():
+        for line in tqdm.tqdm(expression_file, 'Reading GTEx file', unit=' lines'):
+            line = line.rstrip('\n')
+            if not line:
+                break
+
+            fields = line.split('\t', 2)
+            gene_id = fields[0].split('.')[0]
+            values = np.fromstring(fields[2], dtype=np.float32, sep='\t')
+
+            yield (gene_id, values[column_order])
+
+    return tissue_index, iterate_values()
+
+
+def get_expression_summary(values, tissue_index):
+    """
+    Returns a dict of tissue_type -> [min, first quartile, median, third quartile, max] of the given values
+    """
+    summary = {}
+    offset = 0
+    for tissue, num_samples in tissue_index:
+        quartiles = np.percentile(values[offset:offset+num_samples], [0, 25, 50, 75, 100])
+        summary[tissue] = [_round_display_value(q) for q in quartiles]
+        offset += num_samples
+    return summary
+
+
+def get_expression_display_values(values, tissue_index):
+    """
+    Returns a dict of tissue_type -> list of the tissue's non-zero expression values, which are the ones the
+    expression plot shows - zeros can't be drawn on its log scale
+    """
+    display_values = {}
+    offset = 0
+    for tissue, num_samples in tissue_index:
+        tissue_values = values[offset:offset+num_samples]
+        display_values[tissue] = [_round_display_value(v) for v in tissue_values[tissue_values > 0]]
+        offset += num_samples
+    return display_values
+
+
+def _round_display_value(value):
+    # float32 values would otherwise be serialized with ~17 significant digits
+    return float('%.*g' % (DISPLAY_VALUE_PRECISION, value))
+
+
 def get_tissue_type_map(samples_file):
     """
     Returns map of sample id -> tissue type
@@ -0,0 +1,60 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import TestCase
+from xbrowse.reference import gene_expression
+
+
+class GeneExpressionTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_tissue_expression_arrays(self):
+        samples_file_name = os.path.join(self.temp_dir, 'samples.txt')
+        with open(samples_file_name, 'w') as f:
+            f.write('SAMPID\tSMTS\tSMTSD\n')
+            f.write('S1\tLiver\tLiver\n')
+            f.write('S2\tBrain\tBrain - Cortex\n')
+            f.write('S3\tLiver\tLiver\n')
+            f.write('S4\tBone Marrow\tBone Marrow\n')
+
+        expression_file_name = os.path.join(self.temp_dir, 'expression.gct.gz')
+        f = gzip.open(expression_file_name, 'w')
+        f.write('#1.2\n')
+        f.write('2\t4\n')
+        f.write('Name\tDescription\tS1\tS2\tS3\tS4\n')
+        f.write('ENSG00000001.5\tA\t1.5\t0\t3.25\t7\n')
+        f.write('ENSG00000002.1\tB\t0\t0.123456\t0\t1\n')
+        f.close()
+
+        tissue_index, values_by_gene = gene_expression.get_tissue_expression_arrays_by_gene(
+            expression_file_name, samples_file_name)
+        values_by_gene = list(values_by_gene)
+
+        self.assertEqual(tissue_index, [['brain', 1], ['liver', 2]])
+        self.assertEqual([gene_id for gene_id, _ in values_by_gene], ['ENSG00000001', 'ENSG00000002'])
+
+        values = values_by_gene[0][1]
+        self.assertEqual(values.dtype, np.float32)
+        self.assertEqual(list(values), [0, 1.5, 3.25])
+
+        self.assertEqual(gene_expression.get_expression_display_values(values, tissue_index), {
+            'brain': [],
+            'liver': [1.5, 3.25],
+        })
+        self.assertEqual(gene_expression.get_expression_summary(values, tissue_index), {
+            'brain': [0, 0, 0, 0, 0],
+            'liver': [1.5, 1.938, 2.375, 2.812, 3.25],
+        })
+
+        self.assertEqual(gene_expression.get_expression_display_values(values_by_gene[1][1], tissue_index), {
+            'brain': [0.1235],
+            'liver': [],
+        })
@@ -1,22 +1,61 @@
+import gc
 import gzip
+import json
 import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
 
 import itertools
+import uuid
 
+import bson
 import ensembl_parsing_utils
 import gene_expression
+import numpy
 import pandas
 import pymongo
-import requests
 from xbrowse import genomeloc
 from xbrowse.parsers.gtf import get_data_from_gencode_gtf
-from xbrowse.reference.clinvar import parse_clinvar_vcf
-from xbrowse.utils import get_progressbar
+from xbrowse.reference import cache_snapshot
+from xbrowse.reference.clinvar import ClinvarIndex, parse_clinvar_vcf
+from xbrowse.reference.ensembl_rest_proxy import EnsemblRESTProxy
+from xbrowse.utils import freeze_structure, get_progressbar
+from xbrowse.utils.interval_index import IntervalIndex
 
 
+from .classes import CodingRegion
 from .utils import get_coding_regions_from_gene_structure, get_coding_size_from_gene_structure
 
 
+# max number of gene documents memoized per process by get_gene / get_genes
+GENE_MEMO_SIZE = 2000
+
+BULK_WRITE_BATCH_SIZE = 5000
+
+# collections are loaded under this suffix and then renamed into place
+STAGING_COLLECTION_SUFFIX = '__staging'
+
+# how often, in seconds, processes check whether clinvar was reloaded since they built their ClinvarIndex
+CLINVAR_VERSION_CHECK_INTERVAL = 60
+
+# how often, in seconds, processes check whether the reference_cache was rebuilt since they memoized gene documents
+REFERENCE_CACHE_CHECK_INTERVAL = 60
+
+# reference_cache entries that are loaded into Reference attributes of the same name (with a leading '_') by preload()
+PRELOADED_CACHE_KEYS = ('gene_positions', 'ordered_genes', 'gene_symbols', 'gene_symbols_r', 'gene_summaries')
+
+# the deepest nesting of containers in the preloaded caches
+FREEZE_GC_PASSES = 3
+
+# reference_cache entries that are set by the loaders rather than computed by _reset_reference_cache
+LOADER_CACHE_KEYS = ('clinvar_version', 'tissue_expression_index')
+
+# reference_cache values that are stored as zlib-compressed json, since they're too big for a mongo document
+COMPRESSED_CACHE_KEYS = ('coding_regions',)
+
+
 class Reference(object):
     """
     Reference is a workhorse - it provides an API for looking up any information about the human genome
@@ -40,6 +79,25 @@ class Reference(object):
         self._gene_symbols_r = None
         self._gene_ids = None
         self._gene_summaries = None
+        self._mendelian_phenotype_genes = None
+        self._disease_genes = None
+        self._gene_interval_index = None
+        self._coding_regions = None
+        self._clinvar_index = None  # (clinvar_version it was built from, ClinvarIndex)
+        self._clinvar_index_checked_at = None
+
+        # optional file copy of the reference_cache collection - see cache_snapshot.py
+        self._reference_cache_snapshot_path = getattr(settings_module, 'reference_cache_snapshot_path', None)
+        self._checked_reference_cache_snapshot = None  # (snapshot, whether it matches reference_cache)
+
+        # LRU memo of gene_id -> gene document, cleared when the reference_cache gets a new cache_id
+        self._gene_memo = OrderedDict()
+        self._gene_memo_lock = threading.Lock()
+        self._reference_cache_id = None
+        self._reference_cache_checked_at = None
+
+        # per-thread counts of gene lookups, so they can be reported per request
+        self._lookup_counts = threading.local()
 
     def get_ensembl_db_proxy(self):
         if self._ensembl_db_proxy is None:
@@ -54,30 +112,26 @@ class Reference(object):
         if self._ensembl_rest_proxy is None:
             self._ensembl_rest_proxy = EnsemblRESTProxy(
             host=self.settings_module.ensembl_rest_host,
-            port=self.settings_module.ensembl_rest_port
+            port=self.settings_module.ensembl_rest_port,
+            cache_dir=getattr(self.settings_module, 'ensembl_rest_cache_dir', None),
         )
         return self._ensembl_rest_proxy
 
     def load(self):
         self._load_clinvar()
         self._load_genes()
-        self._load_additional_gene_info()
-        self._load_tags()
         self._load_gtex_data()
         self._reset_reference_cache()
 
     def _load_genes(self):
-
-        self._db.drop_collection('genes')
-        self._db.genes.ensure_index('gene_id')
-
-        self._db.drop_collection('transcripts')
-        self._db.transcripts.ensure_index('transcript_id')
-        self._db.transcripts.ensure_index('gene_id')
-
-        self._db.drop_collection('exons')
-        self._db.exons.ensure_index('exon_id')
-        self._db.exons.ensure_index('gene_id')
+        """
+        Loads the genes, transcripts and exons collections from the gencode GTF.
+        Complete documents are assembled in memory and bulk inserted into staging collections that are then renamed
+        over the live ones - so the live collections are never partially loaded while this runs.
+        """
+        genes = OrderedDict()
+        transcripts = []
+        exons = OrderedDict()
 
         gencode_file = gzip.open(self.settings_module.gencode_gtf_file)
         size = os.path.getsize(self.settings_module.gencode_gtf_file)
@@ -86,43 +140,82 @@ class Reference(object):
             progress.update(gencode_file.fileobj.tell())
 
             if datatype == 'gene':
-                gene_id = obj['gene_id']
                 obj['symbol'] = obj['gene_name']
-
                 obj['tags'] = {}
-
-                # TODO
-                #obj['coding_size'] = loading_utils.get_coding_size_from_gene_structure(obj)
-                obj['coding_size'] = 0
-
-                self._db.genes.insert(obj)
+                genes[obj['gene_id']] = obj
 
             if datatype == 'transcript':
-                transcript_id = obj['transcript_id']
                 obj['tags'] = {}
-                self._db.transcripts.insert(obj)
+                transcripts.append(obj)
 
             if datatype == 'exon':
                 exon_id = obj['exon_id']
                 transcript_id = obj['transcript_id']
                 del obj['transcript_id']
-                if self._db.exons.find_one({'exon_id': exon_id}):
-                    self._db.exons.update({'exon_id': exon_id}, {'$push': {'transcripts': transcript_id}})
+                if exon_id in exons:
+                    exons[exon_id]['transcripts'].append(transcript_id)
                 else:
                     obj['transcripts'] = [transcript_id,]
                     obj['tags'] = {}
-                    self._db.exons.insert(obj)
+                    exons[exon_id] = obj
 
             if datatype == 'cds':
-                exon_id = obj['exon_id']
                 # this works because cds always comes after exon
-                # this is obviously an inglorious hack - all the gtf parsing should be improved
-                self._db.exons.update({'exon_id': exon_id}, {'$set': {
-                    'cds_start': obj['start'],
-                    'cds_stop': obj['stop'],
-                    'cds_xstart': obj['xstart'],
-                    'cds_xstop': obj['xstop'],
-                }})
+                exon = exons.get(obj['exon_id'])
+                if exon is not None:
+                    exon['cds_start'] = obj['start']
+                    exon['cds_stop'] = obj['stop']
+                    exon['cds_xstart'] = obj['xstart']
+                    exon['cds_xstop'] = obj['xstop']
+
+        exons_by_gene = defaultdict(list)
+        for exon in exons.values():
+            exons_by_gene[exon['gene_id']].append(exon)
+
+        gene_tags = self._get_gene_tags(genes.keys())
+        phenotype_info_by_gene = self._get_phenotype_info_many(genes.keys())
+        for gene_id, gene in genes.items():
+            gene['coding_size'] = get_coding_size_from_gene_structure(gene_id, {'exons': exons_by_gene[gene_id]})
+            gene['phenotype_info'] = phenotype_info_by_gene[gene_id]
+            gene['tags'].update(gene_tags[gene_id])
+
+        self._replace_collection('transcripts', transcripts, ['transcript_id', 'gene_id'])
+        self._replace_collection('exons', exons.values(), ['exon_id', 'gene_id'])
+        self._replace_collection('genes', genes.values(), ['gene_id'])
+        self._clear_gene_memo()
+
+    def _replace_collection(self, collection_name, docs, index_keys):
+        """
+        Bulk inserts docs into a staging collection, indexes it, and renames it over collection_name
+        """
+        staging_collection = self._db[collection_name + STAGING_COLLECTION_SUFFIX]
+        staging_collection.drop()
+
+        docs = iter(docs)
+        while True:
+            chunk = list(itertools.islice(docs, BULK_WRITE_BATCH_SIZE))
+            if not chunk:
+                break
+            staging_collection.bulk_write(map(pymongo.InsertOne, chunk), ordered=False)
+
+        # building indexes after the inserts is much faster than maintaining them during the load
+        for index_key in index_keys:
+            staging_collection.create_index(index_key)
+        staging_collection.rename(collection_name, dropTarget=True)
+
+    def _get_phenotype_info_many(self, gene_ids):
+        """
+        Returns a dict of gene_id -> phenotype info, from the Ensembl REST API if has_phenotype_data
+        """
+        if self.has_phenotype_data:
+            print("Getting phenotype info for %s genes from Ensembl" % len(gene_ids))
+            return self.get_ensembl_rest_proxy().get_phenotype_info_many(gene_ids)
+        return {gene_id: {
+            'has_mendelian_phenotype': False,
+            'mim_id': "",
+            'mim_phenotypes': [],
+            'orphanet_phenotypes': [],
+        } for gene_id in gene_ids}
 
     def _load_clinvar(self, clinvar_vcf_path=None):
         self._db.drop_collection('clinvar')
@@ -134,54 +227,34 @@ class Reference(object):
             if len(chunk) == 0:
                 break
             try:
-                self._db.clinvar.bulk_write(list(map(pymongo.InsertOne, chunk)))
+                self._db.clinvar.bulk_write(list(map(pymongo.InsertOne, chunk)), ordered=False)
             except pymongo.bulk.BulkWriteError as bwe:
                 # If ref/alt are too long to index, drop the variant. Otherwise, raise an error
                 fatal_errors = [err['errmsg'] for err in bwe.details['writeErrors'] if 'key too large to index' not in err['errmsg']]
                 if fatal_errors:
                     raise Exception(fatal_errors)
 
+        # tells processes to rebuild their in-memory ClinvarIndex
+        self._db.reference_cache.update_one({'key': 'clinvar_version'}, {'$set': {'val': time.time()}}, upsert=True)
 
     def _load_gtex_data(self):
-        self._db.drop_collection('tissue_expression')
-        self._db.tissue_expression.ensure_index('gene_id')
-
-        for gene_id, expression_array in gene_expression.get_tissue_expression_values_by_gene(
+        """
+        Loads GTEx expression into the tissue_expression collection. Each gene's values are stored as one binary
+        float32 array, laid out by the 'tissue_expression_index' reference_cache entry, along with per-tissue
+        summary statistics.
+        """
+        tissue_index, values_by_gene = gene_expression.get_tissue_expression_arrays_by_gene(
             self.settings_module.gtex_expression_file,
             self.settings_module.gtex_samples_file
-        ):
-            self._db.tissue_expression.insert({
-                'gene_id': gene_id,
-                'expression_display_values': expression_array
-            })
-
-    def _load_additional_gene_info(self):
-
-        gene_ids = self.get_all_gene_ids()
-        size = len(gene_ids)
-        progress = get_progressbar(size, 'Loading additional info about genes')
-        for i, gene_id in enumerate(gene_ids):
-            progress.update(i)
+        )
+        docs = ({
+            'gene_id': gene_id,
+            'values': bson.Binary(values.tostring()),
+            'summary': gene_expression.get_expression_summary(values, tissue_index),
+        } for gene_id, values in values_by_gene)
 
-            # calculate coding size
-            gene_structure = self.get_gene_structure(gene_id)
-            coding_size = get_coding_size_from_gene_structure(gene_id, gene_structure)
-            self._db.genes.update({'gene_id': gene_id}, {'$set': {'coding_size': coding_size}})
-
-            # phenotypes
-            if self.has_phenotype_data:
-                phenotype_info = self.get_ensembl_rest_proxy().get_phenotype_info(gene_id)
-            else:
-                phenotype_info = {
-                    'has_mendelian_phenotype': False,
-                    'mim_id': "",
-                    'mim_phenotypes': [],
-                    'orphanet_phenotypes': [],
-                }
-            self._db.genes.update(
-                {'gene_id': gene_id},
-                {'$set': {'phenotype_info': phenotype_info}}
-            )
+        self._replace_collection('tissue_expression', docs, ['gene_id'])
+        self._db.reference_cache.update_one({'key': 'tissue_expression_index'}, {'$set': {'val': tissue_index}}, upsert=True)
 
     def update_phenotype_info(self, gene_id, phenotype_info):
         """Sets phenotype info for the given gene_id
@@ -211,41 +284,70 @@ class Reference(object):
                 {'gene_id': gene_id},
                 {'$set': {'phenotype_info': phenotype_info}}
             )
+        with self._gene_memo_lock:
+            self._gene_memo.pop(gene_id, None)
+
+    def refresh_phenotype_caches(self):
+        """
+        Rebuilds the mendelian_phenotype_genes and disease_genes reference caches from the genes collection.
+        Call this after update_phenotype_info, once all the genes are updated.
+        """
+        caches = self._compute_phenotype_gene_caches()
+        for key, val in caches.items():
+            self._db.reference_cache.update_one({'key': key}, {'$set': {'val': val}}, upsert=True)
+        self._update_reference_cache_id()
 
     def _load_tags(self):
-        self._load_gene_list_tags()
-        self._load_gene_test_statistic_tags()
+        """
+        Reloads the gene tags of the genes that are already in the genes collection
+        """
+        gene_tags = self._get_gene_tags(self.get_all_gene_ids())
+        updates = (
+            pymongo.UpdateOne({'gene_id': gene_id}, {'$set': {'tags.'+tag_id: value for tag_id, value in tags.items()}})
+            for gene_id, tags in gene_tags.items() if tags
+        )
+        while True:
+            chunk = list(itertools.islice(updates, BULK_WRITE_BATCH_SIZE))
+            if not chunk:
+                break
+            self._db.genes.bulk_write(chunk, ordered=False)
+        self._clear_gene_memo()
+
+    def _get_gene_tags(self, gene_ids):
+        """
+        Returns a dict of gene_id -> dict of tag_id -> value, for the gene list and gene test statistic tags
+        """
+        gene_tags = {gene_id: {} for gene_id in gene_ids}
 
-    def _load_gene_list_tags(self):
         for gene_tag in self.settings_module.gene_list_tags:
             tag_id = gene_tag['slug']
-            # first set all genes to false
-            self._db.genes.update({}, {'$set': {'tags.'+tag_id: False}}, multi=True)
-
-            gene_ids = [line.strip() for line in open(gene_tag['file']).readlines()]
-            for gene_id in gene_ids:
-                self._db.genes.update({'gene_id': gene_id}, {'$set': {'tags.'+tag_id: True}})
-
-    def _load_gene_test_statistic_tags(self):
+            tagged_gene_ids = set(line.strip() for line in open(gene_tag['file']).readlines())
+            for gene_id, tags in gene_tags.items():
+                tags[tag_id] = gene_id in tagged_gene_ids
 
-        score_data = pandas.DataFrame.from_csv(self.settings_module.constraint_scores_file)
+        if self.settings_module.gene_test_statistic_tags:
+            score_data = pandas.DataFrame.from_csv(self.settings_module.constraint_scores_file)
 
         for gene_tag in self.settings_module.gene_test_statistic_tags:
             tag_id = gene_tag['slug']
             tag_field = gene_tag['data_field']
 
-            # first set all to None
-            self._db.genes.update({}, {'$set': {'tags.'+tag_id: None}}, multi=True)
+            for tags in gene_tags.values():
+                tags[tag_id] = None
 
             scores = getattr(score_data, tag_field)
             ranks = scores.rank(ascending=False)
             for gene_id, score in scores.iteritems():
-                self._db.genes.update({'gene_id': gene_id}, {'$set': {'tags.'+tag_id: score}})
+                if gene_id in gene_tags:
+                    gene_tags[gene_id][tag_id] = score
             for gene_id, rank in ranks.iteritems():
-                self._db.genes.update({'gene_id': gene_id}, {'$set': {'tags.'+tag_id+'_rank': [int(rank), len(ranks)]}})
+                if gene_id in gene_tags:
+                    gene_tags[gene_id][tag_id+'_rank'] = [int(rank), len(ranks)]
+
+        return gene_tags
 
     def _reset_reference_cache(self):
-        self._db.reference_cache.remove()
+        self._db.reference_cache.remove({'key': {'$nin': LOADER_CACHE_KEYS}})
         self._db.reference_cache.ensure_index('key')
 
         genes = []
@@ -254,37 +356,17 @@ class Reference(object):
         gene_symbols_r = {}
         for gene in self._db.genes.find({}, {'gene_id': 1, 'xstart': 1, 'xstop': 1, 'symbol': 1}):
             genes.append(gene)
-            gene_positions[gene['gene_id']] = (gene['xstart'], gene['xstop'])
+            gene_positions[gene['gene_id']] = [gene['xstart'], gene['xstop']]
             gene_symbols[gene['gene_id']] = gene['symbol']
             gene_symbols_r[gene['symbol'].lower().replace('.', '_')] = gene['gene_id']
 
+        # lists rather than tuples, since that's what they are when they come back from mongo
         ordered_genes = sorted(
-            [(gene['gene_id'], gene['xstart'], gene['xstop']) for gene in genes],
+            [[gene['gene_id'], gene['xstart'], gene['xstop']] for gene in genes],
             key=lambda x: (x[1], x[2])
         )
 
-        self._db.reference_cache.insert({
-            'key': 'gene_positions',
-            'val': gene_positions,
-        })
-
-        self._db.reference_cache.insert({
-            'key': 'ordered_genes',
-            'val': ordered_genes,
-        })
-
-        self._db.reference_cache.insert({
-            'key': 'gene_symbols',
-            'val': gene_symbols,
-        })
-
-        self._db.reference_cache.insert({
-            'key': 'gene_symbols_r',
-            'val': gene_symbols_r,
-        })
-
         gene_summaries = {}
-        mendelian_phenotype_genes = []
         for gene in self._db.genes.find():
             gene_summary = {
                 'gene_id': gene['gene_id'],
@@ -294,28 +376,161 @@ class Reference(object):
             gene_summary.update(gene['tags'])
             gene_summaries[gene['gene_id']] = gene_summary
 
+        caches = {
+            'gene_positions': gene_positions,
+            'ordered_genes': ordered_genes,
+            'gene_symbols': gene_symbols,
+            'gene_symbols_r': gene_symbols_r,
+            'gene_summaries': gene_summaries,
+            'coding_regions': zlib.compress(json.dumps([list(r) for r in self._compute_coding_regions()])),
+        }
+        caches.update(self._compute_phenotype_gene_caches())
+        for key, val in caches.items():
+            self._db.reference_cache.insert({
+                'key': key,
+                'val': bson.Binary(val) if key in COMPRESSED_CACHE_KEYS else val,
+            })
+
+        self._update_reference_cache_id(caches)
+
+    def _compute_phenotype_gene_caches(self):
+        """
+        Returns the mendelian_phenotype_genes and disease_genes reference caches, computed from the genes collection
+        """
+        mendelian_phenotype_genes = []
+        disease_genes = []
+        for gene in self._db.genes.find({}, projection={'gene_id': True, 'phenotype_info': True}):
             if gene.get("phenotype_info") and gene['phenotype_info']['has_mendelian_phenotype'] is True:
                 mendelian_phenotype_genes.append(gene['gene_id'])
+            if _has_disease_db_phenotypes(gene):
+                disease_genes.append(gene['gene_id'])
+        return {
+            'mendelian_phenotype_genes': mendelian_phenotype_genes,
+            'disease_genes': disease_genes,
+        }
 
-        self._db.reference_cache.insert({
-            'key': 'gene_summaries',
-            'val': gene_summaries,
-        })
+    def _update_reference_cache_id(self, caches=None):
+        """
+        Gives the reference_cache a new cache_id and writes a new snapshot of it, so that all processes drop
+        what they cached from the old one. caches is the full reference_cache contents, read from mongo if not given.
+        """
+        if caches is None:
+            caches = {}
+            for doc in self._db.reference_cache.find({'key': {'$nin': list(LOADER_CACHE_KEYS) + ['cache_id']}}):
+                caches[doc['key']] = str(doc['val']) if doc['key'] in COMPRESSED_CACHE_KEYS else doc['val']
+
+        # identifies this version of the cache, so processes can tell whether a snapshot file is up to date
+        cache_id = uuid.uuid4().hex
+        self._db.reference_cache.update_one({'key': 'cache_id'}, {'$set': {'val': cache_id}}, upsert=True)
+
+        if self._reference_cache_snapshot_path:
+            try:
+                cache_snapshot.write_cache_snapshot(self._reference_cache_snapshot_path, cache_id, caches)
+            except (IOError, OSError, ValueError), e:
+                print("WARNING: couldn't write reference cache snapshot %s: %s" % (self._reference_cache_snapshot_path, e))
+
+        self._reset_cached_reference_info(cache_id)
 
-        self._db.reference_cache.insert({
-            'key': 'mendelian_phenotype_genes',
-            'val': mendelian_phenotype_genes,
-        })
+    def _get_reference_cache(self, key):
+        snapshot = self._get_reference_cache_snapshot()
+        if snapshot is not None and key in snapshot['caches']:
+            return snapshot['caches'][key]
 
-    def _get_reference_cache(self, key): 
         doc = self._db.reference_cache.find_one({'key': key})
         if doc: 
             return doc['val']
 
+    def _get_reference_cache_snapshot(self):
+        """
+        Returns the snapshot at reference_cache_snapshot_path if there is one and it was made from the current
+        contents of the reference_cache collection, and otherwise None
+        """
+        if not self._reference_cache_snapshot_path:
+            return None
+
+        snapshot = cache_snapshot.read_cache_snapshot(self._reference_cache_snapshot_path)
+        if snapshot is None:
+            return None
+
+        if self._checked_reference_cache_snapshot is None or self._checked_reference_cache_snapshot[0] is not snapshot:
+            doc = self._db.reference_cache.find_one({'key': 'cache_id'})
+            is_current = doc is not None and doc['val'] == snapshot['cache_id']
+            if not is_current:
+                print("WARNING: reference cache snapshot %s is out of date. Using mongo reference_cache instead." % self._reference_cache_snapshot_path)
+            self._checked_reference_cache_snapshot = (snapshot, is_current)
+
+        return snapshot if self._checked_reference_cache_snapshot[1] else None
+
+    def _check_reference_cache_id(self):
+        """
+        Clears this process's gene memo if the reference_cache got a new cache_id - ie. the genes were reloaded,
+        maybe by another process - since it was last checked. Checks at most every REFERENCE_CACHE_CHECK_INTERVAL seconds.
+        """
+        now = time.time()
+        if self._reference_cache_checked_at is not None and now - self._reference_cache_checked_at <= REFERENCE_CACHE_CHECK_INTERVAL:
+            return
+
+        doc = self._db.reference_cache.find_one({'key': 'cache_id'})
+        cache_id = doc['val'] if doc else None
+        if cache_id != self._reference_cache_id:
+            self._reset_cached_reference_info(cache_id)
+        self._reference_cache_checked_at = now
+
+    def _reset_cached_reference_info(self, cache_id):
+        """
+        Drops everything this process cached from the reference_cache, which now has the given cache_id
+        Getters read each cache into a local before using it, since this can run in another thread
+        """
+        self._clear_gene_memo()
+        self._checked_reference_cache_snapshot = None
+        for key in PRELOADED_CACHE_KEYS:
+            setattr(self, '_' + key, None)
+        self._mendelian_phenotype_genes = None
+        self._disease_genes = None
+        self._gene_interval_index = None
+        self._coding_regions = None
+        self._reference_cache_id = cache_id
+        self._reference_cache_checked_at = time.time()
+
     def _ensure_cache(self, key):
         varname = '_' + key
-        if getattr(self, varname) is None:
-            setattr(self, varname, self._get_reference_cache(key))
+        val = getattr(self, varname)
+        if val is None:
+            val = self._get_reference_cache(key)
+            setattr(self, varname, val)
+        return val
+
+    def preload(self, freeze=False):
+        """
+        Loads all the lazily-loaded gene caches, the gene interval index and the clinvar index up front.
+        Call this in a process before it forks workers, so that they share the data copy-on-write instead of
+        each loading its own copy on its first requests.
+
+        Args:
+            freeze (bool): convert the caches with freeze_structure, so the garbage collector stops writing
+                to - and so un-sharing - the memory of their millions of small containers
+        """
+        # so a first cache_id check doesn't drop what's loaded here
+        self._check_reference_cache_id()
+        for key in PRELOADED_CACHE_KEYS:
+            self._ensure_cache(key)
+        self.is_in_disease_gene_db(None)
+        self.has_mendelian_phenotype(None)
+        self.get_gene_interval_index()
+        self._get_clinvar_index()
+
+        if freeze:
+            snapshot = self._get_reference_cache_snapshot()
+            for key in PRELOADED_CACHE_KEYS + ('disease_genes', 'mendelian_phenotype_genes'):
+                varname = '_' + key
+                frozen = freeze_structure(getattr(self, varname))
+                setattr(self, varname, frozen)
+                if snapshot is not None and key in snapshot['caches']:
+                    # otherwise the snapshot would keep the unfrozen copy alive
+                    snapshot['caches'][key] = frozen
+            # each collection untracks one more level of nested containers
+            for _ in range(FREEZE_GC_PASSES):
+                gc.collect()
 
     #
     # Gene lookups
@@ -328,29 +543,19 @@ class Reference(object):
         raise NotImplementedError
 
     def get_ordered_genes(self):
-        if self._ordered_genes is None:
-            self._ordered_genes = self._get_reference_cache('ordered_genes')
-        return self._ordered_genes
+        return self._ensure_cache('ordered_genes')
 
     def get_gene_bounds(self, gene_id):
-        if self._gene_positions is None:
-            self._gene_positions = self._get_reference_cache('gene_positions')
-
-        return self._gene_positions.get(gene_id)
+        return self._ensure_cache('gene_positions').get(gene_id)
 
     def get_gene_symbol(self, gene_id):
-        if self._gene_symbols is None:
-            self._gene_symbols = self._get_reference_cache('gene_symbols')
-        return self._gene_symbols.get(gene_id)
+        return self._ensure_cache('gene_symbols').get(gene_id)
 
     def get_gene_id_from_symbol(self, symbol):
-        if self._gene_symbols_r is None:
-            self._gene_symbols_r = self._get_reference_cache('gene_symbols_r')
-        return self._gene_symbols_r.get(symbol.lower().replace('.', '_'))
+        return self._ensure_cache('gene_symbols_r').get(symbol.lower().replace('.', '_'))
 
     def is_valid_gene_id(self, gene_id):
-        self._ensure_cache('gene_symbols')
-        return gene_id in self._gene_symbols
+        return gene_id in self._ensure_cache('gene_symbols')
 
     def get_gene(self, gene_id):
         """
@@ -358,51 +563,122 @@ class Reference(object):
         - structure, ie. exons and transcripts
         - statistics
         """
-        return self._db.genes.find_one({'gene_id': gene_id}, projection={'_id': False})
+        return self.get_genes([gene_id])[gene_id]
 
     def get_genes(self, gene_id_list):
         """
         get_gene for a set of genes
-        faster because only one db call
-        TODO: but haven't optimized yet
+        faster because only one db call, for the genes that aren't memoized
         return map of gene_id -> gene
         gene is None if gene_id invalid
+        Gene documents are memoized and shared, so callers shouldn't modify them
         """
-        return {gene_id: self.get_gene(gene_id) for gene_id in gene_id_list}
+        self._check_reference_cache_id()
+        counts = self.get_gene_lookup_counts()
+        ret = {}
+        with self._gene_memo_lock:
+            for gene_id in gene_id_list:
+                counts['gene_lookups'] += 1
+                if gene_id in self._gene_memo:
+                    counts['memo_hits'] += 1
+                    ret[gene_id] = self._gene_memo.pop(gene_id)
+                    self._gene_memo[gene_id] = ret[gene_id]  # most recently used goes last
+
+        missing_gene_ids = [gene_id for gene_id in set(gene_id_list) if gene_id not in ret]
+        if missing_gene_ids:
+            counts['db_queries'] += 1
+            for gene_id in missing_gene_ids:
+                ret[gene_id] = None
+            for gene in self._db.genes.find({'gene_id': {'$in': missing_gene_ids}}, projection={'_id': False}):
+                ret[gene['gene_id']] = gene
+
+            with self._gene_memo_lock:
+                for gene_id in missing_gene_ids:
+                    # unknown gene ids aren't memoized, since they may be added by the next load
+                    if ret[gene_id] is not None:
+                        self._gene_memo[gene_id] = ret[gene_id]
+                while len(self._gene_memo) > GENE_MEMO_SIZE:
+                    self._gene_memo.popitem(last=False)
+
+        return ret
+
+    def _clear_gene_memo(self):
+        with self._gene_memo_lock:
+            self._gene_memo.clear()
+
+    def get_gene_lookup_counts(self):
+        """
+        Returns this thread's gene lookup counts since the last reset_gene_lookup_counts(), as a dict with
+        'gene_lookups' (genes requested), 'memo_hits' (genes found in the memo) and 'db_queries'
+        """
+        if not hasattr(self._lookup_counts, 'counts'):
+            self.reset_gene_lookup_counts()
+        return self._lookup_counts.counts
+
+    def reset_gene_lookup_counts(self):
+        self._lookup_counts.counts = {'gene_lookups': 0, 'memo_hits': 0, 'db_queries': 0}
+
+    def get_gene_interval_index(self):
+        """
+        IntervalIndex of gene_id by gene xstart / xstop
+        """
+        self._check_reference_cache_id()
+        gene_interval_index = self._gene_interval_index
+        if gene_interval_index is None:
+            gene_interval_index = IntervalIndex((t[1], t[2], t[0]) for t in self.get_ordered_genes())
+            self._gene_interval_index = gene_interval_index
+        return gene_interval_index
 
     def get_genes_in_region(self, region_start, region_end):
         """
         List of gene_ids of genes that overlap this region
         Inclusive
         """
-        if not hasattr(self, '_genetree'):
-            import banyan
-            self._genetree = banyan.SortedSet([(t[1], t[2]) for t in self.get_ordered_genes()], updator=banyan.OverlappingIntervalsUpdator)
-            self._geneposmap = {(t[1], t[2]): t[0] for t in self.get_ordered_genes()}
-        ret = []
-        for item in self._genetree.overlap((region_start, region_end)):
-            ret.append(self._geneposmap[item])
-        return ret
+        return self.get_gene_interval_index().overlap(region_start, region_end)
         # return [gene['gene_id'] for gene in self._db.genes.find({
         #     'xstart': {'$lte': region_end},
         #     'xstop': {'$gte': region_start},
         # })]
 
 
+    def is_in_disease_gene_db(self, gene_id):
+        """
+        Whether OMIM or Orphanet list any phenotypes for this gene
+        """
+        self._check_reference_cache_id()
+        disease_genes = self._disease_genes
+        if disease_genes is None:
+            disease_genes = self._get_reference_cache('disease_genes')
+            if disease_genes is None:
+                # the reference cache was built before it included this
+                disease_genes = [
+                    gene['gene_id'] for gene in self._db.genes.find(
+                        {'phenotype_info': {'$exists': True}}, projection={'gene_id': True, 'phenotype_info': True})
+                    if _has_disease_db_phenotypes(gene)
+                ]
+            disease_genes = set(disease_genes)
+            self._disease_genes = disease_genes
+        return gene_id in disease_genes
+
+    def has_mendelian_phenotype(self, gene_id):
+        self._check_reference_cache_id()
+        mendelian_phenotype_genes = self._mendelian_phenotype_genes
+        if mendelian_phenotype_genes is None:
+            mendelian_phenotype_genes = set(self._get_reference_cache('mendelian_phenotype_genes') or [])
+            self._mendelian_phenotype_genes = mendelian_phenotype_genes
+        return gene_id in mendelian_phenotype_genes
+
     def get_gene_summary(self, gene_id):
-        self._ensure_cache('gene_summaries')
-        return self._gene_summaries.get(gene_id, "")
+        return self._ensure_cache('gene_summaries').get(gene_id, "")
 
     def get_gene_symbols(self):
         """
         Map of gene_id -> gene symbol for all genes
         """
-        if self._gene_symbols is None:
-            self._gene_symbols = self._get_reference_cache('gene_symbols')
-            
-        if self._gene_symbols is None:
+        gene_symbols = self._ensure_cache('gene_symbols')
+        if gene_symbols is None:
             raise Exception("gene_symbols collection not found in mongodb. If this is a new install, please run python manage.py load_resources")
-        return self._gene_symbols
+        return gene_symbols
 
     def get_ordered_exons(self):
         """
@@ -416,12 +692,33 @@ class Reference(object):
         """
         Get the data for displaying tissue expression plot
 
-        This is a list of ~60 expression values for each tissue, so it's pretty big, hence not part of get_gene()
+        This is a list of the non-zero expression values for each tissue, so it's pretty big, hence not part of get_gene()
         """
         doc = self._db.tissue_expression.find_one({'gene_id': gene_id})
         if doc is None:
             return None
-        return doc['expression_display_values']
+        if 'expression_display_values' in doc:
+            # loaded before values were stored as arrays
+            return doc['expression_display_values']
+
+        tissue_index = self._get_tissue_expression_index()
+        values = numpy.frombuffer(doc['values'], dtype=numpy.float32)
+        if tissue_index is None or sum(num_samples for _, num_samples in tissue_index) != len(values):
+            return None
+        return gene_expression.get_expression_display_values(values, tissue_index)
+
+    def get_tissue_expression_summary(self, gene_id):
+        """
+        Returns a dict of tissue_type -> [min, first quartile, median, third quartile, max] expression, or None
+        """
+        doc = self._db.tissue_expression.find_one({'gene_id': gene_id}, projection={'summary': True})
+        if doc is None:
+            return None
+        return doc.get('summary')
+
+    def _get_tissue_expression_index(self):
+        doc = self._db.reference_cache.find_one({'key': 'tissue_expression_index'})
+        return doc['val'] if doc else None
 
     def get_gene_structure(self, gene_id):
         d = dict()
@@ -433,200 +730,71 @@ class Reference(object):
         """
         Return a list of CodingRegions, in order
         "order" implies that cdrs for a gene might not be consecutive
+        The list is computed once per version of the reference_cache and shared, so callers shouldn't modify it
         """
-        cdr_list = []
-        for gene_id in self.get_all_gene_ids():
-            gene = self.get_gene(gene_id)
-            if gene['gene_type'] != 'protein_coding':
-                continue
-            gene_structure = self.get_gene_structure(gene_id)
-            flattened_cdrs = get_coding_regions_from_gene_structure(gene_id, gene_structure)
-            cdr_list.extend(flattened_cdrs)
-        return sorted(cdr_list, key=lambda x: (x.xstart, x.xstop))
-
-    def get_clinvar_info(self, xpos, ref, alt):
-        doc = self._db.clinvar.find_one({'xpos': xpos, 'ref': ref, 'alt': alt})
-        if doc is None:
-            return None, ''
-        else:
-            return doc['variant_id'], doc['clinsig']
-
-
-class EnsemblRESTProxy(object):
-    """
-    Wrapper over an Ensembl REST server that a Reference uses as its underlying data source
-    """
-
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-
-    def _get_rest_url(self):
-        return "http://%s:%d" % (self.host, self.port)
+        self._check_reference_cache_id()
+        coding_regions = self._coding_regions
+        if coding_regions is None:
+            compressed_coding_regions = self._get_reference_cache('coding_regions')
+            if compressed_coding_regions is None:
+                # reference_cache is from before coding regions were cached
+                coding_regions = self._compute_coding_regions()
+            else:
+                coding_regions = [CodingRegion(*r) for r in json.loads(zlib.decompress(compressed_coding_regions))]
+            self._coding_regions = coding_regions
+        return coding_regions
 
-    def get_phenotype_info(self, gene_id):
+    def _compute_coding_regions(self):
         """
-        Here's what returns for RYR1:
-        {
-            'has_mendelian_phenotype': true,
-            'mim_id': "180901",
-            'mim_phenotypes': [
-                {'mim_id': '117000', 'description': 'CENTRAL CORE DISEASE OF MUSCLE'},
-                ...
-            ],
-            'orphanet_phenotypes': [
-                {'orphanet_id': '178145', 'description': 'Moderate multiminicore disease with hand involvement'},
-                ...
-            ]
-        }
+        Computes the sorted list of CodingRegions of all protein coding genes from the genes and exons collections
         """
+        coding_gene_ids = set(
+            gene['gene_id'] for gene in self._db.genes.find({'gene_type': 'protein_coding'}, projection={'gene_id': True})
+        )
+        coding_exons_by_gene = defaultdict(list)
+        for exon in self._db.exons.find(
+                {'cds_xstart': {'$exists': True}}, projection={'_id': False, 'gene_id': True, 'cds_xstart': True, 'cds_xstop': True}):
+            if exon['gene_id'] in coding_gene_ids:
+                coding_exons_by_gene[exon['gene_id']].append(exon)
 
-        phenotype_info = {
-            'mim_id': None,
-            'mim_phenotypes': [],
-            'orphanet_phenotypes': []
-        }
-
-        url = self._get_rest_url() + '/xrefs/id/%s' % gene_id
-        params = {'content-type': 'application/json'}
-        xrefs_json = requests.get(url, params=params).json()
-
-        for item in xrefs_json:
-
-            if item['dbname'] == 'MIM_GENE':
-                phenotype_info['mim_id'] = item['primary_id']
-
-            elif item['dbname'] == 'MIM_MORBID':
-                phenotype_info['mim_phenotypes'].append({
-                    'mim_id': item['primary_id'],
-                    'description': item['description']
-                })
-
-            elif item['dbname'] == 'Orphanet':
-                phenotype_info['orphanet_phenotypes'].append({
-                    'orphanet_id': item['primary_id'],
-                    'description': item['description']
-                })
-
-        if len(phenotype_info['mim_phenotypes']) > 0 or len(phenotype_info['orphanet_phenotypes']) > 0:
-            phenotype_info['has_mendelian_phenotype'] = True
-        else:
-            phenotype_info['has_mendelian_phenotype'] = False
+        cdr_list = []
+        for gene_id, exons in coding_exons_by_gene.items():
+            cdr_list.extend(get_coding_regions_from_gene_structure(gene_id, {'exons': exons}))
+        return sorted(cdr_list, key=lambda x: (x.xstart, x.xstop, x.gene_id))
 
-        return phenotype_info
+    def get_clinvar_info(self, xpos, ref, alt):
+        """
+        Returns (clinvar variant_id, clinsig) for the given variant, or (None, '') if it isn't in clinvar
+        """
+        return self.get_clinvar_info_many([(xpos, ref, alt)])[(xpos, ref, alt)]
 
-    def get_gene_structure(self, gene_id):
+    def get_clinvar_info_many(self, variant_t_list):
         """
-        Query ensembl API for the transcript/exon structure of a gene
-        This is the foundation of the elements in db.genes
-        Exception if can't process gene
-        """
-
-        gene = {}
-
-        # gene basics
-        url = self._get_rest_url() + '/feature/id/%s' % gene_id
-        params = {'content-type': 'application/json', 'feature': 'gene'}
-        gene_list_json = requests.get(url, params=params).json()
-        gene_list_json = [item for item in gene_list_json if item['ID'] == gene_id]
-        if len(gene_list_json) == 0:
-            raise Exception("No genes with ID %s" % gene_id)
-        if len(gene_list_json) > 1:
-            raise Exception(">1 ensembl genes with ID %s" % gene_id)
-        gene_json = gene_list_json[0]
-
-        chr = ensembl_parsing_utils.get_chr_from_seq_region_name(gene_json['seq_region_name'])
-        if chr is None:
-            raise Exception("Gene %s is on a nonstandard chromosome: %s" % (gene_id, chr) )
-
-        gene['chr'] = chr
-        gene['start'] = gene_json['start']
-        gene['stop'] = gene_json['end']
-        gene['xstart'] = genomeloc.get_single_location(chr, gene['start'])
-        gene['xstop'] = genomeloc.get_single_location(chr, gene['stop'])
-
-        gene['gene_id'] = gene_json['ID']
-        gene['symbol'] = gene_json['external_name']
-        gene['description'] = gene_json['description']
-        gene['biotype'] = gene_json['biotype']
-
-        # transcripts
-        url = self._get_rest_url() + '/feature/id/%s' % gene_id
-        params = {'content-type': 'application/json', 'feature': 'transcript'}
-        transcript_json = [t for t in requests.get(url, params=params).json() if t['Parent'] == gene_id]
-
-        gene['transcripts'] = []
-        for t in transcript_json:
-            transcript_id = t['ID']
-            transcript = dict(
-                transcript_id=transcript_id,
-                biotype=t['biotype'],
-                start=t['start'],
-                stop=t['end']
-            )
-            transcript['xstart'] = genomeloc.get_single_location(chr, transcript['start'])
-            transcript['xstop'] = genomeloc.get_single_location(chr, transcript['stop'])
-
-            # exons_for_transcript
-            url = self._get_rest_url() + '/feature/id/%s' % transcript_id
-            params = {'content-type': 'application/json', 'feature': 'exon'}
-            transcript_exon_json = requests.get(url, params=params).json()
-            transcript['exons'] = [
-                e['ID'] for e in sorted(transcript_exon_json, key=lambda x: x['start']) if e['Parent'] == transcript_id
-            ]
-
-            gene['transcripts'].append(transcript)
-
-        # exons
-        url = self._get_rest_url() + '/feature/id/%s' % gene_id
-        params = {'content-type': 'application/json', 'feature': 'exon'}
-        exon_json = requests.get(url, params=params).json()
-
-        transcript_ids = {t['transcript_id'] for t in gene['transcripts']}
-        exon_ids_seen = set()
-        gene['exons'] = []
-        for e in exon_json:
-            exon_id = e['ID']
-            # skip exons that aren't actually in one of this gene's transcripts
-            if e['Parent'] not in transcript_ids:
-                continue
-            if exon_id in exon_ids_seen:
-                continue
-            exon = {
-                'exon_id': exon_id,
-                'start': e['start'],
-                'stop': e['end'],
-            }
-            exon['xstart'] = genomeloc.get_single_location(chr, exon['start'])
-            exon['xstop'] = genomeloc.get_single_location(chr, exon['stop'])
-            gene['exons'].append(exon)
-            exon_ids_seen.add(e['ID'])
-
-        # cds
-        url = self._get_rest_url() + '/feature/id/%s' % gene_id
-        params = {'content-type': 'application/json', 'feature': 'cds'}
-        cds_json = requests.get(url, params=params).json()
-
-        cds_map = {}  # map from (start, stop) -> {start, stop, transcripts}
-        for c in cds_json:
-            # skip exons that aren't actually in one of this gene's transcripts
-            if c['Parent'] not in transcript_ids:
-                continue
-            cds_t = (c['start'], c['end'])
-            if cds_t not in cds_map:
-                cds_map[cds_t] = {
-                    'start': c['start'],
-                    'stop': c['end'],
-                    'xstart': genomeloc.get_single_location(chr, c['start']),
-                    'xstop': genomeloc.get_single_location(chr, c['end']),
-                    'transcripts': [],
-                }
-            cds_map[cds_t]['transcripts'].append(c['Parent'])
-        gene['cds'] = sorted(cds_map.values(), key=lambda x: (x['start'], x['stop']))
-        for i, cds in enumerate(gene['cds']):
-            cds['cds_id'] = '%s-%i' % (gene['gene_id'], i+1)
-        return gene
+        Batch version of get_clinvar_info.
+        Returns a dict that maps each (xpos, ref, alt) tuple in variant_t_list to a (variant_id, clinsig) tuple
+        """
+        variant_t_list = list(variant_t_list)
+        clinvar_info = self._get_clinvar_index().get_clinvar_info_many(variant_t_list)
+        return {variant_t: clinvar_info.get(variant_t, (None, '')) for variant_t in variant_t_list}
 
+    def _get_clinvar_index(self):
+        """
+        Returns this process's ClinvarIndex, rebuilding it from the clinvar collection if clinvar was reloaded
+        """
+        now = time.time()
+        if self._clinvar_index is None or now - self._clinvar_index_checked_at > CLINVAR_VERSION_CHECK_INTERVAL:
+            doc = self._db.reference_cache.find_one({'key': 'clinvar_version'})
+            clinvar_version = doc['val'] if doc else None
+            if self._clinvar_index is None or self._clinvar_index[0] != clinvar_version:
+                clinvar_index = ClinvarIndex(self._db.clinvar.find(
+                    projection={'_id': False, 'xpos': True, 'ref': True, 'alt': True, 'variant_id': True, 'clinsig': True}))
+                self._clinvar_index = (clinvar_version, clinvar_index)
+            self._clinvar_index_checked_at = now
+        return self._clinvar_index[1]
+
+def _has_disease_db_phenotypes(gene):
+    phenotype_info = gene.get('phenotype_info')
+    return bool(phenotype_info and (phenotype_info.get('orphanet_phenotypes') or phenotype_info.get('mim_phenotypes')))
 
 
 class EnsemblDBProxy(object):
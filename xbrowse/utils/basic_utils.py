@@ -208,6 +208,25 @@ def slugify(s, separator='_', replace_dot=False):
     return separator.join(filter(None, words))
 
 
+def freeze_structure(obj):
+    """Returns a copy of a nested structure of dicts, lists, tuples and sets, with every list converted to a tuple and
+    every set to a frozenset.
+
+    Tuples that only hold strings, numbers and untracked tuples - and dicts whose values are all such objects - stop
+    being tracked by the garbage collector once it has passed over them - one pass per level of nesting - so it no
+    longer writes to their memory.
+    In a process that forks workers, this keeps large caches in pages that stay shared copy-on-write with the workers.
+    Dicts are copied but stay mutable - callers shouldn't modify them.
+    """
+    if isinstance(obj, dict):
+        return {k: freeze_structure(v) for k, v in obj.iteritems()}
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze_structure(v) for v in obj)
+    if isinstance(obj, (set, frozenset)):
+        return frozenset(obj)
+    return obj
+
+
 # make encoded values as human-readable as possible
 ES_FIELD_NAME_ESCAPE_CHAR = '$'
 ES_FIELD_NAME_BAD_LEADING_CHARS = set(['_', '-', '+', ES_FIELD_NAME_ESCAPE_CHAR])
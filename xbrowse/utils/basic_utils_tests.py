@@ -1,5 +1,7 @@
+import gc
+
 from django.test import TestCase
-from xbrowse.utils.basic_utils import _encode_name, _decode_name
+from xbrowse.utils.basic_utils import _encode_name, _decode_name, freeze_structure
 
 
 class BasicUtilsTest(TestCase):
@@ -28,7 +30,19 @@ class BasicUtilsTest(TestCase):
             decoded_test_char = _decode_name(_encode_name(test_char))
             self.assertEqual(test_char, decoded_test_char)
 
-
-
-
-
+    def test_freeze_structure(self):
+        frozen = freeze_structure({
+            'ordered_genes': [['ENSG1', 1000000100, 1000000200], ['ENSG2', 1000000150, 1000000300]],
+            'gene_summaries': {'ENSG1': {'symbol': 'A', 'rank': [1, 2]}},
+            'gene_ids': set(['ENSG1']),
+        })
+        self.assertEqual(frozen, {
+            'ordered_genes': (('ENSG1', 1000000100, 1000000200), ('ENSG2', 1000000150, 1000000300)),
+            'gene_summaries': {'ENSG1': {'symbol': 'A', 'rank': (1, 2)}},
+            'gene_ids': frozenset(['ENSG1']),
+        })
+
+        for _ in range(3):  # one pass per level of nesting
+            gc.collect()
+        self.assertFalse(gc.is_tracked(frozen['ordered_genes']))
+        self.assertFalse(gc.is_tracked(frozen['gene_summaries']['ENSG1']))
@@ -0,0 +1,77 @@
+"""
+Static index of inclusive (start, end) intervals - eg. gene or exon xstart / xstop - for overlap queries.
+
+Intervals are kept sorted by start, along with a running max of their ends. The intervals that overlap
+[query_start, query_end] are all between the first one whose running max end reaches query_start and the last
+one that starts at or before query_end, so a single query is two bisects plus a scan of that range.
+For many queries sorted by start - eg. a sorted variant stream - overlap_sorted answers them all in one merge
+pass over the intervals instead.
+"""
+
+import bisect
+
+
+class IntervalIndex():
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals: iter of (start, end, value) tuples, in any order. Intervals are inclusive, and may
+                overlap or be identical - each value is returned separately.
+        """
+        intervals = sorted(intervals, key=lambda t: (t[0], t[1]))
+        self._starts = [t[0] for t in intervals]
+        self._ends = [t[1] for t in intervals]
+        self._values = [t[2] for t in intervals]
+
+        self._max_ends = []
+        max_end = None
+        for end in self._ends:
+            if max_end is None or end > max_end:
+                max_end = end
+            self._max_ends.append(max_end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def overlap(self, start, end):
+        """
+        Returns the values of the intervals that overlap [start, end], in order of interval start
+        """
+        ends = self._ends
+        first_i = bisect.bisect_left(self._max_ends, start)
+        last_i = bisect.bisect_right(self._starts, end)
+        return [self._values[i] for i in xrange(first_i, last_i) if ends[i] >= start]
+
+    def overlap_sorted(self, queries):
+        """
+        Batch version of overlap, for queries sorted by start.
+        Walks the intervals once, keeping only the ones that can still overlap the next query,
+        so the total work is linear in len(queries) + len(self) plus the number of overlaps returned.
+
+        Args:
+            queries: iter of (start, end) tuples - or longer tuples that start with start, end - sorted by start
+        Yields:
+            (query, list of values) tuples, in query order
+        """
+        starts, ends, values = self._starts, self._ends, self._values
+        num_intervals = len(starts)
+
+        active = []  # indexes of intervals that started before the last query end and may still overlap
+        next_i = 0
+        previous_start = None
+        for query in queries:
+            query_start, query_end = query[0], query[1]
+            if previous_start is not None and query_start < previous_start:
+                raise ValueError("overlap_sorted queries must be sorted by start: %s came after %s" % (query_start, previous_start))
+            previous_start = query_start
+
+            while next_i < num_intervals and starts[next_i] <= query_end:
+                active.append(next_i)
+                next_i += 1
+            # later queries start at or after this one, so intervals that end before it are done
+            if any(ends[i] < query_start for i in active):
+                active = [i for i in active if ends[i] >= query_start]
+
+            # active can include intervals added for an earlier, longer query that start after this one ends
+            yield query, [values[i] for i in active if starts[i] <= query_end]
@@ -0,0 +1,51 @@
+import random
+
+from django.test import TestCase
+from xbrowse.utils.interval_index import IntervalIndex
+
+
+class IntervalIndexTest(TestCase):
+
+    def test_overlap(self):
+        index = IntervalIndex([
+            (100, 200, 'a'),
+            (150, 160, 'b'),
+            (150, 160, 'c'),  # identical intervals are both returned
+            (300, 300, 'd'),
+            (50, 1000, 'e'),
+        ])
+
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.overlap(10, 49), [])
+        self.assertEqual(index.overlap(155, 155), ['e', 'a', 'b', 'c'])
+        self.assertEqual(index.overlap(200, 300), ['e', 'a', 'd'])
+        self.assertEqual(index.overlap(301, 2000), ['e'])
+        self.assertEqual(index.overlap(1001, 2000), [])
+        self.assertEqual(IntervalIndex([]).overlap(1, 2), [])
+
+    def test_overlap_sorted_matches_overlap(self):
+        rand = random.Random(0)
+        intervals = []
+        for i in range(300):
+            start = rand.randint(1, 10000)
+            intervals.append((start, start + rand.choice([0, 10, 100, 5000]), i))
+        index = IntervalIndex(intervals)
+
+        queries = []
+        for i in range(1000):
+            start = rand.randint(1, 12000)
+            queries.append((start, start + rand.choice([0, 0, 50, 3000])))
+        queries.sort(key=lambda q: q[0])
+
+        results = list(index.overlap_sorted(queries))
+        self.assertEqual([q for q, values in results], queries)
+        for query, values in results:
+            self.assertEqual(values, index.overlap(*query))
+            expected = [v for interval_start, interval_end, v in intervals
+                        if interval_start <= query[1] and interval_end >= query[0]]
+            self.assertEqual(sorted(values), sorted(expected))
+
+    def test_overlap_sorted_requires_sorted_queries(self):
+        index = IntervalIndex([(100, 200, 'a')])
+        with self.assertRaises(ValueError):
+            list(index.overlap_sorted([(150, 150), (120, 120)]))
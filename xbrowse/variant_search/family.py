@@ -144,10 +144,39 @@ def is_family_compound_het_for_combo(combo, family):
     return valid
 
 
+def get_compound_het_variants(variants, family):
+    """
+    Variants that are in at least one pair that is compound het in family (see is_family_compound_het_for_combo)
+    Rather than checking every pair, variants are grouped by a bitmask of the unaffected individuals that carry them -
+    a pair is valid if no unaffected carries both, so only pairs of groups need to be checked.
+    Variants that any unaffected is homozygous alt for can't be in any pair.
+    """
+    unaffected_ids = [indiv_id for indiv_id, individual in family.individuals.items() if individual.affected_status == 'unaffected']
+
+    variants_by_mask = defaultdict(list)
+    for variant in variants:
+        mask = 0
+        for i, indiv_id in enumerate(unaffected_ids):
+            num_alt = variant.get_genotype(indiv_id).num_alt
+            if num_alt > 1:
+                break
+            if num_alt > 0:
+                mask |= 1 << i
+        else:
+            variants_by_mask[mask].append(variant)
+
+    valid_masks = set()
+    for mask1, mask2 in itertools.combinations_with_replacement(variants_by_mask.keys(), 2):
+        if mask1 & mask2 == 0 and (mask1 != mask2 or len(variants_by_mask[mask1]) > 1):
+            valid_masks.update([mask1, mask2])
+
+    return {variant.unique_tuple(): variant for mask in valid_masks for variant in variants_by_mask[mask]}.values()
+
+
 def get_compound_het_genes(datastore, reference, family, variant_filter=None, quality_filter=None, user=None):
     """
     Gene-based inheritance; genes with variants that follow compound het inheritance in a family
-    Note that compound het implies two variants, so we look at all variant pairs
+    Note that compound het implies two variants, so we look for valid variant pairs (see get_compound_het_variants)
     Return is a stream of tuples (gene_name, variant_list)
     """
 
@@ -162,21 +191,13 @@ def get_compound_het_genes(datastore, reference, family, variant_filter=None, qu
 
         variants = search_utils.filter_gene_variants_by_variant_filter(raw_variants, gene_name, variant_filter)
 
-        variants_to_return = {}
-
         # don't care about genes w less than 2 variants
         if len(variants) < 2:
             continue
 
-        combos = itertools.combinations(variants, 2)
-        for combo in combos:
-            valid = is_family_compound_het_for_combo(combo, family)
-            if valid:
-                variants_to_return[combo[0].unique_tuple()] = combo[0]
-                variants_to_return[combo[1].unique_tuple()] = combo[1]
-
+        variants_to_return = get_compound_het_variants(variants, family)
         if len(variants_to_return) > 0:
-            yield (gene_name, variants_to_return.values())
+            yield (gene_name, variants_to_return)
 
 
 def get_recessive_genes(datastore, reference, family, variant_filter=None, quality_filter=None, user=None):
@@ -189,7 +210,8 @@ def get_recessive_genes(datastore, reference, family, variant_filter=None, quali
     # combine hom rec and x linked into single variant stream, then gene stream
     hom_rec_variants = get_homozygous_recessive_variants(datastore, reference, family, variant_filter, quality_filter, user=user)
     x_linked_variants = get_x_linked_variants(datastore, reference, family, variant_filter, quality_filter, user=user)
-    single_variants = stream_utils.combine_variant_streams([hom_rec_variants, x_linked_variants])
+    single_variants = stream_utils.unique_variant_stream(
+        stream_utils.combine_variant_streams([hom_rec_variants, x_linked_variants]))
     single_variants_by_gene = stream_utils.variant_stream_to_gene_stream(single_variants, reference)
 
     # combine with compound het genes
@@ -0,0 +1,61 @@
+import itertools
+import random
+
+from django.test import TestCase
+from xbrowse import Genotype, Variant
+from xbrowse.core.samples import Family, Individual
+from xbrowse.variant_search import family as family_search
+
+
+def make_variant(pos, num_alts):
+    variant = Variant(1000000000 + pos, 'A', 'G')
+    for indiv_id, num_alt in num_alts.items():
+        variant.genotypes[indiv_id] = Genotype(
+            alleles=[], gq=None, num_alt=num_alt, filter='pass', ab=None, extras={})
+    return variant
+
+
+class CompoundHetTest(TestCase):
+
+    def setUp(self):
+        self.family = Family('F1', [
+            Individual('child', affected_status='affected'),
+            Individual('father', affected_status='unaffected'),
+            Individual('mother', affected_status='unaffected'),
+            Individual('sibling', affected_status='unknown'),
+        ])
+
+    def test_get_compound_het_variants(self):
+        paternal = make_variant(1, {'child': 1, 'father': 1, 'mother': 0, 'sibling': 2})
+        maternal = make_variant(2, {'child': 1, 'father': 0, 'mother': 1, 'sibling': 0})
+        other_paternal = make_variant(3, {'child': 1, 'father': 1, 'mother': 0, 'sibling': 0})
+        both_parents = make_variant(4, {'child': 1, 'father': 1, 'mother': 1, 'sibling': 0})
+        hom_parent = make_variant(5, {'child': 1, 'father': 0, 'mother': 2, 'sibling': 0})
+
+        def get_positions(variants):
+            return sorted(variant.xpos - 1000000000 for variant in
+                          family_search.get_compound_het_variants(variants, self.family))
+
+        self.assertEqual(get_positions([paternal, maternal, other_paternal, both_parents, hom_parent]), [1, 2, 3])
+        self.assertEqual(get_positions([paternal, other_paternal, both_parents, hom_parent]), [])
+
+        # a de novo variant pairs with anything, including another de novo
+        de_novo = make_variant(6, {'child': 1, 'father': 0, 'mother': 0, 'sibling': 0})
+        self.assertEqual(get_positions([both_parents, de_novo]), [4, 6])
+        self.assertEqual(get_positions([de_novo]), [])
+        self.assertEqual(get_positions([de_novo, make_variant(7, {'child': 1, 'father': -1, 'mother': 0})]), [6, 7])
+
+    def test_matches_pairwise_check(self):
+        rand = random.Random(0)
+        for _ in range(50):
+            variants = [
+                make_variant(pos, {indiv_id: rand.choice([-1, 0, 0, 1, 1, 2]) for indiv_id in self.family.individuals})
+                for pos in range(rand.randint(0, 12))
+            ]
+            expected = set()
+            for combo in itertools.combinations(variants, 2):
+                if family_search.is_family_compound_het_for_combo(combo, self.family):
+                    expected.update(variant.xpos for variant in combo)
+            self.assertEqual(
+                set(variant.xpos for variant in family_search.get_compound_het_variants(variants, self.family)),
+                expected)
@@ -129,13 +129,9 @@ def add_gene_databases_to_variants(variants):
     """
     Adds variant['gene_databases'] - a list of *gene* databases that this variant's gene(s) are seen in
     """
+    reference = get_reference()
     for variant in variants:
-        variant.set_extra('in_disease_gene_db', False)
-        for gene_id in variant.coding_gene_ids:
-            gene = get_reference().get_gene(gene_id)
-            # TODO: should be part of reference cache
-            if gene and 'phenotype_info' in gene and (len(gene['phenotype_info']['orphanet_phenotypes']) or len(gene['phenotype_info']['mim_phenotypes'])):
-                variant.set_extra('in_disease_gene_db', True)
+        variant.set_extra('in_disease_gene_db', any(reference.is_in_disease_gene_db(gene_id) for gene_id in variant.coding_gene_ids))
 
 
 def add_gene_names_to_variants(reference, variants):
@@ -194,9 +190,9 @@ def add_gene_info_to_variants(variants):
 
 
 def add_clinical_info_to_variants(variants):
+    clinvar_info = get_reference().get_clinvar_info_many([variant.unique_tuple() for variant in variants])
     for variant in variants:
-        xpos, ref, alt = variant.unique_tuple()
-        variant_id, clinsig = get_reference().get_clinvar_info(xpos, ref, alt)
+        variant_id, clinsig = clinvar_info[variant.unique_tuple()]
         variant.set_extra('clinvar_variant_id', variant_id)
         variant.set_extra('clinvar_clinsig', clinsig)
 
@@ -263,8 +259,7 @@ def add_extra_info_to_genes(project, reference, genes):
         if gene['gene_id'] in by_gene:
             gene['extras']['gene_lists'] = [g.name for g in by_gene[gene['gene_id']]]
 
-        xgene = reference.get_gene(gene['gene_id'])
-        if xgene and 'phenotype_info' in xgene and (len(xgene['phenotype_info']['orphanet_phenotypes']) or len(xgene['phenotype_info']['mim_phenotypes'])):
+        if reference.is_in_disease_gene_db(gene['gene_id']):
             gene['extras']['in_disease_gene_db'] = True
 
 
@@ -327,8 +327,9 @@ def cohort_gene_search_variants(request):
 @log_request('gene_info')
 def gene_info(request, gene_id):
 
-    gene = get_reference().get_gene(gene_id)
+    gene = dict(get_reference().get_gene(gene_id))
     gene['expression'] = get_reference().get_tissue_expression_display_values(gene_id)
+    gene['expression_summary'] = get_reference().get_tissue_expression_summary(gene_id)
     add_notes_to_genes([gene], request.user)
 
     ret = {
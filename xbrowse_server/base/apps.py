@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 from xbrowse_server import mall
 from django.db import connection
 from django.db.utils import OperationalError
@@ -27,3 +28,9 @@ class XBrowseBaseConfig(AppConfig):
                 
             ReferencePopulation = self.get_model('ReferencePopulation')
             mall.x_custom_populations = [p.to_dict() for p in ReferencePopulation.objects.all()]
+
+        if settings.PRELOAD_REFERENCE_DATA:
+            try:
+                mall.get_reference().preload(freeze=settings.FREEZE_PRELOADED_REFERENCE_DATA)
+            except Exception, e:
+                print("ERROR: couldn't preload reference data: %s" % e)
@@ -3,6 +3,7 @@ import os
 from xbrowse_server import xbrowse_controls
 from django.core.management.base import BaseCommand
 
+from xbrowse.parsers import vcf_index
 from xbrowse_server.base.models import Project, Individual, VCFFile
 from xbrowse_server import sample_management
 
@@ -25,6 +26,9 @@ class Command(BaseCommand):
         vcf_file_path = os.path.abspath(args[1])
         vcf_file = VCFFile.objects.get_or_create(file_path=vcf_file_path)[0]
 
+        # index the VCF once at registration, so later sample matching and progress reporting don't have to rescan it
+        vcf_index.get_vcf_index(vcf_file_path, full_scan=True)
+
         if options.get('clear'):
             for individual in project.individual_set.all():
                 individual.vcf_files.clear()
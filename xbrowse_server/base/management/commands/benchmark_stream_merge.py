@@ -0,0 +1,89 @@
+import Queue
+import random
+import time
+from django.core.management.base import BaseCommand
+from xbrowse.core import stream_utils
+
+
+class BenchmarkVariant(object):
+
+    __slots__ = ('xpos', 'ref', 'alt')
+
+    def __init__(self, xpos, ref, alt):
+        self.xpos = xpos
+        self.ref = ref
+        self.alt = alt
+
+
+def synthetic_variant_stream(seed, num_variants):
+    """Sorted variants on chr1, with positions drawn from a small range so that streams share many variants"""
+    rand = random.Random(seed)
+    xpos = 1000000000
+    for _ in xrange(num_variants):
+        xpos += rand.randint(0, 20)
+        yield BenchmarkVariant(xpos, 'A', rand.choice('CGT'))
+
+
+def priority_queue_merge(stream_list):
+    """The Queue.PriorityQueue merge that combine_variant_streams used before, for comparison"""
+    variant_queue = Queue.PriorityQueue()
+    for stream_index, stream in enumerate(stream_list):
+        try:
+            variant = stream.next()
+            variant_queue.put((variant.xpos, stream_index, variant))
+        except StopIteration:
+            pass
+
+    while not variant_queue.empty():
+        pos, stream_index, variant = variant_queue.get()
+        try:
+            next_variant = stream_list[stream_index].next()
+            variant_queue.put((next_variant.xpos, stream_index, next_variant))
+        except StopIteration:
+            pass
+        yield variant
+
+
+class Command(BaseCommand):
+    """Times merging synthetic sorted family variant streams into one genomic-order stream with the old
+    Queue.PriorityQueue merge vs. combine_variant_streams, and deduplicating the result with unique_variant_stream.
+    Also checks that each merged stream is in genomic order."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', dest='num_streams', type=int, default=100, help="Number of streams to merge")
+        parser.add_argument('-n', dest='stream_size', type=int, default=100000, help="Number of variants per stream")
+
+    def handle(self, *args, **options):
+        num_streams = options['num_streams']
+        stream_size = options['stream_size']
+        total_variants = num_streams * stream_size
+
+        def get_streams():
+            return [synthetic_variant_stream(seed, stream_size) for seed in range(num_streams)]
+
+        def count_variants(variant_stream, check_order):
+            count = 0
+            last_xpos = 0
+            for variant in variant_stream:
+                if check_order and variant.xpos < last_xpos:
+                    raise ValueError("Merged stream is out of order at %s" % variant.xpos)
+                last_xpos = variant.xpos
+                count += 1
+            return count
+
+        # (name, merge function, whether the result should be in genomic order)
+        benchmarks = [
+            ('read streams (no merge)', lambda streams: (variant for stream in streams for variant in stream), False),
+            ('Queue.PriorityQueue merge', priority_queue_merge, True),
+            ('combine_variant_streams', stream_utils.combine_variant_streams, True),
+            ('combine_variant_streams + unique_variant_stream',
+             lambda streams: stream_utils.unique_variant_stream(stream_utils.combine_variant_streams(streams)), True),
+        ]
+
+        print("Merging %s streams of %s variants" % (num_streams, stream_size))
+        for name, merge, check_order in benchmarks:
+            start = time.time()
+            count = count_variants(merge(get_streams()), check_order)
+            elapsed = time.time() - start
+            print("%s: %s variants in %0.2f seconds (%0.2f us per input variant)" % (
+                name, count, elapsed, 10**6 * elapsed / max(total_variants, 1)))
@@ -0,0 +1,62 @@
+import gzip
+import itertools
+import time
+from django.core.management.base import BaseCommand
+from xbrowse.annotation import vep_annotations
+
+
+class Command(BaseCommand):
+    """Times parsing a VEP-annotated VCF and selecting the worst transcript of each variant, overall and per coding
+    gene, with one get_worst_vep_annotation_index call per gene vs. the single-pass get_worst_vep_annotation_indexes.
+    Also checks that both give the same results."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('vcf_path', help="VEP-annotated VCF (.vcf or .vcf.gz)")
+        parser.add_argument('-n', dest='max_variants', type=int, default=100000, help="Number of variants to use")
+        parser.add_argument('--repeats', type=int, default=3, help="Times to repeat each selection benchmark")
+
+    def handle(self, *args, **options):
+        vcf_path = options['vcf_path']
+        vcf_file = gzip.open(vcf_path) if vcf_path.endswith('.gz') else open(vcf_path)
+
+        start = time.time()
+        vep_annotation_list = [
+            vep_annotation for _, vep_annotation in
+            itertools.islice(vep_annotations.parse_vep_annotations_from_vcf(vcf_file), 0, options['max_variants'])
+        ]
+        parse_time = time.time() - start
+        vcf_file.close()
+
+        num_variants = len(vep_annotation_list)
+        num_transcripts = sum(len(vep_annotation) for vep_annotation in vep_annotation_list)
+        print("Parsed %s variants with %s transcript annotations in %0.2f seconds (%0.1f us per variant)" % (
+            num_variants, num_transcripts, parse_time, 10**6 * parse_time / max(num_variants, 1)))
+
+        coding_gene_ids_list = [vep_annotations.get_coding_gene_ids(vep_annotation) for vep_annotation in vep_annotation_list]
+
+        def select_per_gene():
+            return [(
+                vep_annotations.get_worst_vep_annotation_index(vep_annotation),
+                {gene_id: vep_annotations.get_worst_vep_annotation_index(vep_annotation, gene_id=gene_id) for gene_id in gene_ids}
+            ) for vep_annotation, gene_ids in zip(vep_annotation_list, coding_gene_ids_list)]
+
+        def select_single_pass():
+            return [
+                vep_annotations.get_worst_vep_annotation_indexes(vep_annotation, gene_ids=gene_ids)
+                for vep_annotation, gene_ids in zip(vep_annotation_list, coding_gene_ids_list)
+            ]
+
+        results = {}
+        for name, select in [('per-gene', select_per_gene), ('single-pass', select_single_pass)]:
+            times = []
+            for _ in range(options['repeats']):
+                start = time.time()
+                results[name] = select()
+                times.append(time.time() - start)
+            print("%s selection: best of %s runs %0.2f seconds (%0.1f us per variant)" % (
+                name, options['repeats'], min(times), 10**6 * min(times) / max(num_variants, 1)))
+
+        if results['per-gene'] != results['single-pass']:
+            print("ERROR: per-gene and single-pass selection gave different results")
+        else:
+            print("Results match")
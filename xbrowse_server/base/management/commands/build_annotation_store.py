@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from xbrowse_server.base.models import Project
+from xbrowse_server import mall
+
+
+class Command(BaseCommand):
+    """Builds a read-only local annotation store file from the annotator's db.variants collection, or directly
+    from VEP-annotated VCFs. Set annotation_store_path in the annotator settings to use it."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_path', help="Path of the annotation store file to write")
+        parser.add_argument('--vcf', action='append', dest='vcf_file_paths', help="VEP-annotated VCF to read annotations from instead of db.variants. Can be specified more than once.")
+        parser.add_argument('--project', action='append', dest='project_ids', help="Read annotations from all VCFs in this project instead of db.variants. Can be specified more than once.")
+
+    def handle(self, *args, **options):
+        vcf_file_paths = list(options.get('vcf_file_paths') or [])
+        for project_id in options.get('project_ids') or []:
+            project = Project.objects.get(project_id=project_id)
+            vcf_file_paths += [vcf_file.path() for vcf_file in project.get_all_vcf_files()]
+
+        num_records = mall.get_annotator().build_local_annotation_store(options['output_path'], vcf_file_paths=vcf_file_paths or None)
+        print("Wrote %s variants to %s" % (num_records, options['output_path']))
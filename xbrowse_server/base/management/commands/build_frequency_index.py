@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from xbrowse_server import mall
+
+
+class Command(BaseCommand):
+    """Builds a read-only frequency index of the reference populations in the annotator's pop_variants collection.
+    Set frequency_index_path in the annotator settings to use it."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', help="Directory to write the frequency index to. Must not already contain an index.")
+        parser.add_argument('--float16', action='store_true', help="Store frequencies as float16 instead of float32 - half the size, with about 3 significant digits")
+
+    def handle(self, *args, **options):
+        dtype = 'float16' if options['float16'] else 'float32'
+        num_variants = mall.get_annotator().get_population_frequency_store().build_frequency_index(options['output_dir'], dtype=dtype)
+        print("Wrote %s variants to %s" % (num_variants, options['output_dir']))
@@ -43,16 +43,15 @@ class Command(BaseCommand):
                 else:
                     f = open(path)
                 if f:
-                    for variant in vcf_stuff.iterate_vcf(f):
+                    for xpos, ref, alt in vcf_stuff.scan_tuples(f):
                         all_counter += 1
                         try:
-                            get_mall(project).annotator.get_annotation(variant.xpos, variant.ref, variant.alt)
+                            get_mall(project).annotator.get_annotation(xpos, ref, alt)
                         except ValueError, e:
                             not_found_counter += 1
                             if len(not_found_variants) < 30:
-                                chrom, pos = genomeloc.get_chr_pos(variant.xpos)
+                                chrom, pos = genomeloc.get_chr_pos(xpos)
                                 chrom = chrom.replace("chr","")
-                                ref, alt = variant.ref, variant.alt
                                 not_found_variants.append("%(chrom)s-%(pos)s-%(ref)s-%(alt)s" % locals())
                             #print("WARNING: variant not found in annotator cache: " + str(e))
                             #if not_found_counter > 5:
@@ -82,6 +82,7 @@ class Command(BaseCommand):
                 }
                 print("Updated %(gene_id)s to %(phenotypes)s" % locals())
                 get_reference().update_phenotype_info(gene_id, phenotypes)
+        get_reference().refresh_phenotype_caches()
         print("Done. %d records updated" % len(get_reference().get_all_gene_ids()))
 
 """
@@ -8,6 +8,8 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('args', nargs='*')
+        parser.add_argument('--full', action='store_true', help="rewrite every annotation, instead of only reloading chromosomes and alleles that changed since the last reload")
+        parser.add_argument('--processes', type=int, default=1, help="load chromosomes in parallel using this many processes (requires tabix-indexed VCFs)")
 
     def handle(self, *args, **options):
         if not args:
@@ -24,6 +26,6 @@ class Command(BaseCommand):
                     print("VCF %s isn't annotated (eg. doesn't have a CSQ)" % str(vcf_obj.path()))
                 else:
                     print("Loading VCF %s with CSQ: %s" % (vcf_obj.path(), r.infos["CSQ"]))
-                mall.get_annotator().add_preannotated_vcf_file(vcf_obj.path(), force=True)
+                mall.get_annotator().add_preannotated_vcf_file(vcf_obj.path(), force=True, num_processes=options['processes'], incremental=not options['full'])
 
         print(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S  -- loading project: " + project_id + " - db.variants cache"))
@@ -22,8 +22,9 @@ def gene_search(request):
 def gene_info(request, gene_str):
 
     real_gene_id = get_gene_id_from_str(gene_str, get_reference())
-    gene = get_reference().get_gene(real_gene_id)
+    gene = dict(get_reference().get_gene(real_gene_id))
     gene['expression'] = get_reference().get_tissue_expression_display_values(real_gene_id)
+    gene['expression_summary'] = get_reference().get_tissue_expression_summary(real_gene_id)
     add_notes_to_genes([gene], request.user)
     gene_json = json.dumps(gene)
 
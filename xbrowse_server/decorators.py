@@ -37,7 +37,16 @@ def log_request(viewname):
                 settings.LOGGING_DB.pageviews.insert(d)
             except Exception:
                 logging.error("Error while logging request event: %s" % d)
-            return f(request, *args, **kwargs)
+
+            from xbrowse_server.mall import get_reference
+            reference = get_reference()
+            reference.reset_gene_lookup_counts()
+            response = f(request, *args, **kwargs)
+            gene_lookup_counts = reference.get_gene_lookup_counts()
+            if gene_lookup_counts['gene_lookups']:
+                logging.info("%s: %s gene lookups, %s from memo, %s db queries" % (
+                    viewname, gene_lookup_counts['gene_lookups'], gene_lookup_counts['memo_hits'], gene_lookup_counts['db_queries']))
+            return response
 
         return wrapper
 
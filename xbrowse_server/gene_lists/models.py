@@ -30,7 +30,9 @@ class GeneList(models.Model):
         return [g.gene_id for g in self.genelistitem_set.all()]
 
     def get_genes(self):
-        return [get_reference().get_gene(gene_id) for gene_id in self.gene_id_list()]
+        gene_id_list = self.gene_id_list()
+        genes = get_reference().get_genes(gene_id_list)
+        return [genes[gene_id] for gene_id in gene_id_list]
 
     def get_projects(self, user):
         """
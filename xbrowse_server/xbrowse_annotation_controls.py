@@ -2,6 +2,18 @@ import collections
 from xbrowse.core import genomeloc, constants
 from xbrowse.core.genomeloc import CHROMOSOMES, get_xpos
 from tqdm import tqdm
+import itertools
+import pymongo
+
+
+# dbNSFP fields returned by get_annotations_for_variants
+FIELDS_TO_INCLUDE = ['rsid', 'polyphen', 'sift', 'fathmm', 'muttaster']
+
+# number of distinct positions looked up in one query
+LOOKUP_BATCH_SIZE = 1000
+
+# number of documents per insert when loading dbNSFP
+BULK_INSERT_BATCH_SIZE = 10000
 
 class CustomAnnotator():
 
@@ -18,18 +30,25 @@ class CustomAnnotator():
         self._esp_target_filter = None
 
     def get_annotations_for_variants(self, variant_t_list):
+        """
+        Returns an OrderedDict that maps each (xpos, ref, alt) tuple in variant_t_list, in order, to a dict of
+        the dbNSFP fields. Fields are None for variants that aren't in dbNSFP.
+        """
+        # look up LOOKUP_BATCH_SIZE positions per query, in sorted order so each batch covers one narrow
+        # range of the (xpos, ref, alt) index
+        found = {}
+        xpos_list = sorted({variant_t[0] for variant_t in variant_t_list})
+        for i in range(0, len(xpos_list), LOOKUP_BATCH_SIZE):
+            cursor = self._db.variants.find(
+                {'xpos': {'$in': xpos_list[i:i+LOOKUP_BATCH_SIZE]}},
+                projection=dict({'_id': False, 'xpos': True, 'ref': True, 'alt': True}, **{name: True for name in FIELDS_TO_INCLUDE}))
+            for doc in cursor:
+                found[(doc['xpos'], doc['ref'], doc['alt'])] = doc
 
-        # start with an empty ordereddict - add each variant as we look it up in the database
         ret = collections.OrderedDict()
-        fields_to_include = ['rsid', 'polyphen', 'sift', 'fathmm', 'muttaster']
         for variant_t in variant_t_list:
-            doc = self._db.variants.find_one({'xpos': variant_t[0], 'ref': variant_t[1], 'alt': variant_t[2]})
-
-            d = {name: None for name in fields_to_include}
-            if doc:
-                d = {name: doc.get(name) for name in fields_to_include}
-
-            ret[variant_t] = d
+            doc = found.get(variant_t, {})
+            ret[variant_t] = {name: doc.get(name) for name in FIELDS_TO_INCLUDE}
 
         return ret
 
@@ -38,8 +57,8 @@ class CustomAnnotator():
 
 
     def load_dbnsfp(self):
+        # the index is built once at the end - that's much faster than updating it for every insert
         self._db.drop_collection('variants')
-        self._db.variants.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)])
 
         # load dbnsfp info
         polyphen_map = {
@@ -85,16 +104,24 @@ class CustomAnnotator():
                     i = r
             return pred_rank[i]
 
-        for chrom in CHROMOSOMES:
-            if chrom == "chrM":
-                continue  # no dbNSFP data for chrM
-
-            print "Reading dbNSFP data for {}".format(chrom)
-            single_chrom_file = open(self._settings.dbnsfp_dir[self._genome_version] + 'dbNSFP2.9_variant.' + chrom)
-            header = single_chrom_file.readline()
-            header_fields = header.strip("\n").split()
-            field_index = {name: header_fields.index(name) for name in header_fields}
-
+        def iterate_unique_dbnsfp_docs(single_chrom_file, field_index):
+            """
+            Merges the rows for the same variant, with later rows winning as they did with per-row upserts.
+            dbNSFP files are sorted by position, so only the rows at one position need to be held at a time.
+            """
+            previous_xpos = None
+            for xpos, docs in itertools.groupby(iterate_dbnsfp_docs(single_chrom_file, field_index), key=lambda doc: doc['xpos']):
+                if previous_xpos is not None and xpos < previous_xpos:
+                    raise ValueError("dbNSFP file %s isn't sorted by position" % single_chrom_file.name)
+                previous_xpos = xpos
+
+                docs_by_variant = collections.OrderedDict()
+                for doc in docs:
+                    docs_by_variant.setdefault((doc['ref'], doc['alt']), {}).update(doc)
+                for doc in docs_by_variant.values():
+                    yield doc
+
+        def iterate_dbnsfp_docs(single_chrom_file, field_index):
             for i, line in tqdm(enumerate(single_chrom_file)):
                 if i == 0:
                     continue
@@ -107,7 +134,10 @@ class CustomAnnotator():
                     raise ValueError("Unexpected chr, pos: %(chrom)s, %(pos)s" % (chrom, pos))
 
                 rsid = fields[field_index["rs_dbSNP141"]]
-                annotations_dict = {
+                yield {
+                    'xpos': xpos,
+                    'ref': ref,
+                    'alt': alt,
                     'rsid': rsid if rsid != '.' else None,
                     'polyphen': polyphen_map[select_worst(fields[field_index["Polyphen2_HVAR_pred"]])],
                     'sift': sift_map[select_worst(fields[field_index["SIFT_pred"]])],
@@ -117,8 +147,23 @@ class CustomAnnotator():
                     #'cadd_phred': collapse(fields[field_index["CADD_phred"]]),
                 }
 
-                self._db.variants.update(
-                    {'xpos': xpos, 'ref': ref, 'alt': alt},
-                    {'$set': annotations_dict},
-                    upsert=True
-                )
+        for chrom in CHROMOSOMES:
+            if chrom == "chrM":
+                continue  # no dbNSFP data for chrM
+
+            print "Reading dbNSFP data for {}".format(chrom)
+            single_chrom_file = open(self._settings.dbnsfp_dir[self._genome_version] + 'dbNSFP2.9_variant.' + chrom)
+            header = single_chrom_file.readline()
+            header_fields = header.strip("\n").split()
+            field_index = {name: header_fields.index(name) for name in header_fields}
+
+            docs = iterate_unique_dbnsfp_docs(single_chrom_file, field_index)
+            while True:
+                chunk = list(itertools.islice(docs, 0, BULK_INSERT_BATCH_SIZE))
+                if len(chunk) == 0:
+                    break
+                self._db.variants.bulk_write(list(map(pymongo.InsertOne, chunk)), ordered=False)
+            single_chrom_file.close()
+
+        print "Creating index"
+        self._db.variants.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)], unique=True)